@@ -0,0 +1,311 @@
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timezone
+from django.conf import settings
+from .pagination import CARBON_SOURCE_KEY, EMISSION_FACTOR_KEY, row_key
+from .read_cache import ReadCache
+from .shared_catalog import SharedCatalog
+from .supabase_client import storage_backend, supabase_client
+
+# Factor used when neither the source nor its category has one for the date
+DEFAULT_FACTOR = 1.0
+DEFAULT_UNIT = 'unit'
+
+CATALOGS = ('emission_factors', 'carbon_sources')
+
+# Carbon source columns kept in the catalog; these are also the public columns of the source views
+SOURCE_COLUMNS = 'uid, name, description, source_type, created_at, updated_at'
+
+
+class EmissionFactorRegistry:
+    """
+    Process-level cache of carbon sources and their emission factors.
+
+    The catalogs are loaded in full and kept in memory; the database version stamps
+    (catalog_versions, bumped by triggers on every write) are re-checked at most every
+    ``check_interval`` seconds and the catalogs are reloaded only when a stamp moved,
+    so resolving a factor is a pure in-memory lookup.
+
+    With a ``shared`` SharedCatalog, worker processes on a host share the loading of the
+    catalogs: whichever worker finds the last check too old queries the stamps (and
+    reloads if they moved) and publishes the result, and the others pick it up from
+    shared memory instead of querying the database themselves. Each worker still keeps
+    its own decoded copy of the catalogs in memory.
+    """
+
+    def __init__(self, client, check_interval=30, page_size=1000, shared=None):
+        self.client = client
+        self.check_interval = check_interval
+        self.page_size = page_size
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._sources = {}  # source uid -> source row
+        self._source_index = ([], [])  # (sort keys, source rows) in (created_at, uid) order
+        self._by_source = {}  # source uid -> (valid_from list, factor rows), sorted by valid_from
+        self._by_category = {}  # category -> (valid_from list, factor rows), sorted by valid_from
+        self._versions = None
+        self._checked_at = None
+        self._stale = False
+        self._generation = 0
+        self.loaded_at = None
+        self.reloads = 0
+
+    def get_source(self, source_uid):
+        """Return the cached carbon source row, or None if there is no such source.
+
+        An unknown UID forces a version check (rate limited to once a second), so a
+        source created by another process is picked up without waiting for the interval.
+        """
+        self.refresh()
+        source = self._sources.get(str(source_uid))
+        if source is None and self._checked_at is not None and time.monotonic() - self._checked_at >= 1:
+            self.refresh(force=True)
+            source = self._sources.get(str(source_uid))
+        return source
+
+    def resolve(self, source, on_date=None):
+        """Return (factor, unit, origin) for a source row on a date (today by default).
+
+        A factor set for the source itself wins over one for its category; origin is
+        'source', 'category' or 'default'.
+        """
+        self.refresh()
+        on_date = on_date or date.today()
+        for origin, table, key in (('source', self._by_source, str(source['uid'])),
+                                   ('category', self._by_category, source.get('source_type'))):
+            row = self._valid_on(table.get(key), on_date)
+            if row:
+                return row['factor'], row['unit'], origin
+        return DEFAULT_FACTOR, DEFAULT_UNIT, 'default'
+
+    def factor_timeline(self, source):
+        """Return (boundaries, factors) describing a source's factor as a step function of date.
+
+        factors[0] applies before boundaries[0] and factors[i] from boundaries[i - 1] up to
+        boundaries[i], so numpy.searchsorted(boundaries, dates, side='right') maps record
+        dates to their factors in one vectorized call.
+        """
+        self.refresh()
+        boundaries = set()
+        for entry in (self._by_source.get(str(source['uid'])), self._by_category.get(source.get('source_type'))):
+            for row in (entry[1] if entry else ()):
+                boundaries.update(bound for bound in (row['valid_from'], row['valid_to']) if bound is not None)
+        boundaries = sorted(boundaries)
+        factors = [self.resolve(source, start)[0] for start in [date.min] + boundaries]
+        return boundaries, factors
+
+    def sources(self):
+        """Return every cached carbon source row"""
+        self.refresh()
+        return list(self._sources.values())
+
+    def source_page(self, limit, after=None):
+        """Return up to ``limit`` cached source rows in (created_at, uid) order after the sort key ``after``.
+
+        Raises ValueError if ``after`` is not a valid carbon source sort key.
+        """
+        self.refresh()
+        keys, rows = self._source_index
+        start = 0
+        if after is not None:
+            try:
+                start = bisect_right(keys, (self._parse_timestamp(after[0]), str(after[1])))
+            except (TypeError, ValueError):
+                raise ValueError('Invalid cursor')
+        return rows[start:start + limit]
+
+    def catalog_version(self, name):
+        """Return the version stamp of a catalog, re-checked at most every check_interval seconds"""
+        self.refresh()
+        return (self._versions or {}).get(name)
+
+    def factors(self):
+        """Return every cached factor row"""
+        self.refresh()
+        by_source, by_category = self._by_source, self._by_category
+        return [row for _, rows in list(by_source.values()) + list(by_category.values()) for row in rows]
+
+    def invalidate(self):
+        """Force a version check on the next lookup, e.g. right after this process changed a source"""
+        with self._lock:
+            self._checked_at = None
+            self._stale = True
+
+    def refresh(self, force=False):
+        """Reload the catalogs if the check interval elapsed and a version stamp changed"""
+        now = time.monotonic()
+        if not force and not self._stale and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            force = force or self._stale
+            if not force and self._checked_at is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return
+            if self.shared is None:
+                self._check_versions()
+            else:
+                self._refresh_shared(force)
+            self._checked_at = time.monotonic()
+            self._stale = False
+
+    def stats(self):
+        """Return cache state counters"""
+        return {
+            'versions': self._versions,
+            'sources': len(self._sources),
+            'factors': sum(len(rows) for _, rows in list(self._by_source.values()) + list(self._by_category.values())),
+            'reloads': self.reloads,
+            'loaded_at': self.loaded_at,
+            'shared_generation': self._generation if self.shared is not None else None
+        }
+
+    def _check_versions(self):
+        """Query the version stamps and reload if they moved; returns whether the catalogs were reloaded"""
+        response = self.client.get_catalog_versions(CATALOGS)
+        versions = {row['name']: row['version'] for row in response.data or []}
+        if versions != self._versions or self.loaded_at is None:
+            self._load()
+            self._versions = versions
+            return True
+        return False
+
+    def _refresh_shared(self, force):
+        """Adopt the shared snapshot if it is recent enough, otherwise check the database and publish.
+
+        A forced refresh only accepts a check that started after it was requested, so a write
+        this process just made is never hidden by an older snapshot.
+        """
+        fresh_after = time.time() if force else time.time() - self.check_interval
+        if self._adopt_shared(fresh_after):
+            return
+        with self.shared.lock():
+            # Another worker may have refreshed the snapshot while this one waited for the lock
+            if self._adopt_shared(fresh_after):
+                return
+            checked_at = time.time()
+            if self._check_versions() or self.shared.header()[0] == 0:
+                self.shared.publish(self._snapshot(), checked_at)
+                # Serve the decoded snapshot like every other worker, so all of them return identical rows
+                self._adopt_shared(fresh_after)
+            else:
+                self.shared.touch(checked_at)
+
+    def _adopt_shared(self, fresh_after):
+        """Install the shared snapshot if it changed; returns whether it was checked after fresh_after"""
+        generation, checked_at, snapshot = self.shared.read(self._generation)
+        if snapshot is not None:
+            self._install(snapshot)
+            self._generation = generation
+        return generation != 0 and checked_at >= fresh_after
+
+    def _snapshot(self):
+        """Return the cached catalogs as JSON-ready rows for publishing to other workers"""
+        return {
+            'versions': self._versions,
+            'sources': self._sources,
+            'factors': [row for grouped in (self._by_source, self._by_category) for _, rows in grouped.values() for row in rows],
+            'loaded_at': self.loaded_at
+        }
+
+    def _install(self, snapshot):
+        """Swap in catalogs decoded from a shared snapshot; the caller must hold the lock"""
+        by_source, by_category = self._group_factors(snapshot['factors'])
+        self._versions = snapshot['versions']
+        self._sources = snapshot['sources']
+        self._source_index = self._order_sources(self._sources)
+        self._by_source = self._index(by_source)
+        self._by_category = self._index(by_category)
+        self.loaded_at = snapshot['loaded_at']
+
+    def _load(self):
+        """Load both catalogs in keyset pages and swap them in; the caller must hold the lock"""
+        sources = {
+            str(row['uid']): row
+            for row in self._pages(self.client.list_carbon_sources, CARBON_SOURCE_KEY, columns=SOURCE_COLUMNS)
+        }
+        by_source, by_category = self._group_factors(self._pages(self.client.list_emission_factors, EMISSION_FACTOR_KEY))
+
+        self._sources = sources
+        self._source_index = self._order_sources(sources)
+        self._by_source = self._index(by_source)
+        self._by_category = self._index(by_category)
+        self.loaded_at = time.time()
+        self.reloads += 1
+
+    def _pages(self, list_method, key_columns, **kwargs):
+        """Yield every row of a catalog, one keyset page at a time"""
+        after = None
+        while True:
+            rows = list_method(limit=self.page_size, after=after, **kwargs).data or []
+            yield from rows
+            if len(rows) < self.page_size:
+                return
+            after = row_key(rows[-1], key_columns)
+
+    def _group_factors(self, rows):
+        """Parse the validity bounds of factor rows and group them by source uid and by category"""
+        by_source, by_category = {}, {}
+        for row in rows:
+            row['valid_from'] = self._parse_date(row.get('valid_from'))
+            row['valid_to'] = self._parse_date(row.get('valid_to'))
+            if row.get('source_uid') is not None:
+                by_source.setdefault(str(row['source_uid']), []).append(row)
+            else:
+                by_category.setdefault(row['category'], []).append(row)
+        return by_source, by_category
+
+    def _order_sources(self, sources):
+        """Sort source rows by their (created_at, uid) keyset for bisecting"""
+        keyed = sorted(((self._parse_timestamp(row.get('created_at')), uid), row) for uid, row in sources.items())
+        return [key for key, _ in keyed], [row for _, row in keyed]
+
+    def _index(self, grouped):
+        """Sort each group of factor rows by valid_from for bisecting"""
+        index = {}
+        for key, rows in grouped.items():
+            rows.sort(key=lambda row: row['valid_from'] or date.min)
+            index[key] = ([row['valid_from'] or date.min for row in rows], rows)
+        return index
+
+    def _valid_on(self, entry, on_date):
+        """Return the factor row in effect on a date: the latest-starting one whose range covers it"""
+        if not entry:
+            return None
+        starts, rows = entry
+        for position in range(bisect_right(starts, on_date) - 1, -1, -1):
+            row = rows[position]
+            if row['valid_to'] is None or on_date < row['valid_to']:
+                return row
+        return None
+
+    def _parse_date(self, value):
+        """Parse an optional date column, which PostgREST returns as a string"""
+        if value is None or isinstance(value, date):
+            return value
+        return date.fromisoformat(value)
+
+    def _parse_timestamp(self, value):
+        """Parse a timestamp column or cursor value to an aware datetime so every backend sorts alike (nulls last)"""
+        if value is None:
+            return datetime.max.replace(tzinfo=timezone.utc)
+        if not isinstance(value, datetime):
+            value = datetime.fromisoformat(value)
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def create_shared_catalog():
+    """Return the SharedCatalog configured by CATALOG_SHARED_CACHE_PATH, or None to keep catalogs per process"""
+    path = getattr(settings, 'CATALOG_SHARED_CACHE_PATH', None)
+    if not path or not SharedCatalog.available():
+        return None
+    return SharedCatalog(path)
+
+# Global instance; it reads the uncached backend since it tracks catalog versions itself
+emission_factor_registry = EmissionFactorRegistry(
+    storage_backend,
+    check_interval=getattr(settings, 'EMISSION_FACTOR_CHECK_INTERVAL', 30),
+    shared=create_shared_catalog()
+)
+
+# Never serve cached carbon sources older than the registry's version stamp
+if isinstance(supabase_client, ReadCache):
+    supabase_client.watch('carbon_sources', lambda: emission_factor_registry.catalog_version('carbon_sources'))
@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from .supabase_client import supabase_client, async_supabase_client
+
+
+class IdentityResolver:
+    """
+    Resolve an email to its user_id and profile_id with a bounded LRU + TTL cache
+    """
+
+    def __init__(self, client, async_client=None, max_entries=10000, ttl=300):
+        self.client = client
+        self.async_client = async_client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # email or ('user', user_id) -> [expires_at, user_id, profile_id]
+        self._emails_by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def resolve(self, email, with_profile=False):
+        """Return (user_id, profile_id) for an email, or (None, None) if the user does not exist.
+
+        The profile is only looked up when ``with_profile`` is set; profile_id is None
+        when it was not requested or the user has no profile yet.
+        """
+        cached, user_id, profile_id = self._lookup(email, with_profile)
+        if cached:
+            return user_id, profile_id
+
+        if user_id is None:
+            user_response = self.client.get_user_account_by_email(email, columns='id')
+            if not user_response.data:
+                return None, None
+            user_id = user_response.data[0]['id']
+
+        if with_profile:
+            profile_response = self.client.get_user_profile(user_id, columns='id')
+            if profile_response.data:
+                profile_id = profile_response.data[0]['id']
+
+        self.remember(email, user_id, profile_id)
+        return user_id, profile_id
+
+    async def aresolve(self, email, with_profile=False):
+        """Async variant of resolve() that queries through the async client on a miss"""
+        cached, user_id, profile_id = self._lookup(email, with_profile)
+        if cached:
+            return user_id, profile_id
+
+        if user_id is None:
+            user_response = await self.async_client.get_user_account_by_email(email, columns='id')
+            if not user_response.data:
+                return None, None
+            user_id = user_response.data[0]['id']
+
+        if with_profile:
+            profile_response = await self.async_client.get_user_profile(user_id, columns='id')
+            if profile_response.data:
+                profile_id = profile_response.data[0]['id']
+
+        self.remember(email, user_id, profile_id)
+        return user_id, profile_id
+
+    def resolve_request(self, request, email, with_profile=False):
+        """resolve() for a request, answered from its session token when it carries one.
+
+        A token's user is never looked up by email, which may have changed since the token
+        was issued; a profile missing from the token is looked up by the token's user id and
+        cached under ``('user', user_id)``.
+        """
+        identity = getattr(request, 'identity', None)
+        if not identity:
+            return self.resolve(email, with_profile)
+        if not with_profile or identity.profile_id is not None:
+            return identity.user_id, identity.profile_id
+
+        key = ('user', identity.user_id)
+        cached, _, profile_id = self._lookup(key, with_profile=True)
+        if not cached:
+            profile_response = self.client.get_user_profile(identity.user_id, columns='id')
+            if profile_response.data:
+                profile_id = profile_response.data[0]['id']
+                self.remember(key, identity.user_id, profile_id)
+        return identity.user_id, profile_id
+
+    async def aresolve_request(self, request, email, with_profile=False):
+        """Async variant of resolve_request()"""
+        identity = getattr(request, 'identity', None)
+        if not identity:
+            return await self.aresolve(email, with_profile)
+        if not with_profile or identity.profile_id is not None:
+            return identity.user_id, identity.profile_id
+
+        key = ('user', identity.user_id)
+        cached, _, profile_id = self._lookup(key, with_profile=True)
+        if not cached:
+            profile_response = await self.async_client.get_user_profile(identity.user_id, columns='id')
+            if profile_response.data:
+                profile_id = profile_response.data[0]['id']
+                self.remember(key, identity.user_id, profile_id)
+        return identity.user_id, profile_id
+
+    def remember(self, email, user_id, profile_id=None):
+        """Cache an identity, e.g. right after a profile has been created"""
+        with self._lock:
+            self._remove(email)
+            self._entries[email] = [time.monotonic() + self.ttl, user_id, profile_id]
+            self._emails_by_user.setdefault(user_id, set()).add(email)
+            while len(self._entries) > self.max_entries:
+                oldest_email = next(iter(self._entries))
+                self._remove(oldest_email)
+                self.evictions += 1
+
+    def invalidate_email(self, email):
+        """Drop the cached identity for an email"""
+        with self._lock:
+            self._remove(email)
+
+    def invalidate_user(self, user_id):
+        """Drop every cached identity that points at a user"""
+        with self._lock:
+            for email in list(self._emails_by_user.get(user_id, ())):
+                self._remove(email)
+
+    def clear(self):
+        """Drop all cached identities"""
+        with self._lock:
+            self._entries.clear()
+            self._emails_by_user.clear()
+
+    def stats(self):
+        """Return cache hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+    def _lookup(self, email, with_profile):
+        """Return (cached, user_id, profile_id), counting the lookup as a hit or a miss.
+
+        On a miss user_id is still filled in when only the profile is missing from the entry.
+        """
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry and entry[0] <= time.monotonic():
+                self._remove(email)
+                entry = None
+            if entry and (not with_profile or entry[2] is not None):
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return True, entry[1], entry[2]
+            self.misses += 1
+            return False, entry[1] if entry else None, None
+
+    def _remove(self, email):
+        """Remove a cache entry; the caller must hold the lock"""
+        entry = self._entries.pop(email, None)
+        if entry:
+            emails = self._emails_by_user.get(entry[1])
+            if emails:
+                emails.discard(email)
+                if not emails:
+                    del self._emails_by_user[entry[1]]
+
+def request_email(request, email=None):
+    """Return the email a request acts for: the signed-in user's when it carries a session token, else ``email``.
+
+    The token's email may have changed since it was issued, so writes key on request_user_id() instead.
+    """
+    identity = getattr(request, 'identity', None)
+    return identity.email if identity else email
+
+def request_user_id(request):
+    """Return the user id of the session token a request carries, or None when it has none"""
+    identity = getattr(request, 'identity', None)
+    return identity.user_id if identity else None
+
+# Global instance
+identity_resolver = IdentityResolver(
+    supabase_client,
+    async_supabase_client,
+    max_entries=getattr(settings, 'IDENTITY_CACHE_MAX_ENTRIES', 10000),
+    ttl=getattr(settings, 'IDENTITY_CACHE_TTL', 300)
+)
@@ -0,0 +1,151 @@
+import inspect
+import re
+import time
+from collections import namedtuple
+from contextvars import ContextVar
+from .metrics import metrics
+
+# One backend call made while serving a request
+BackendCall = namedtuple('BackendCall', ['table', 'operation', 'filters', 'rows', 'duration_ms', 'error'])
+
+# PostgREST request builder methods that pick the operation, and the filters worth recording
+OPERATIONS = {'select', 'insert', 'upsert', 'update', 'delete'}
+FILTERS = {
+    'eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'like', 'ilike', 'is_', 'in_', 'contains',
+    'contained_by', 'match', 'filter', 'or_', 'not_', 'text_search', 'range_gte', 'range_lte',
+}
+
+SQL_TABLE_RE = re.compile(r'\b(?:from|into|update|join)\s+"?(\w+)"?', re.IGNORECASE)
+SQL_OPERATION_RE = re.compile(r'^\s*(\w+)')
+# Transaction control statements carry no table and are not recorded
+TRANSACTION_STATEMENTS = {'begin', 'commit', 'rollback', 'savepoint', 'release'}
+
+_calls = ContextVar('backend_calls', default=None)
+
+
+def start_request():
+    """Start collecting backend calls for the current request; returns (calls, token for end_request)"""
+    calls = []
+    return calls, _calls.set(calls)
+
+
+def end_request(token):
+    """Stop collecting backend calls for the request started with this token"""
+    _calls.reset(token)
+
+
+def record_call(table, operation, filters, rows, duration, error=False):
+    """Record a backend call in the process metrics and against the current request, if any"""
+    labels = (('table', table), ('operation', operation))
+    metrics.increment('backend_calls_total', labels)
+    if error:
+        metrics.increment('backend_call_errors_total', labels)
+    metrics.observe('backend_call_duration_seconds', (('table', table),), duration)
+    calls = _calls.get()
+    if calls is not None:
+        calls.append(BackendCall(table, operation, tuple(filters), rows, duration * 1000, error))
+
+
+def record_sql(sql, rows, duration, error=False):
+    """Record a SQL statement, taking the table and operation from its text"""
+    operation = SQL_OPERATION_RE.match(sql)
+    operation = operation.group(1).lower() if operation else 'sql'
+    if operation in TRANSACTION_STATEMENTS:
+        return
+    table = SQL_TABLE_RE.search(sql)
+    record_call(
+        table.group(1) if table else '-',
+        operation,
+        (),
+        rows,
+        duration,
+        error
+    )
+
+
+def _row_count(response):
+    """Number of rows in a PostgREST response"""
+    data = getattr(response, 'data', None)
+    if isinstance(data, list):
+        return len(data)
+    return 0 if data is None else 1
+
+
+class InstrumentedBuilder:
+    """
+    Wrapper around a PostgREST request builder that records its table, operation,
+    filtered columns (never values), row count and latency when it is executed.
+    Works for both sync and async builders.
+    """
+
+    def __init__(self, builder, table, operation='select', filters=()):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+        self._filters = filters
+
+    def __getattr__(self, name):
+        attribute = getattr(self._builder, name)
+        if name == 'execute':
+            return self._execute(attribute)
+        if not callable(attribute):
+            # e.g. the not_ property, which returns the builder with the next filter negated
+            return self._wrap(name, attribute, ()) if hasattr(attribute, 'execute') else attribute
+
+        def chained(*args, **kwargs):
+            return self._wrap(name, attribute(*args, **kwargs), args)
+        return chained
+
+    def _wrap(self, name, result, args):
+        """Wrap a builder returned by a chained call, noting the operation or filter it added"""
+        if not hasattr(result, 'execute'):
+            return result
+        operation, filters = self._operation, self._filters
+        if name in OPERATIONS:
+            operation = name
+        elif name in FILTERS:
+            column = args[0] if args and isinstance(args[0], str) and name not in ('or_', 'match') else ''
+            filters = filters + (f'{name.rstrip("_")}:{column}' if column else name.rstrip('_'),)
+        return InstrumentedBuilder(result, self._table, operation, filters)
+
+    def _execute(self, execute):
+        def timed_execute(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = execute(*args, **kwargs)
+            except Exception:
+                record_call(self._table, self._operation, self._filters, 0, time.perf_counter() - start, error=True)
+                raise
+            if inspect.isawaitable(result):
+                return self._finish_async(result, start)
+            record_call(self._table, self._operation, self._filters, _row_count(result), time.perf_counter() - start)
+            return result
+        return timed_execute
+
+    async def _finish_async(self, awaitable, start):
+        try:
+            response = await awaitable
+        except Exception:
+            record_call(self._table, self._operation, self._filters, 0, time.perf_counter() - start, error=True)
+            raise
+        record_call(self._table, self._operation, self._filters, _row_count(response), time.perf_counter() - start)
+        return response
+
+
+class InstrumentedClient:
+    """Wrapper around a (sync or async) Supabase client whose table and rpc builders are instrumented"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return InstrumentedBuilder(self._client.table(name), name)
+
+    def from_(self, name):
+        return InstrumentedBuilder(self._client.from_(name), name)
+
+    def rpc(self, fn, *args, **kwargs):
+        return InstrumentedBuilder(self._client.rpc(fn, *args, **kwargs), fn, 'rpc')
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,411 @@
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import json
+import logging
+import os
+import platform
+import random
+import re
+import threading
+import time
+import uuid
+import numpy as np
+
+SERVER_TIMING_BACKEND_RE = re.compile(r'backend;desc="(\d+) calls";dur=([\d.]+)')
+CATEGORIES = ('Travel', 'Dining & Shopping', 'Utility & Bills')
+PASSWORD = 'benchmark'
+RECORD_START = date(2024, 1, 1)
+# Sources every seeded user starts with; add_source_to_user links the ones after them
+LINKED_SOURCES = 3
+
+
+async def _drain(streaming_content):
+    """Consume an async streaming response body"""
+    return b''.join([chunk async for chunk in streaming_content])
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every API endpoint against the in-memory Supabase stand-in: throughput, '
+        'p50/p99 latency and backend round trips per endpoint, optionally compared with a stored baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint (default 200)')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per endpoint before measuring (default 10)')
+        parser.add_argument('--concurrency', type=int, default=1, help='Client threads sending requests (default 1)')
+        parser.add_argument(
+            '--latency-ms', type=float,
+            help='Simulated latency per backend round trip. Defaults to MEMORY_BACKEND_LATENCY_MS'
+        )
+        parser.add_argument('--endpoint', action='append', help='Only run endpoints whose label contains this text (repeatable)')
+        parser.add_argument('--users', type=int, default=50, help='Seeded users (default 50)')
+        parser.add_argument('--sources', type=int, default=20, help='Seeded carbon sources (default 20)')
+        parser.add_argument('--records-per-user', type=int, default=200, help='Seeded carbon records per user (default 200)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the seeded data (default 0)')
+        parser.add_argument(
+            '--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'),
+            help='Baseline to compare with, if the file exists (default benchmarks/baseline.json)'
+        )
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the results to PATH as the new baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=25,
+            help='Percent p50 slowdown against the baseline reported as a regression (default 25)'
+        )
+        parser.add_argument(
+            '--fail-on-regression', action='store_true',
+            help='Exit with an error if any endpoint regressed: more round trips or a p50 beyond --tolerance'
+        )
+
+    def handle(self, *args, **options):
+        if settings.STORAGE_BACKEND != 'memory':
+            raise CommandError(
+                'The benchmark writes to the database and only runs on the in-memory backend.\n'
+                'Run it with STORAGE_BACKEND=memory.'
+            )
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1')
+
+        from django.test.utils import setup_test_environment, teardown_test_environment
+        from api.supabase_client import storage_backend
+        from api.memory_backend import memory_database
+
+        memory_database.latency = 0
+        memory_database.reset()
+        fixture = self.seed(storage_backend, options)
+        self.stdout.write(
+            f'Seeded {options["users"]} users, {options["sources"]} sources and '
+            f'{options["users"] * options["records_per_user"]} carbon records'
+        )
+
+        latency_ms = options['latency_ms'] if options['latency_ms'] is not None else settings.MEMORY_BACKEND_LATENCY_MS
+        memory_database.latency = latency_ms / 1000
+
+        scenarios = self.scenarios(storage_backend, fixture)
+        if options['endpoint']:
+            scenarios = [s for s in scenarios if any(text in s['label'] for text in options['endpoint'])]
+            if not scenarios:
+                raise CommandError('No endpoint matches --endpoint')
+
+        # Request logs would dominate the output; the log lines are still built, so their cost is measured
+        quiet = {name: logging.getLogger(name) for name in ('api.requests', 'django.request')}
+        levels = {name: logger.level for name, logger in quiet.items()}
+        for logger in quiet.values():
+            logger.setLevel(logging.ERROR)
+        setup_test_environment()
+        try:
+            results = {}
+            for scenario in scenarios:
+                results[scenario['label']] = self.run_scenario(scenario, options)
+        finally:
+            teardown_test_environment()
+            for name, logger in quiet.items():
+                logger.setLevel(levels[name])
+            memory_database.latency = settings.MEMORY_BACKEND_LATENCY_MS / 1000
+
+        report = {
+            'settings': {
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'latency_ms': latency_ms,
+                'users': options['users'],
+                'sources': options['sources'],
+                'records_per_user': options['records_per_user'],
+                'async_views': settings.ASYNC_VIEWS,
+                'python': platform.python_version(),
+            },
+            'endpoints': results
+        }
+
+        baseline = self.load_baseline(options['baseline'], report['settings'])
+        regressions = self.print_report(results, baseline, options['tolerance'])
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['save_baseline'])), exist_ok=True)
+            with open(options['save_baseline'], 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+                file.write('\n')
+            self.stdout.write(f'Baseline written to {options["save_baseline"]}')
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} endpoint(s) regressed: {", ".join(regressions)}')
+
+    def seed(self, backend, options):
+        """Create the users, profiles, sources, links and carbon records the scenarios read"""
+        rng = random.Random(options['seed'])
+        sources = []
+        for index in range(options['sources']):
+            uid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            backend.create_carbon_source({
+                'uid': uid,
+                'name': f'Benchmark source {index}',
+                'description': 'Seeded by the benchmark command',
+                'source_type': CATEGORIES[index % len(CATEGORIES)]
+            })
+            sources.append(uid)
+        # source_detail routes take integer ids
+        numeric_source = '900000'
+        backend.create_carbon_source({
+            'uid': numeric_source, 'name': 'Benchmark numeric source', 'description': '', 'source_type': CATEGORIES[0]
+        })
+
+        users = []
+        for index in range(options['users']):
+            account = backend.create_user_account({
+                'username': f'bench-user-{index}',
+                'email': f'bench-user-{index}@example.com',
+                'password_hash': PASSWORD,
+                'first_name': 'Bench',
+                'last_name': str(index)
+            }).data[0]
+            backend.create_user_profile({'user_id': account['id']})
+            for source_uid in sources[:LINKED_SOURCES]:
+                backend.add_source_to_user(account['email'], source_uid)
+            records = [
+                {
+                    'uid': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                    'user_id': account['id'],
+                    'source_uid': rng.choice(sources[:LINKED_SOURCES]),
+                    'amount': round(rng.uniform(0.5, 50), 2),
+                    'date': (RECORD_START + timedelta(days=rng.randrange(365))).isoformat()
+                }
+                for _ in range(options['records_per_user'])
+            ]
+            for start in range(0, len(records), 1000):
+                backend.upsert_carbon_records(records[start:start + 1000])
+            users.append(account)
+
+        return {'users': users, 'sources': sources, 'numeric_source': numeric_source}
+
+    def scenarios(self, backend, fixture):
+        """One scenario per endpoint and method; reads first, then writes, then deletes"""
+        from api.tokens import issue_token
+
+        users, sources = fixture['users'], fixture['sources']
+        user = lambda i: users[i % len(users)]
+        email = lambda i: user(i)['email']
+        # A (user, source) pair not linked yet for every request index
+        pair = lambda i: (email(i), sources[LINKED_SOURCES + (i // len(users)) % max(len(sources) - LINKED_SOURCES, 1)])
+        timeframe = {'start_date': '2024-01-01', 'end_date': '2024-12-31'}
+
+        def throwaway_users(count):
+            return [
+                backend.create_user_account({
+                    'username': f'bench-delete-{uuid.uuid4().hex}', 'email': f'{uuid.uuid4().hex}@example.com',
+                    'password_hash': PASSWORD
+                }).data[0]['id']
+                for _ in range(count)
+            ]
+
+        def throwaway_sources(count):
+            start = 910000
+            for index in range(count):
+                backend.create_carbon_source({
+                    'uid': str(start + index), 'name': f'Benchmark delete {index}', 'description': '', 'source_type': CATEGORIES[0]
+                })
+            return [start + index for index in range(count)]
+
+        def tokens(count):
+            return [issue_token(user(i)['id'], None, email(i)) for i in range(count)]
+
+        def records(i):
+            rng = random.Random(i)
+            return [
+                {
+                    'source_uid': sources[index % LINKED_SOURCES],
+                    'amount': round(rng.uniform(0.5, 50), 2),
+                    'date': (RECORD_START + timedelta(days=rng.randrange(365))).isoformat()
+                }
+                for index in range(100)
+            ]
+
+        return [
+            # Reads
+            {'label': 'GET api_root', 'method': 'get', 'path': lambda i, _: '/api/'},
+            {'label': 'GET health_check', 'method': 'get', 'path': lambda i, _: '/api/health/'},
+            {'label': 'GET metrics', 'method': 'get', 'path': lambda i, _: '/api/metrics/'},
+            {'label': 'GET accounts:user_list', 'method': 'get', 'path': lambda i, _: '/api/accounts/users/?limit=50'},
+            {'label': 'GET accounts:user_detail', 'method': 'get', 'path': lambda i, _: f'/api/accounts/users/{user(i)["id"]}/'},
+            {
+                'label': 'POST accounts:user_login', 'method': 'post', 'path': lambda i, _: '/api/accounts/login/',
+                'body': lambda i, _: {'username': user(i)['username'], 'password': PASSWORD}
+            },
+            {'label': 'GET sources:source_list', 'method': 'get', 'path': lambda i, _: '/api/sources/?limit=100'},
+            {'label': 'GET sources:source_detail', 'method': 'get', 'path': lambda i, _: f'/api/sources/{fixture["numeric_source"]}/'},
+            {'label': 'GET sources:source_categories', 'method': 'get', 'path': lambda i, _: '/api/sources/categories/'},
+            {'label': 'GET sources:emission_factors', 'method': 'get', 'path': lambda i, _: '/api/sources/emission-factors/'},
+            {
+                'label': 'POST sources:calculate_footprint', 'method': 'post', 'path': lambda i, _: '/api/sources/calculate/',
+                'body': lambda i, _: {'source_id': sources[i % len(sources)], 'amount': 12.5, 'date': '2024-06-01'}
+            },
+            {
+                'label': 'POST sources:calculate_footprint_batch', 'method': 'post', 'path': lambda i, _: '/api/sources/calculate/batch/',
+                'body': lambda i, _: {'items': [{'source_id': sources[k % len(sources)], 'amount': k + 1} for k in range(100)]}
+            },
+            {'label': 'GET sources:get_user_sources', 'method': 'get', 'path': lambda i, _: f'/api/sources/user/sources/?email={email(i)}'},
+            {
+                'label': 'GET sources:get_user_records_by_timeframe', 'method': 'get',
+                'path': lambda i, _: (
+                    f'/api/sources/user/records/?email={email(i)}&source_uid={sources[0]}'
+                    f'&start_date=2024-01-01&end_date=2024-12-31&limit=100'
+                )
+            },
+            {'label': 'GET sources:export_user_records', 'method': 'get', 'path': lambda i, _: f'/api/sources/user/records/export/?email={email(i)}'},
+            {
+                'label': 'POST activities:carbon_consumption', 'method': 'post', 'path': lambda i, _: '/api/activities/carbon-consumption/',
+                'body': lambda i, _: {'email': email(i), **timeframe}
+            },
+            {
+                'label': 'POST activities:carbon_consumption_series', 'method': 'post',
+                'path': lambda i, _: '/api/activities/carbon-consumption/series/',
+                'body': lambda i, _: {'email': email(i), 'bucket': 'week', 'split_by_source': True, **timeframe}
+            },
+            # Writes
+            {
+                'label': 'POST accounts:user_register', 'method': 'post', 'path': lambda i, _: '/api/accounts/register/',
+                'body': lambda i, _: {'username': f'bench-register-{i}', 'email': f'bench-register-{i}@example.com', 'password': PASSWORD}
+            },
+            {
+                'label': 'POST accounts:user_list', 'method': 'post', 'path': lambda i, _: '/api/accounts/users/',
+                'body': lambda i, _: {'username': f'bench-create-{i}', 'email': f'bench-create-{i}@example.com', 'password': PASSWORD}
+            },
+            {
+                'label': 'PUT accounts:user_detail', 'method': 'put', 'path': lambda i, _: f'/api/accounts/users/{user(i)["id"]}/',
+                'body': lambda i, _: {'first_name': f'Bench {i}'}
+            },
+            {
+                'label': 'POST sources:add_source_to_user', 'method': 'post', 'path': lambda i, _: '/api/sources/user/add/',
+                'body': lambda i, _: dict(zip(('email', 'source_uid'), pair(i)))
+            },
+            {
+                'label': 'DELETE sources:remove_source_from_user', 'method': 'delete', 'path': lambda i, _: '/api/sources/user/remove/',
+                'body': lambda i, _: dict(zip(('email', 'source_uid'), pair(i)))
+            },
+            {
+                'label': 'POST sources:ingest_user_records', 'method': 'post', 'path': lambda i, _: '/api/sources/user/records/ingest/',
+                'body': lambda i, _: {'email': email(i), 'records': records(i)}
+            },
+            {
+                'label': 'POST sources:source_list', 'method': 'post', 'path': lambda i, _: '/api/sources/',
+                'body': lambda i, _: {'name': f'Benchmark created {i}', 'source_type': CATEGORIES[i % len(CATEGORIES)]}
+            },
+            {
+                'label': 'PUT sources:source_detail', 'method': 'put', 'path': lambda i, _: f'/api/sources/{fixture["numeric_source"]}/',
+                'body': lambda i, _: {'description': f'Updated {i}'}
+            },
+            {
+                'label': 'POST accounts:user_logout', 'method': 'post', 'path': lambda i, _: '/api/accounts/logout/',
+                'setup': tokens, 'headers': lambda i, token: {'Authorization': f'Bearer {token}'}
+            },
+            # Deletes, each of a row created for it by setup
+            {
+                'label': 'DELETE accounts:user_detail', 'method': 'delete', 'setup': throwaway_users,
+                'path': lambda i, user_id: f'/api/accounts/users/{user_id}/'
+            },
+            {
+                'label': 'DELETE sources:source_detail', 'method': 'delete', 'setup': throwaway_sources,
+                'path': lambda i, source_id: f'/api/sources/{source_id}/'
+            },
+        ]
+
+    def run_scenario(self, scenario, options):
+        """Send warmup + measured requests for one scenario and summarize the measured ones"""
+        from django.test import Client
+
+        warmup, count = options['warmup'], options['requests']
+        targets = scenario['setup'](warmup + count) if 'setup' in scenario else [None] * (warmup + count)
+        local = threading.local()
+
+        def send(i):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            kwargs = {}
+            if 'body' in scenario:
+                kwargs = {'data': json.dumps(scenario['body'](i, targets[i])), 'content_type': 'application/json'}
+            if 'headers' in scenario:
+                kwargs['headers'] = scenario['headers'](i, targets[i])
+            start = time.perf_counter()
+            response = getattr(client, scenario['method'])(scenario['path'](i, targets[i]), **kwargs)
+            if response.streaming and response.is_async:
+                # Async views stream through an async iterator, even to the sync test client
+                async_to_sync(_drain)(response.streaming_content)
+            elif response.streaming:
+                b''.join(response.streaming_content)
+            duration = time.perf_counter() - start
+            backend = SERVER_TIMING_BACKEND_RE.search(response.get('Server-Timing', ''))
+            calls, backend_ms = (int(backend.group(1)), float(backend.group(2))) if backend else (0, 0.0)
+            return duration * 1000, calls, backend_ms, response.status_code
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(send, range(warmup)))
+            started = time.perf_counter()
+            samples = list(executor.map(send, range(warmup, warmup + count)))
+            elapsed = time.perf_counter() - started
+
+        durations = np.array([sample[0] for sample in samples])
+        # Time spent outside backend calls: the API's own work, without the stand-in's or the simulated latency
+        app_durations = durations - np.array([sample[2] for sample in samples])
+        errors = sum(1 for sample in samples if sample[3] >= 400)
+        return {
+            'requests': count,
+            'errors': errors,
+            'throughput': round(count / elapsed, 1),
+            'p50_ms': round(float(np.percentile(durations, 50)), 3),
+            'p99_ms': round(float(np.percentile(durations, 99)), 3),
+            'app_p50_ms': round(float(np.percentile(app_durations, 50)), 3),
+            'round_trips': round(sum(sample[1] for sample in samples) / count, 2)
+        }
+
+    def load_baseline(self, path, current_settings):
+        """Load a stored baseline, warning when it was recorded with different settings"""
+        if not path or not os.path.exists(path):
+            return None
+        with open(path) as file:
+            baseline = json.load(file)
+        differing = [
+            name for name in ('requests', 'concurrency', 'latency_ms', 'users', 'sources', 'records_per_user', 'async_views')
+            if baseline.get('settings', {}).get(name) != current_settings[name]
+        ]
+        self.stdout.write(f'Comparing with {path}')
+        if differing:
+            self.stdout.write(self.style.WARNING(
+                f'The baseline was recorded with different settings ({", ".join(differing)}); timings are not comparable'
+            ))
+        return baseline.get('endpoints', {})
+
+    def print_report(self, results, baseline, tolerance):
+        """Print one row per endpoint; returns the labels of endpoints that regressed against the baseline"""
+        header = f'{"endpoint":<46} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"app p50":>9} {"trips":>6} {"errors":>6}'
+        if baseline:
+            header += f' {"p50 vs base":>12} {"trips vs base":>14}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+
+        regressions = []
+        for label, result in results.items():
+            line = (
+                f'{label:<46} {result["throughput"]:>9.1f} {result["p50_ms"]:>9.3f} {result["p99_ms"]:>9.3f} {result["app_p50_ms"]:>9.3f} '
+                f'{result["round_trips"]:>6.2f} {result["errors"]:>6}'
+            )
+            base = baseline.get(label) if baseline else None
+            regressed = False
+            if base:
+                change = (result['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100 if base['p50_ms'] else 0.0
+                trips = result['round_trips'] - base['round_trips']
+                line += f' {change:>+11.1f}% {trips:>+14.2f}'
+                # Ignore sub-0.1 ms swings, which are timer noise on the fastest endpoints
+                regressed = trips > 0.005 or (change > tolerance and result['p50_ms'] - base['p50_ms'] > 0.1)
+            elif baseline is not None:
+                line += f' {"new":>12}'
+            if regressed:
+                regressions.append(label)
+                self.stdout.write(self.style.ERROR(line))
+            elif result['errors']:
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+        return regressions
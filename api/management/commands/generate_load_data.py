@@ -0,0 +1,258 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+import math
+import threading
+import time
+import uuid
+import numpy as np
+from api.emission_factors import emission_factor_registry
+from api.supabase_client import UniqueViolation, supabase_client
+
+# source_type -> day of the year its activity peaks (summer travel, holiday shopping, winter heating)
+SEASONAL_PEAKS = {
+    'Travel': 196,
+    'Dining & Shopping': 350,
+    'Utility & Bills': 15,
+}
+# Dining & Shopping activity is this much higher on weekends
+WEEKEND_FACTOR = 1.3
+# Sources are looked up and created this many at a time
+SOURCE_CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate deterministic synthetic users, carbon sources and seasonal carbon records '
+        'in the configured storage backend, with batched upserts from parallel writers'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to generate (default 1000)')
+        parser.add_argument('--sources', type=int, default=100, help='Carbon sources to generate (default 100)')
+        parser.add_argument(
+            '--records-per-user', type=int, default=1000,
+            help='Average carbon records per user; each user gets a Poisson-distributed count (default 1000)'
+        )
+        parser.add_argument('--sources-per-user', type=int, default=5, help='Sources linked to each user profile (default 5)')
+        parser.add_argument('--start-date', default='2023-01-01', help='First record date (YYYY-MM-DD, default 2023-01-01)')
+        parser.add_argument('--end-date', default='2024-12-31', help='Last record date (YYYY-MM-DD, default 2024-12-31)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed and options generate the same rows (default 0)')
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'INGEST_CHUNK_SIZE', 1000),
+            help='Records per upsert statement (default INGEST_CHUNK_SIZE)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Parallel writer threads (default 4; use 1 with the django backend on SQLite)'
+        )
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help='Do not ask for confirmation before writing',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start_date = datetime.strptime(options['start_date'], '%Y-%m-%d').date()
+            end_date = datetime.strptime(options['end_date'], '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError('Invalid date format. Use YYYY-MM-DD')
+        if start_date > end_date:
+            raise CommandError('Start date cannot be after end date')
+        for name in ('users', 'sources', 'batch_size', 'workers'):
+            if options[name] < 1:
+                raise CommandError(f'--{name.replace("_", "-")} must be at least 1')
+        if options['records_per_user'] < 0 or not 0 <= options['sources_per_user'] <= options['sources']:
+            raise CommandError('--records-per-user must not be negative and --sources-per-user must be between 0 and --sources')
+
+        total_records = options['users'] * options['records_per_user']
+        self.stdout.write(
+            f'About to write {options["users"]} users, {options["sources"]} sources and about {total_records} '
+            f'carbon records to the {settings.STORAGE_BACKEND} backend.'
+        )
+        if options['interactive'] and input("Type 'yes' to continue: ") != 'yes':
+            raise CommandError('Load data generation cancelled.')
+
+        started = time.monotonic()
+        sources = self.generate_sources(options)
+        self.stdout.write(f'✓ {len(sources)} carbon sources ready')
+
+        # Footprints are stored with the factor valid on each record's date
+        emission_factor_registry.invalidate()
+        emission_factor_registry.refresh(force=True)
+        for source in sources:
+            boundaries, factors = emission_factor_registry.factor_timeline(source)
+            source['boundaries'] = np.array(boundaries, dtype='datetime64[D]')
+            source['factors'] = np.array(factors, dtype=float)
+
+        self.progress = {'users': 0, 'records': 0, 'batches': 0}
+        self.progress_lock = threading.Lock()
+        self.write_users(sources, start_date, end_date, options)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Generated {self.progress["users"]} users and {self.progress["records"]} carbon records in '
+                f'{self.progress["batches"]} batches in {elapsed:.1f}s '
+                f'({self.progress["records"] / elapsed if elapsed else 0:.0f} records/s).'
+            )
+        )
+
+    def generate_sources(self, options):
+        """Create the carbon sources that don't exist yet and return every source row with its seasonal profile"""
+        rng = np.random.default_rng([options['seed'], 0])
+        categories = list(SEASONAL_PEAKS)
+        sources = []
+        for index in range(options['sources']):
+            category = categories[index % len(categories)]
+            sources.append({
+                'uid': str(uuid.UUID(bytes=rng.bytes(16), version=4)),
+                'name': f'Load source {index}',
+                'description': 'Synthetic source generated by generate_load_data',
+                'source_type': category,
+                # Typical amount per record, how strongly it swings with the seasons and its peak day
+                'base': float(rng.lognormal(2.0, 0.6)),
+                'amplitude': float(rng.uniform(0.2, 0.6)),
+                'peak': SEASONAL_PEAKS[category] + int(rng.integers(-20, 21)),
+            })
+
+        columns = ('uid', 'name', 'description', 'source_type')
+        for start in range(0, len(sources), SOURCE_CHUNK_SIZE):
+            chunk = sources[start:start + SOURCE_CHUNK_SIZE]
+            existing = supabase_client.get_carbon_sources_by_uid([source['uid'] for source in chunk]).data or []
+            existing = {str(row['uid']) for row in existing}
+            for source in chunk:
+                if source['uid'] not in existing:
+                    supabase_client.create_carbon_source({column: source[column] for column in columns})
+        return sources
+
+    def write_users(self, sources, start_date, end_date, options):
+        """Generate users in blocks on parallel writer threads, reporting progress every few seconds"""
+        # Blocks hold enough users to fill at least one batch, so batches are rarely partial
+        block_size = max(1, math.ceil(options['batch_size'] / max(options['records_per_user'], 1)))
+        blocks = [range(start, min(start + block_size, options['users'])) for start in range(0, options['users'], block_size)]
+
+        started = last_report = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            pending = {executor.submit(self.write_block, block, sources, start_date, end_date, options) for block in blocks}
+            try:
+                while pending:
+                    done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    now = time.monotonic()
+                    if now - last_report >= 5 or not pending:
+                        last_report = now
+                        self.report(started, now, options, finished=not pending)
+            except Exception as e:
+                for future in pending:
+                    future.cancel()
+                raise CommandError(f'Load data generation failed: {e}') from e
+
+    def report(self, started, now, options, finished=False):
+        with self.progress_lock:
+            users, records = self.progress['users'], self.progress['records']
+        rate = records / (now - started) if now > started else 0
+        expected = options['users'] * options['records_per_user']
+        eta = f', about {max(expected - records, 0) / rate:.0f}s left' if rate and not finished else ''
+        self.stdout.write(f'{users}/{options["users"]} users, {records} records ({rate:.0f} records/s{eta})')
+
+    def write_block(self, block, sources, start_date, end_date, options):
+        """Create one block of users with their profile links and upsert their records in batches"""
+        try:
+            batch = []
+            for index in block:
+                user_id, email = self.ensure_user(index)
+                records = self.generate_records(index, user_id, email, sources, start_date, end_date, options)
+                batch.extend(records)
+                while len(batch) >= options['batch_size']:
+                    self.upsert(batch[:options['batch_size']])
+                    batch = batch[options['batch_size']:]
+                with self.progress_lock:
+                    self.progress['users'] += 1
+            if batch:
+                self.upsert(batch)
+        finally:
+            # Each writer thread has its own Django database connection
+            connections.close_all()
+
+    def upsert(self, records):
+        supabase_client.upsert_carbon_records(records)
+        with self.progress_lock:
+            self.progress['records'] += len(records)
+            self.progress['batches'] += 1
+
+    def ensure_user(self, index):
+        """Create the user with this index, or reuse it if an earlier run created it; returns (id, email)"""
+        username = f'load-user-{index}'
+        email = f'{username}@example.com'
+        try:
+            account = supabase_client.create_user_account({
+                'username': username,
+                'email': email,
+                'password_hash': 'load-test',
+                'first_name': 'Load',
+                'last_name': str(index)
+            }).data[0]
+        except UniqueViolation:
+            account = supabase_client.get_user_account_by_username(username, columns='id, email').data[0]
+        return account['id'], account['email']
+
+    def generate_records(self, index, user_id, email, sources, start_date, end_date, options):
+        """Link the user's sources and return its carbon records.
+
+        Every user draws from its own generator seeded with (seed, index), so the rows don't
+        depend on which thread writes them or in what order.
+        """
+        rng = np.random.default_rng([options['seed'], 1, index])
+        chosen = rng.choice(len(sources), size=options['sources_per_user'], replace=False)
+        for source_index in chosen:
+            # An 'already added' status on a rerun is fine
+            supabase_client.add_source_to_user(email, sources[source_index]['uid'])
+        if not len(chosen):
+            if not supabase_client.get_user_profile(user_id, columns='id').data:
+                supabase_client.create_user_profile({'user_id': user_id})
+            return []
+
+        count = int(rng.poisson(options['records_per_user']))
+        if not count:
+            return []
+        # Users lean on a few of their sources and differ in overall volume
+        source_indexes = chosen[rng.choice(len(chosen), size=count, p=rng.dirichlet(np.ones(len(chosen))))]
+        days = (end_date - start_date).days + 1
+        dates = np.datetime64(start_date, 'D') + rng.integers(0, days, size=count)
+        day_of_year = (dates - dates.astype('datetime64[Y]')).astype(int) + 1
+        weekday = (dates.astype(int) + 3) % 7  # 0 is Monday
+
+        base = np.array([sources[i]['base'] for i in source_indexes])
+        amplitude = np.array([sources[i]['amplitude'] for i in source_indexes])
+        peak = np.array([sources[i]['peak'] for i in source_indexes])
+        season = 1 + amplitude * np.cos(2 * np.pi * (day_of_year - peak) / 365.25)
+        weekend = np.where(
+            (weekday >= 5) & (np.array([sources[i]['source_type'] for i in source_indexes]) == 'Dining & Shopping'),
+            WEEKEND_FACTOR, 1.0
+        )
+        amounts = np.round(base * season * weekend * rng.lognormal(0, 0.3, size=count) * rng.lognormal(0, 0.5), 2)
+
+        factors = np.empty(count)
+        for source_index in chosen:
+            mask = source_indexes == source_index
+            source = sources[source_index]
+            factors[mask] = source['factors'][np.searchsorted(source['boundaries'], dates[mask], side='right')]
+        footprints = amounts * factors
+
+        uid_bytes = rng.bytes(16 * count)
+        return [
+            {
+                'uid': str(uuid.UUID(bytes=uid_bytes[i * 16:(i + 1) * 16], version=4)),
+                'user_id': user_id,
+                'source_uid': sources[source_indexes[i]]['uid'],
+                'amount': float(amounts[i]),
+                'date': str(dates[i]),
+                'footprint': float(footprints[i]),
+                'emission_factor': float(factors[i])
+            }
+            for i in range(count)
+        ]
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.profiling import issue_profile_token
+
+class Command(BaseCommand):
+    help = 'Print a signed X-Profile-Request token that makes requests carrying it be profiled'
+
+    def handle(self, *args, **options):
+        if not settings.PROFILING_ENABLED:
+            self.stderr.write('Warning: PROFILING_ENABLED is off, requests will not be profiled.')
+        self.stdout.write(issue_profile_token())
+        self.stdout.write(
+            f'Valid for {settings.PROFILING_TOKEN_MAX_AGE} seconds. Send it as the X-Profile-Request header; '
+            f'profiles are written to {settings.PROFILING_DIR}'
+        )
@@ -0,0 +1,203 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import time
+from datetime import datetime
+import numpy as np
+from django.conf import settings
+from supabase import create_client
+from api.emission_factors import emission_factor_registry
+from api.pagination import CARBON_RECORD_KEY, row_key
+from api.supabase_client import SupabaseClient, supabase_client
+
+class Command(BaseCommand):
+    help = 'Recalculate stored carbon record footprints after emission factors change'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source-uid',
+            action='append',
+            dest='source_uids',
+            help='Only recalculate records of this source (repeatable)',
+        )
+        parser.add_argument(
+            '--category',
+            help='Only recalculate records of sources with this source_type',
+        )
+        parser.add_argument(
+            '--start-date',
+            help='First record date to recalculate (YYYY-MM-DD)',
+        )
+        parser.add_argument(
+            '--end-date',
+            help='Last record date to recalculate (YYYY-MM-DD)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Records read and written per round trip (default 1000)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default='recalculate_footprints.checkpoint.json',
+            help='File recording progress so an interrupted run can resume',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint and start from the beginning',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Compute footprints and report what would change without writing',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start_date = self.parse_date(options['start_date'])
+            end_date = self.parse_date(options['end_date'])
+        except ValueError:
+            raise CommandError('Invalid date format. Use YYYY-MM-DD')
+        if start_date and end_date and start_date > end_date:
+            raise CommandError('Start date cannot be after end date')
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be positive')
+
+        # Work from freshly loaded factors, one source at a time in a stable order
+        emission_factor_registry.refresh(force=True)
+        sources = sorted(emission_factor_registry.sources(), key=lambda source: str(source['uid']))
+        if options['source_uids']:
+            sources = [source for source in sources if str(source['uid']) in set(options['source_uids'])]
+        if options['category']:
+            sources = [source for source in sources if source.get('source_type') == options['category']]
+        if not sources:
+            self.stdout.write('No matching carbon sources, nothing to recalculate.')
+            return
+
+        scope = {
+            'source_uids': sorted(options['source_uids'] or []),
+            'category': options['category'],
+            'start_date': options['start_date'],
+            'end_date': options['end_date']
+        }
+        checkpoint = self.load_checkpoint(options['checkpoint'], scope, options['restart'])
+        writer = None if options['dry_run'] else self.footprint_writer()
+
+        started = last_report = time.monotonic()
+        processed = updated = 0
+        for source in sources:
+            uid = str(source['uid'])
+            progress = checkpoint['sources'].setdefault(uid, {'after': None, 'done': False})
+            if progress['done']:
+                continue
+
+            boundaries, factors = emission_factor_registry.factor_timeline(source)
+            boundaries = np.array(boundaries, dtype='datetime64[D]')
+            factors = np.array(factors, dtype=float)
+
+            while True:
+                rows = supabase_client.list_source_carbon_records(
+                    uid, options['start_date'], options['end_date'],
+                    columns='uid, date, amount, footprint, emission_factor',
+                    limit=options['batch_size'],
+                    after=tuple(progress['after']) if progress['after'] else None
+                ).data or []
+                if not rows:
+                    break
+
+                changes = self.recalculate(rows, boundaries, factors)
+                if changes and not options['dry_run']:
+                    writer.update_carbon_record_footprints(changes)
+
+                processed += len(rows)
+                updated += len(changes)
+                progress['after'] = list(row_key(rows[-1], CARBON_RECORD_KEY))
+                if not options['dry_run']:
+                    self.save_checkpoint(options['checkpoint'], checkpoint)
+
+                # Report progress at most every few seconds
+                now = time.monotonic()
+                if now - last_report >= 5:
+                    last_report = now
+                    self.stdout.write(
+                        f'{source["name"]}: {processed} records processed, {updated} changed '
+                        f'({processed / (now - started):.0f} records/s)'
+                    )
+                if len(rows) < options['batch_size']:
+                    break
+
+            progress['done'] = True
+            if not options['dry_run']:
+                self.save_checkpoint(options['checkpoint'], checkpoint)
+            self.stdout.write(f'✓ Recalculated {source["name"]} ({uid})')
+
+        if not options['dry_run'] and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+
+        elapsed = time.monotonic() - started
+        verb = 'would change' if options['dry_run'] else 'updated'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Recalculated footprints for {len(sources)} sources: {processed} records processed, '
+                f'{updated} {verb} in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.0f} records/s).'
+            )
+        )
+
+    def footprint_writer(self):
+        """Client for the footprint updates; on Supabase only the service role may run them"""
+        if getattr(settings, 'STORAGE_BACKEND', 'supabase') != 'supabase':
+            return supabase_client
+
+        supabase_url = os.getenv('SUPABASE_URL')
+        supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')  # update_carbon_record_footprints is only granted to the service role
+        if not supabase_url or not supabase_key:
+            raise CommandError(
+                'SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in your .env file.\n'
+                'Please check the SUPABASE_SETUP.md file for instructions.'
+            )
+        return SupabaseClient(create_client(supabase_url, supabase_key))
+
+    def recalculate(self, rows, boundaries, factors):
+        """Recompute footprints for a page of records and return the rows whose stored values changed"""
+        dates = np.array([str(row['date']) for row in rows], dtype='datetime64[D]')
+        amounts = np.array([row['amount'] for row in rows], dtype=float)
+        new_factors = factors[np.searchsorted(boundaries, dates, side='right')]
+        footprints = amounts * new_factors
+
+        stored_footprints = np.array([np.nan if row.get('footprint') is None else row['footprint'] for row in rows], dtype=float)
+        stored_factors = np.array([np.nan if row.get('emission_factor') is None else row['emission_factor'] for row in rows], dtype=float)
+        changed = ~(np.isclose(stored_footprints, footprints) & np.isclose(stored_factors, new_factors))
+
+        return [
+            {'uid': str(rows[i]['uid']), 'footprint': float(footprints[i]), 'emission_factor': float(new_factors[i])}
+            for i in np.flatnonzero(changed)
+        ]
+
+    def load_checkpoint(self, path, scope, restart):
+        """Load the checkpoint for this scope, or start a new one"""
+        if restart or not os.path.exists(path):
+            return {'scope': scope, 'sources': {}}
+        with open(path) as file:
+            checkpoint = json.load(file)
+        if checkpoint.get('scope') != scope:
+            raise CommandError(
+                f'Checkpoint {path} belongs to a run with different options. '
+                'Use --restart to discard it or rerun with the same options.'
+            )
+        self.stdout.write(f'Resuming from checkpoint {path}')
+        return checkpoint
+
+    def save_checkpoint(self, path, checkpoint):
+        """Atomically replace the checkpoint file"""
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(checkpoint, file)
+        os.replace(temporary_path, path)
+
+    def parse_date(self, value):
+        """Parse an optional YYYY-MM-DD option"""
+        if not value:
+            return None
+        return datetime.strptime(value, '%Y-%m-%d').date()
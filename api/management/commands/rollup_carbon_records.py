@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand, CommandError
+import os
+from supabase import create_client, Client
+from datetime import date, datetime
+
+class Command(BaseCommand):
+    help = 'Backfill and reconcile the daily/monthly carbon record rollups from raw carbon_records'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-id',
+            type=int,
+            help='Only reconcile rollups for this user',
+        )
+        parser.add_argument(
+            '--start-date',
+            help='First day to reconcile (YYYY-MM-DD). Defaults to the earliest record',
+        )
+        parser.add_argument(
+            '--end-date',
+            help='Last day to reconcile (YYYY-MM-DD). Defaults to the latest record',
+        )
+
+    def handle(self, *args, **options):
+        supabase_url = os.getenv('SUPABASE_URL')
+        supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')  # Rollup tables are only writable by the service role
+
+        if not supabase_url or not supabase_key:
+            raise CommandError(
+                'SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in your .env file.\n'
+                'Please check the SUPABASE_SETUP.md file for instructions.'
+            )
+
+        supabase: Client = create_client(supabase_url, supabase_key)
+        user_id = options['user_id']
+
+        try:
+            start_date = self.parse_date(options['start_date']) or self.record_date_bound(supabase, user_id, first=True)
+            end_date = self.parse_date(options['end_date']) or self.record_date_bound(supabase, user_id, first=False)
+        except ValueError:
+            raise CommandError('Invalid date format. Use YYYY-MM-DD')
+
+        if start_date is None or end_date is None:
+            self.stdout.write('No carbon records found, nothing to reconcile.')
+            return
+        if start_date > end_date:
+            raise CommandError('Start date cannot be after end date')
+
+        # Reconcile one calendar month per call so a backfill never runs as one huge statement
+        daily_fixed = monthly_fixed = 0
+        for month_start, month_end in self.month_ranges(start_date, end_date):
+            response = supabase.rpc('reconcile_carbon_rollups', {
+                'p_user_id': user_id,
+                'p_start_date': month_start.isoformat(),
+                'p_end_date': month_end.isoformat()
+            }).execute()
+            result = response.data[0] if response.data else {}
+            daily_fixed += result.get('daily_rows_fixed') or 0
+            monthly_fixed += result.get('monthly_rows_fixed') or 0
+            self.stdout.write(f'✓ Reconciled {month_start:%Y-%m}')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rollups reconciled from {start_date} to {end_date}: '
+                f'{daily_fixed} daily and {monthly_fixed} monthly rows updated.'
+            )
+        )
+
+    def parse_date(self, value):
+        """Parse an optional YYYY-MM-DD option"""
+        if not value:
+            return None
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    def record_date_bound(self, supabase: Client, user_id, first):
+        """Find the earliest or latest carbon record date in scope"""
+        query = supabase.table('carbon_records').select('date')
+        if user_id is not None:
+            query = query.eq('user_id', user_id)
+        response = query.order('date', desc=not first).limit(1).execute()
+        if not response.data:
+            return None
+        return self.parse_date(response.data[0]['date'])
+
+    def month_ranges(self, start_date, end_date):
+        """Yield (first_day, last_day) pairs for each calendar month overlapping the range"""
+        current = start_date
+        while current <= end_date:
+            if current.month == 12:
+                next_month = date(current.year + 1, 1, 1)
+            else:
+                next_month = date(current.year, current.month + 1, 1)
+            yield current, min(end_date, date.fromordinal(next_month.toordinal() - 1))
+            current = next_month
@@ -1,8 +1,9 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 import os
+import time
 from supabase import create_client, Client
-from datetime import datetime
+from api.schema_migrations import MigrationError, PostgresMigrationRunner, RestMigrationRunner, discover_migrations
 
 class Command(BaseCommand):
     help = 'Set up Supabase tables and initial data for CarbonThink'
@@ -13,80 +14,89 @@ class Command(BaseCommand):
             action='store_true',
             help='Force recreation of tables (will drop existing tables)',
         )
+        parser.add_argument(
+            '--fake',
+            action='store_true',
+            help='Record pending migrations as applied without running them, for databases set up by hand in the SQL Editor',
+        )
+        parser.add_argument(
+            '--plan',
+            action='store_true',
+            help='List each migration as applied, pending or changed without running anything',
+        )
+        parser.add_argument(
+            '--directory',
+            default=None,
+            help='Directory of numbered .sql migrations (default supabase/migrations)',
+        )
 
     def handle(self, *args, **options):
-        # Check if environment variables are set
-        supabase_url = os.getenv('SUPABASE_URL')
-        supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')  # Use service role for admin operations
-        
-        if not supabase_url or not supabase_key:
-            self.stdout.write(
-                self.style.ERROR(
-                    'SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in your .env file.\n'
-                    'Please check the SUPABASE_SETUP.md file for instructions.'
+        self.fake = options['fake']
+        try:
+            migrations = discover_migrations(options['directory'])
+        except MigrationError as e:
+            raise CommandError(str(e))
+
+        # A direct connection runs each migration in one round trip under a session advisory lock
+        dsn = getattr(settings, 'SUPABASE_DB_URL', None) or os.getenv('SUPABASE_DB_URL')
+        if dsn:
+            runner = PostgresMigrationRunner(dsn)
+        else:
+            # Check if environment variables are set
+            supabase_url = os.getenv('SUPABASE_URL')
+            supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')  # Use service role for admin operations
+
+            if not supabase_url or not supabase_key:
+                self.stdout.write(
+                    self.style.ERROR(
+                        'SUPABASE_DB_URL, or SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY, must be set in your .env file.\n'
+                        'Please check the SUPABASE_SETUP.md file for instructions.'
+                    )
                 )
-            )
-            return
+                return
 
-        if supabase_url == 'your_supabase_project_url_here' or supabase_key == 'your_supabase_service_role_key_here':
-            self.stdout.write(
-                self.style.ERROR(
-                    'Please update your .env file with actual Supabase credentials.\n'
-                    'Check the SUPABASE_SETUP.md file for instructions.'
+            if supabase_url == 'your_supabase_project_url_here' or supabase_key == 'your_supabase_service_role_key_here':
+                self.stdout.write(
+                    self.style.ERROR(
+                        'Please update your .env file with actual Supabase credentials.\n'
+                        'Check the SUPABASE_SETUP.md file for instructions.'
+                    )
                 )
-            )
-            return
+                return
 
-        try:
             # Create Supabase client with service role key
             supabase: Client = create_client(supabase_url, supabase_key)
-            
-            self.stdout.write('Setting up Supabase tables...')
-            
-            # Read and execute the SQL migration files
-            self.execute_sql_file(supabase, 'supabase/migrations/001_create_tables.sql')
-            self.execute_sql_file(supabase, 'supabase/migrations/002_grant_permissions.sql')
-            
-            self.stdout.write(
-                self.style.SUCCESS(
-                    'Successfully set up Supabase tables and permissions!\n'
-                    'You can now test your API endpoints.'
-                )
-            )
-            
-        except Exception as e:
-            self.stdout.write(
-                self.style.ERROR(f'Error setting up Supabase: {str(e)}')
-            )
+            runner = RestMigrationRunner(supabase)
 
-    def execute_sql_file(self, supabase: Client, file_path: str):
-        """Execute SQL commands from a file"""
         try:
-            with open(file_path, 'r') as file:
-                sql_content = file.read()
-            
-            # Split SQL content by semicolons and execute each statement
-            statements = [stmt.strip() for stmt in sql_content.split(';') if stmt.strip()]
-            
-            for statement in statements:
-                if statement:
-                    # Use the rpc method to execute raw SQL
-                    result = supabase.rpc('exec_sql', {'sql': statement}).execute()
-                    
-            self.stdout.write(f'✓ Executed {file_path}')
-            
-        except FileNotFoundError:
-            self.stdout.write(
-                self.style.ERROR(f'SQL file not found: {file_path}')
-            )
+            if options['plan']:
+                pending, changed = runner.status(migrations)
+                for migration in migrations:
+                    state = 'changed' if migration in changed else 'pending' if migration in pending else 'applied'
+                    self.stdout.write(f'{migration.path.name}: {state}')
+                return
+
+            started = time.monotonic()
+            applied = runner.migrate(migrations, fake=options['fake'], log=self.log_migration)
+        except MigrationError as e:
+            raise CommandError(f'Error setting up Supabase: {e}')
         except Exception as e:
-            self.stdout.write(
-                self.style.ERROR(f'Error executing {file_path}: {str(e)}')
+            raise CommandError(
+                f'Error setting up Supabase: {e}\n'
+                'Please manually execute the SQL in supabase/migrations/ using the Supabase SQL Editor.\n'
+                'See SUPABASE_SETUP.md for detailed instructions.'
             )
-            # For SQL execution, we'll provide manual instructions instead
-            self.stdout.write(
-                self.style.WARNING(
-                    f'Please manually execute the SQL in {file_path} using the Supabase SQL Editor.\n'
-                    'See SUPABASE_SETUP.md for detailed instructions.'
-                )
-            )
\ No newline at end of file
+
+        if not applied:
+            self.stdout.write(f'Database schema is up to date ({len(migrations)} migrations).')
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{"Recorded" if self.fake else "Applied"} {len(applied)} migrations in {time.monotonic() - started:.2f}s.\n'
+                'You can now test your API endpoints.'
+            )
+        )
+
+    def log_migration(self, migration, seconds):
+        verb = 'Recorded' if self.fake else 'Executed'
+        self.stdout.write(f'✓ {verb} {migration.path.name} ({seconds * 1000:.0f} ms)')
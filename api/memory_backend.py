@@ -0,0 +1,611 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from django.conf import settings
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from .supabase_client import QueryResult
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _uuid():
+    return str(uuid.uuid4())
+
+
+# table -> (primary key column, whether the key is a bigserial, unique column groups)
+TABLES = {
+    'user_accounts': ('id', True, (('username',), ('email',))),
+    'user_profiles': ('id', True, (('user_id',),)),
+    'user_profile_sources': ('id', True, (('user_profile_id', 'carbon_source_uid'),)),
+    'carbon_sources': ('uid', False, ()),
+    'carbon_records': ('uid', False, ()),
+    'emission_factors': ('id', True, ()),
+    'catalog_versions': ('name', False, ()),
+    'activities': ('id', True, ()),
+}
+
+# Column defaults applied on insert; callables are called once per row
+DEFAULTS = {
+    'user_accounts': {'first_name': '', 'last_name': '', 'is_active': True, 'date_joined': _now, 'created_at': _now, 'updated_at': _now},
+    'user_profiles': {'created_at': _now},
+    'user_profile_sources': {'created_at': _now},
+    'carbon_sources': {'uid': _uuid, 'description': '', 'created_at': _now, 'updated_at': _now},
+    'carbon_records': {'uid': _uuid, 'footprint': None, 'emission_factor': None, 'created_at': _now},
+    'emission_factors': {
+        'source_uid': None, 'category': None, 'unit': 'unit', 'valid_from': None, 'valid_to': None,
+        'created_at': _now, 'updated_at': _now
+    },
+    'catalog_versions': {'version': 1, 'updated_at': _now},
+    'activities': {'created_at': _now},
+}
+
+# (table, referenced table) -> (column, referenced column); used for embedded selects such as
+# carbon_sources(*) and for ON DELETE CASCADE
+FOREIGN_KEYS = {
+    ('user_profiles', 'user_accounts'): ('user_id', 'id'),
+    ('user_profile_sources', 'user_profiles'): ('user_profile_id', 'id'),
+    ('user_profile_sources', 'carbon_sources'): ('carbon_source_uid', 'uid'),
+    ('carbon_records', 'user_accounts'): ('user_id', 'id'),
+    ('carbon_records', 'carbon_sources'): ('source_uid', 'uid'),
+}
+
+# Tables whose writes bump their catalog_versions stamp, like the trigger in 007_emission_factors.sql
+VERSIONED_TABLES = {'carbon_sources', 'emission_factors'}
+
+# Category factors seeded by 007_emission_factors.sql
+DEFAULT_CATEGORY_FACTORS = (('Travel', 2.3), ('Dining & Shopping', 1.5), ('Utility & Bills', 0.8))
+
+
+def _error(code, message, details=None):
+    return APIError({'code': code, 'message': message, 'details': details, 'hint': None})
+
+
+def _cast(value, like):
+    """Cast a filter value to the type of the column value it is compared with, as Postgres would"""
+    if isinstance(like, bool):
+        if isinstance(value, bool):
+            return value
+        if str(value).lower() in ('true', 'false'):
+            return str(value).lower() == 'true'
+    elif isinstance(like, (int, float)):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        try:
+            return type(like)(value)
+        except ValueError:
+            pass
+    else:
+        return value if isinstance(value, str) else str(value)
+    raise _error('22P02', f'invalid input syntax for type {type(like).__name__}: "{value}"')
+
+
+def _matches(stored, operator, value):
+    """Evaluate one PostgREST filter against a stored column value (null never matches a comparison)"""
+    if operator == 'is':
+        return stored is None if value in (None, 'null') else stored is _cast(value, True)
+    if stored is None or value is None:
+        return False
+    if operator == 'in':
+        return stored in [_cast(item, stored) for item in value]
+    value = _cast(value, stored)
+    if operator == 'eq':
+        return stored == value
+    if operator == 'neq':
+        return stored != value
+    if operator == 'gt':
+        return stored > value
+    if operator == 'gte':
+        return stored >= value
+    if operator == 'lt':
+        return stored < value
+    if operator == 'lte':
+        return stored <= value
+    raise _error('PGRST100', f'unsupported operator "{operator}"')
+
+
+def _split_top_level(text):
+    """Split a PostgREST list on the commas outside parentheses and double quotes"""
+    parts, depth, quoted, escaped, start = [], 0, False, False, 0
+    for index, char in enumerate(text):
+        if escaped:
+            escaped = False
+        elif char == '\\' and quoted:
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(text[start:index].strip())
+            start = index + 1
+    parts.append(text[start:].strip())
+    return [part for part in parts if part]
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return value
+
+
+def _logic_predicate(text, combine=any):
+    """Compile a PostgREST logic tree such as ``a.gt."1",and(a.eq."1",b.gt."2")`` into a row predicate"""
+    predicates = []
+    for part in _split_top_level(text):
+        if part.startswith(('and(', 'or(')) and part.endswith(')'):
+            name, _, inner = part.partition('(')
+            predicates.append(_logic_predicate(inner[:-1], all if name == 'and' else any))
+            continue
+        column, operator, value = part.split('.', 2)
+        if operator == 'in':
+            value = [_unquote(item) for item in _split_top_level(value.strip('()'))]
+        else:
+            value = _unquote(value)
+        predicates.append(lambda row, column=column, operator=operator, value=value: _matches(row.get(column), operator, value))
+    return lambda row: combine(predicate(row) for predicate in predicates)
+
+
+def _sort_key(value):
+    """Sort key putting nulls last, as Postgres does for ascending order"""
+    return (value is None, value if value is not None else 0)
+
+
+class MemoryQuery:
+    """
+    Request builder mirroring the subset of postgrest's that SupabaseClient uses: pick an
+    operation (select, insert, upsert, update, delete), chain filters, order and limit,
+    then execute() against a MemoryDatabase after sleeping its injected latency.
+    """
+
+    def __init__(self, database, table):
+        self.database = database
+        self.table = table
+        self.operation = 'select'
+        self.columns = '*'
+        self.count = None
+        self.payload = None
+        self.filters = []
+        self.orders = []
+        self.row_limit = None
+        self.returning = ReturnMethod.representation
+        self.on_conflict = ''
+        self.ignore_duplicates = False
+
+    # Operations
+    def select(self, *columns, count=None):
+        self.operation = 'select'
+        self.columns = ','.join(columns) or '*'
+        self.count = count
+        return self
+
+    def insert(self, json, *, count=None, returning=ReturnMethod.representation, upsert=False, default_to_null=True):
+        self.operation = 'upsert' if upsert else 'insert'
+        self.payload = json
+        self.count = count
+        self.returning = returning
+        return self
+
+    def upsert(self, json, *, count=None, returning=ReturnMethod.representation, ignore_duplicates=False,
+               on_conflict='', default_to_null=True):
+        self.operation = 'upsert'
+        self.payload = json
+        self.count = count
+        self.returning = returning
+        self.ignore_duplicates = ignore_duplicates
+        self.on_conflict = on_conflict
+        return self
+
+    def update(self, json, *, count=None, returning=ReturnMethod.representation):
+        self.operation = 'update'
+        self.payload = json
+        self.count = count
+        self.returning = returning
+        return self
+
+    def delete(self, *, count=None, returning=ReturnMethod.representation):
+        self.operation = 'delete'
+        self.count = count
+        self.returning = returning
+        return self
+
+    # Filters
+    def _filter(self, column, operator, value):
+        self.filters.append(lambda row: _matches(row.get(column), operator, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, 'eq', value)
+
+    def neq(self, column, value):
+        return self._filter(column, 'neq', value)
+
+    def gt(self, column, value):
+        return self._filter(column, 'gt', value)
+
+    def gte(self, column, value):
+        return self._filter(column, 'gte', value)
+
+    def lt(self, column, value):
+        return self._filter(column, 'lt', value)
+
+    def lte(self, column, value):
+        return self._filter(column, 'lte', value)
+
+    def is_(self, column, value):
+        return self._filter(column, 'is', value)
+
+    def in_(self, column, values):
+        return self._filter(column, 'in', list(values))
+
+    def or_(self, filters, reference_table=None):
+        self.filters.append(_logic_predicate(filters))
+        return self
+
+    def match(self, query):
+        for column, value in query.items():
+            self.eq(column, value)
+        return self
+
+    # Modifiers
+    def order(self, column, *, desc=False, nullsfirst=None, foreign_table=None):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size, *, foreign_table=None):
+        self.row_limit = size
+        return self
+
+    def execute(self):
+        if self.database.latency:
+            time.sleep(self.database.latency)
+        return self.database.run(self)
+
+
+class AsyncMemoryQuery(MemoryQuery):
+    """MemoryQuery whose execute() is a coroutine, like postgrest's async request builders"""
+
+    async def execute(self):
+        if self.database.latency:
+            await asyncio.sleep(self.database.latency)
+        return self.database.run(self)
+
+
+class MemorySupabase:
+    """Stand-in for a (sync or async) supabase-py Client backed by a MemoryDatabase"""
+
+    def __init__(self, database, asynchronous=False):
+        self.database = database
+        self.query_class = AsyncMemoryQuery if asynchronous else MemoryQuery
+
+    def table(self, name):
+        return self.query_class(self.database, name)
+
+    def from_(self, name):
+        return self.table(name)
+
+    def rpc(self, fn, params=None, count=None):
+        query = self.query_class(self.database, fn)
+        query.operation = 'rpc'
+        query.payload = params or {}
+        return query
+
+
+class MemoryDatabase:
+    """
+    In-process stand-in for the Supabase tables and database functions the API uses, so the
+    whole API runs (STORAGE_BACKEND=memory) with no Supabase project, e.g. for benchmarks.
+
+    Rows are kept as JSON-shaped dicts, and payloads go through a JSON round trip as they
+    would over the wire. Primary keys, unique constraints (raising the same 23505 APIError
+    as PostgREST), column defaults, foreign-key embeds, ON DELETE CASCADE and catalog
+    version stamps behave like the schema in supabase/migrations. Every round trip first
+    sleeps ``latency`` seconds to stand in for the network.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """Empty every table and reseed catalog_versions and the default category factors"""
+        with self._lock:
+            self.tables = {name: {} for name in TABLES}
+            self._sequences = {name: 0 for name in TABLES}
+            self._unique = {
+                name: {columns: {} for columns in unique} for name, (_, _, unique) in TABLES.items()
+            }
+            self._insert('catalog_versions', [{'name': name} for name in sorted(VERSIONED_TABLES)])
+            self._insert('emission_factors', [
+                {'category': category, 'factor': factor} for category, factor in DEFAULT_CATEGORY_FACTORS
+            ])
+
+    def run(self, query):
+        """Execute a built query and return its QueryResult"""
+        with self._lock:
+            if query.operation == 'rpc':
+                function = getattr(self, f'rpc_{query.table}', None)
+                if function is None:
+                    raise _error('PGRST202', f'Could not find the function public.{query.table} in the schema cache')
+                return QueryResult(function(**json.loads(json.dumps(query.payload))))
+
+            if query.table not in TABLES and not hasattr(self, f'view_{query.table}'):
+                raise _error('42P01', f'relation "public.{query.table}" does not exist')
+            if query.operation in ('insert', 'upsert'):
+                payload = json.loads(json.dumps(query.payload))
+                rows = payload if isinstance(payload, list) else [payload]
+                if query.operation == 'insert':
+                    affected = self._insert(query.table, rows)
+                else:
+                    affected = self._upsert(query.table, rows, query.on_conflict, query.ignore_duplicates)
+            else:
+                affected = self._matching(query)
+                if query.operation == 'update':
+                    affected = self._update(query.table, affected, json.loads(json.dumps(query.payload)))
+                elif query.operation == 'delete':
+                    self._delete(query.table, affected)
+
+            if query.operation != 'select' and query.table in VERSIONED_TABLES:
+                self._bump_version(query.table)
+
+            count = len(affected) if query.count else None
+            if query.operation == 'select':
+                affected = self._order(affected, query.orders)[:query.row_limit]
+            elif query.returning == ReturnMethod.minimal:
+                return QueryResult([], count)
+            return QueryResult([self._project(query.table, row, query.columns) for row in affected], count)
+
+    # Reads
+    def _rows(self, table):
+        view = getattr(self, f'view_{table}', None)
+        return view() if view else self.tables[table].values()
+
+    def _matching(self, query):
+        return [row for row in self._rows(query.table) if all(predicate(row) for predicate in query.filters)]
+
+    def _order(self, rows, orders):
+        rows = list(rows)
+        for column, descending in reversed(orders):
+            rows.sort(key=lambda row: _sort_key(row.get(column)), reverse=descending)
+        return rows
+
+    def _project(self, table, row, columns):
+        """Select a PostgREST column list from a row, resolving embeds such as carbon_sources(*)"""
+        result = {}
+        for item in _split_top_level(columns):
+            if item == '*':
+                result.update(row)
+            elif '(' in item:
+                name, _, inner = item.partition('(')
+                name = name.strip()
+                if (table, name) not in FOREIGN_KEYS:
+                    raise _error('PGRST200', f"Could not find a relationship between '{table}' and '{name}' in the schema cache")
+                column, referenced = FOREIGN_KEYS[(table, name)]
+                target = self._find(name, referenced, row.get(column))
+                result[name] = self._project(name, target, inner[:-1]) if target else None
+            else:
+                result[item] = row.get(item)
+        return result
+
+    def _find(self, table, column, value):
+        if value is None:
+            return None
+        if column == TABLES[table][0]:
+            return self.tables[table].get(value)
+        return next((row for row in self.tables[table].values() if row.get(column) == value), None)
+
+    def _find_user(self, email, user_id=None):
+        if user_id is not None:
+            return self._find('user_accounts', 'id', _cast(user_id, 0))
+        return self._find('user_accounts', 'email', email)
+
+    # Writes
+    def _unique_keys(self, table, row):
+        """(columns, values) of each unique constraint that applies to a row (nulls never conflict)"""
+        for columns in self._unique[table]:
+            values = tuple(row.get(column) for column in columns)
+            if None not in values:
+                yield columns, values
+
+    def _check_unique(self, table, row, ignore_key=None):
+        key_column = TABLES[table][0]
+        if row[key_column] != ignore_key and row[key_column] in self.tables[table]:
+            raise _error(
+                '23505', f'duplicate key value violates unique constraint "{table}_pkey"',
+                f'Key ({key_column})=({row[key_column]}) already exists.'
+            )
+        for columns, values in self._unique_keys(table, row):
+            owner = self._unique[table][columns].get(values)
+            if owner is not None and owner != ignore_key:
+                raise _error(
+                    '23505', f'duplicate key value violates unique constraint "{table}_{"_".join(columns)}_key"',
+                    f'Key ({", ".join(columns)})=({", ".join(map(str, values))}) already exists.'
+                )
+
+    def _store(self, table, row):
+        key = row[TABLES[table][0]]
+        self.tables[table][key] = row
+        for columns, values in self._unique_keys(table, row):
+            self._unique[table][columns][values] = key
+
+    def _unstore(self, table, row):
+        key = self.tables[table].pop(row[TABLES[table][0]])
+        for columns, values in self._unique_keys(table, row):
+            self._unique[table][columns].pop(values, None)
+        return key
+
+    def _insert(self, table, rows):
+        key_column, serial, _ = TABLES[table]
+        created = []
+        # Check the whole statement before storing anything, so a conflict inserts no rows
+        pending = {}
+        for data in rows:
+            row = {column: default() if callable(default) else default for column, default in DEFAULTS.get(table, {}).items()}
+            row.update(data)
+            if serial and row.get(key_column) is None:
+                self._sequences[table] += 1
+                row[key_column] = self._sequences[table]
+            self._check_unique(table, row)
+            if row[key_column] in pending:
+                raise _error('23505', f'duplicate key value violates unique constraint "{table}_pkey"')
+            pending[row[key_column]] = row
+            created.append(row)
+        for row in created:
+            self._store(table, row)
+        return created
+
+    def _upsert(self, table, rows, on_conflict, ignore_duplicates):
+        conflict_columns = tuple(column.strip() for column in on_conflict.split(',') if column.strip()) or (TABLES[table][0],)
+        affected = []
+        for data in rows:
+            values = tuple(data.get(column) for column in conflict_columns)
+            if conflict_columns == (TABLES[table][0],):
+                existing = self.tables[table].get(values[0])
+            else:
+                key = self._unique[table].get(conflict_columns, {}).get(values)
+                existing = self.tables[table].get(key)
+            if existing is None:
+                affected.extend(self._insert(table, [data]))
+            elif not ignore_duplicates:
+                affected.extend(self._update(table, [existing], data))
+        return affected
+
+    def _update(self, table, rows, data):
+        key_column = TABLES[table][0]
+        updated = []
+        for row in rows:
+            new_row = {**row, **data}
+            self._check_unique(table, new_row, ignore_key=row[key_column])
+            self._unstore(table, row)
+            self._store(table, new_row)
+            updated.append(new_row)
+        return updated
+
+    def _delete(self, table, rows):
+        for row in rows:
+            if row[TABLES[table][0]] not in self.tables[table]:
+                continue
+            self._unstore(table, row)
+            for (child, parent), (column, referenced) in FOREIGN_KEYS.items():
+                if parent == table:
+                    self._delete(child, [child_row for child_row in self.tables[child].values() if child_row.get(column) == row.get(referenced)])
+
+    def _bump_version(self, name):
+        stamp = self.tables['catalog_versions'][name]
+        self._update('catalog_versions', [stamp], {'version': stamp['version'] + 1, 'updated_at': _now()})
+
+    # Views standing in for the rollup tables the triggers in 004_carbon_record_rollups.sql maintain
+    def _rollup(self, period):
+        totals = {}
+        for record in self.tables['carbon_records'].values():
+            key = (record['user_id'], record['source_uid'], period(record['date']))
+            total = totals.setdefault(key, [0.0, 0])
+            total[0] += record['amount']
+            total[1] += 1
+        return totals.items()
+
+    def view_carbon_record_daily_rollups(self):
+        return [
+            {'user_id': user_id, 'source_uid': source_uid, 'day': day, 'total_amount': amount, 'record_count': count}
+            for (user_id, source_uid, day), (amount, count) in self._rollup(lambda day: day)
+        ]
+
+    def view_carbon_record_monthly_rollups(self):
+        return [
+            {'user_id': user_id, 'source_uid': source_uid, 'month': month, 'total_amount': amount, 'record_count': count}
+            for (user_id, source_uid, month), (amount, count) in self._rollup(lambda day: day[:8] + '01')
+        ]
+
+    # Database functions (supabase/migrations/003, 005, 008, 010, 011 and 012)
+    def rpc_carbon_consumption_totals(self, p_user_id, p_start_date=None, p_end_date=None):
+        amount, count = 0.0, 0
+        for record in self.tables['carbon_records'].values():
+            if (_matches(record['user_id'], 'eq', p_user_id)
+                    and (p_start_date is None or record['date'] >= p_start_date)
+                    and (p_end_date is None or record['date'] <= p_end_date)):
+                amount += record['amount']
+                count += 1
+        return [{'total_amount': amount, 'record_count': count}]
+
+    def rpc_carbon_consumption_series(self, p_user_id, p_start_date, p_end_date, p_bucket='day', p_split_by_source=False):
+        buckets = {}
+        for row in self.view_carbon_record_daily_rollups():
+            if not (_matches(row['user_id'], 'eq', p_user_id) and p_start_date <= row['day'] <= p_end_date):
+                continue
+            day = date.fromisoformat(row['day'])
+            if p_bucket == 'week':
+                day -= timedelta(days=day.weekday())
+            elif p_bucket == 'month':
+                day = day.replace(day=1)
+            key = (day.isoformat(), row['source_uid'] if p_split_by_source else None)
+            total = buckets.setdefault(key, [0.0, 0])
+            total[0] += row['total_amount']
+            total[1] += row['record_count']
+        return [
+            {'period_start': period_start, 'source_uid': source_uid, 'total_amount': amount, 'record_count': count}
+            for (period_start, source_uid), (amount, count) in sorted(buckets.items(), key=lambda item: (item[0][0], item[0][1] or ''))
+        ]
+
+    def rpc_add_source_to_user(self, p_email, p_source_uid, p_user_id=None):
+        user = self._find_user(p_email, p_user_id)
+        if user is None:
+            return {'status': 404, 'error': 'User not found'}
+        if p_source_uid not in self.tables['carbon_sources']:
+            return {'status': 404, 'error': 'Source not found'}
+        profile = self._find('user_profiles', 'user_id', user['id']) or self._insert('user_profiles', [{'user_id': user['id']}])[0]
+        if self._unique['user_profile_sources'][('user_profile_id', 'carbon_source_uid')].get((profile['id'], p_source_uid)):
+            return {'status': 400, 'error': 'Source already added to user profile'}
+        link = self._insert('user_profile_sources', [{'user_profile_id': profile['id'], 'carbon_source_uid': p_source_uid}])[0]
+        return {
+            'status': 201,
+            'user_id': user['id'],
+            'profile_id': profile['id'],
+            'data': {'id': link['id'], 'user_profile_id': profile['id'], 'carbon_source_uid': p_source_uid}
+        }
+
+    def rpc_remove_source_from_user(self, p_email, p_source_uid, p_user_id=None):
+        user = self._find_user(p_email, p_user_id)
+        if user is None:
+            return {'status': 404, 'error': 'User not found'}
+        profile = self._find('user_profiles', 'user_id', user['id'])
+        if profile is None:
+            return {'status': 404, 'error': 'User profile not found'}
+        key = self._unique['user_profile_sources'][('user_profile_id', 'carbon_source_uid')].get((profile['id'], p_source_uid))
+        if key is None:
+            return {'status': 404, 'error': 'Source not found in user profile'}
+        self._delete('user_profile_sources', [self.tables['user_profile_sources'][key]])
+        return {'status': 200, 'user_id': user['id'], 'profile_id': profile['id']}
+
+    def rpc_upsert_carbon_records(self, p_rows):
+        rejected = []
+        for row in p_rows:
+            existing = self.tables['carbon_records'].get(row['uid'])
+            if existing is None:
+                self._insert('carbon_records', [row])
+            elif existing['user_id'] == row['user_id']:
+                self._update('carbon_records', [existing], {column: value for column, value in row.items() if column != 'user_id'})
+            else:
+                rejected.append(row['uid'])
+        return rejected
+
+    def rpc_update_carbon_record_footprints(self, p_rows):
+        changed = []
+        for update in p_rows:
+            record = self.tables['carbon_records'].get(update['uid'])
+            if record and (record['footprint'], record['emission_factor']) != (update['footprint'], update['emission_factor']):
+                changed.append((record, update))
+        for record, update in changed:
+            self._update('carbon_records', [record], {'footprint': update['footprint'], 'emission_factor': update['emission_factor']})
+        return len(changed)
+
+
+# Global instance shared by the sync and async clients of the memory storage backend
+memory_database = MemoryDatabase(latency=getattr(settings, 'MEMORY_BACKEND_LATENCY_MS', 0) / 1000)
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help) for every metric this module exposes
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by view, method and status'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by view'),
+    'backend_calls_total': ('counter', 'Backend (PostgREST / SQL) calls by table and operation'),
+    'backend_call_errors_total': ('counter', 'Backend calls that raised, by table and operation'),
+    'backend_call_duration_seconds': ('histogram', 'Backend call latency by table'),
+}
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms kept in per-thread shards, so recording is a couple of dict
+    updates with no lock; shards are only merged when metrics are exposed.
+
+    Only counters and bucketed histograms are kept, so values from several worker
+    processes can be summed: with ``directory`` set, each process writes its totals there
+    at most every ``flush_interval`` seconds and the exposition sums every process's file.
+    """
+
+    def __init__(self, directory=None, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._next_flush = 0.0
+        if hasattr(os, 'register_at_fork'):
+            # A forked worker starts from zero instead of repeating the parent's counts
+            os.register_at_fork(after_in_child=self._reset)
+
+    def increment(self, name, labels, amount=1):
+        """Add to a counter; labels is a tuple of (label, value) pairs"""
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Record a value in a histogram with LATENCY_BUCKETS"""
+        histograms = self._shard()[1]
+        key = (name, labels)
+        series = histograms.get(key)
+        if series is None:
+            # per-bucket (non-cumulative) counts, then sum and count
+            series = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+        series[bisect_left(LATENCY_BUCKETS, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def maybe_flush(self):
+        """Write this process's totals to the metrics directory if the flush interval elapsed"""
+        if self.directory and time.monotonic() >= self._next_flush:
+            self._next_flush = time.monotonic() + self.flush_interval
+            self.flush()
+
+    def flush(self):
+        """Atomically write this process's totals to <directory>/<pid>.json"""
+        counters, histograms = self._totals()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump({
+                'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                'histograms': [[name, labels, series] for (name, labels), series in histograms.items()]
+            }, file)
+        os.replace(temporary_path, path)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        counters, histograms = self._collect()
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{self._labels(labels)} {value}')
+                continue
+            for (metric, labels), series in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), series):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{self._labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{self._labels(labels)} {series[-2]}')
+                lines.append(f'{name}_count{self._labels(labels)} {series[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    def _reset(self):
+        """Drop every shard, e.g. in a freshly forked worker"""
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._next_flush = 0.0
+
+    def _shard(self):
+        """Return this thread's (counters, histograms) shard"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _totals(self):
+        """Merge every thread's shard of this process"""
+        counters, histograms = {}, {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard_counters, shard_histograms in shards:
+            self._merge(counters, histograms, shard_counters.copy().items(), shard_histograms.copy().items())
+        return counters, histograms
+
+    def _collect(self):
+        """Merge this process's totals with the files other processes wrote"""
+        counters, histograms = self._totals()
+        if not self.directory:
+            return counters, histograms
+        own_file = f'{os.getpid()}.json'
+        for filename in os.listdir(self.directory) if os.path.isdir(self.directory) else ():
+            if not filename.endswith('.json') or filename == own_file:
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            self._merge(
+                counters, histograms,
+                [((name, tuple(map(tuple, labels))), value) for name, labels, value in data['counters']],
+                [((name, tuple(map(tuple, labels))), series) for name, labels, series in data['histograms']]
+            )
+        return counters, histograms
+
+    def _merge(self, counters, histograms, counter_items, histogram_items):
+        for key, value in counter_items:
+            counters[key] = counters.get(key, 0) + value
+        for key, series in histogram_items:
+            total = histograms.get(key)
+            histograms[key] = list(series) if total is None else [a + b for a, b in zip(total, series)]
+
+    def _labels(self, labels):
+        """Format label pairs as {label="value",...}"""
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{label}="{self._escape(value)}"' for label, value in labels) + '}'
+
+    def _escape(self, value):
+        """Escape a label value for the exposition format"""
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Global instance
+metrics = MetricsRegistry(
+    directory=getattr(settings, 'METRICS_DIR', '') or None,
+    flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+)
@@ -0,0 +1,282 @@
+import json
+import logging
+import random
+import re
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import JsonResponse
+from .instrumentation import end_request, record_sql, start_request
+from .metrics import metrics
+from .profiling import ProfileStore, start_profile, stop_profile, verify_profile_token
+from .tokens import TokenRevoked, acheck_revoked, check_revoked, verify_token
+
+logger = logging.getLogger('api.requests')
+
+# Server-Timing entries beyond the total, one per table and operation
+SERVER_TIMING_MAX_ENTRIES = 20
+
+
+class SessionTokenMiddleware:
+    """
+    Authenticate ``Authorization: Bearer <token>`` session tokens issued by user_login.
+
+    The signature and expiry are checked locally and revocation with one cache lookup,
+    so ``request.identity`` (a TokenIdentity, or None without a token) costs no database
+    round trip. A bad, expired or revoked token is rejected with 401.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        identity, error_response = self.authenticate(request)
+        if error_response:
+            return error_response
+        if identity:
+            try:
+                check_revoked(identity)
+            except TokenRevoked as e:
+                return JsonResponse({'error': str(e)}, status=401)
+        request.identity = identity
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        identity, error_response = self.authenticate(request)
+        if error_response:
+            return error_response
+        if identity:
+            try:
+                await acheck_revoked(identity)
+            except TokenRevoked as e:
+                return JsonResponse({'error': str(e)}, status=401)
+        request.identity = identity
+        return await self.get_response(request)
+
+    def authenticate(self, request):
+        """Return (identity, error_response) for the request's bearer token"""
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return None, None
+        try:
+            return verify_token(token.strip()), None
+        except signing.SignatureExpired:
+            return None, JsonResponse({'error': 'Token has expired'}, status=401)
+        except signing.BadSignature:
+            return None, JsonResponse({'error': 'Invalid token'}, status=401)
+
+
+def _record_orm_query(execute, sql, params, many, context):
+    """Database execute wrapper that records each ORM query as a backend call"""
+    start = time.perf_counter()
+    try:
+        result = execute(sql, params, many, context)
+    except Exception:
+        record_sql(sql, 0, time.perf_counter() - start, error=True)
+        raise
+    rowcount = context['cursor'].rowcount
+    record_sql(sql, rowcount if rowcount >= 0 else None, time.perf_counter() - start)
+    return result
+
+
+class BackendTimingMiddleware:
+    """
+    Collect the backend calls (PostgREST requests, SQL statements) made while serving a
+    request and report them in a Server-Timing header and one structured ``api.requests``
+    log line. With BACKEND_N_PLUS_ONE_WARNINGS on, a request that reads the same table
+    BACKEND_N_PLUS_ONE_THRESHOLD or more times is logged as a likely N+1.
+
+    Calls made while a streaming response is consumed happen after the headers are sent
+    and are not included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.record_orm = getattr(settings, 'STORAGE_BACKEND', 'supabase') == 'django'
+        self.n_plus_one_threshold = (
+            getattr(settings, 'BACKEND_N_PLUS_ONE_THRESHOLD', 3)
+            if getattr(settings, 'BACKEND_N_PLUS_ONE_WARNINGS', False) else None
+        )
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        calls, token = start_request()
+        start = time.perf_counter()
+        try:
+            if self.record_orm:
+                with connection.execute_wrapper(_record_orm_query):
+                    response = self.get_response(request)
+            else:
+                response = self.get_response(request)
+        finally:
+            end_request(token)
+        self.report(request, response, calls, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        calls, token = start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        self.report(request, response, calls, time.perf_counter() - start)
+        return response
+
+    def report(self, request, response, calls, duration):
+        """Add the Server-Timing header, log the request and warn about repeated same-table reads"""
+        groups = {}
+        for call in calls:
+            group = groups.setdefault((call.table, call.operation), [0, 0.0])
+            group[0] += 1
+            group[1] += call.duration_ms
+        backend_ms = sum(call.duration_ms for call in calls)
+
+        entries = [f'backend;desc="{len(calls)} calls";dur={backend_ms:.1f}']
+        for (table, operation), (count, total_ms) in list(groups.items())[:SERVER_TIMING_MAX_ENTRIES]:
+            name = re.sub(r'[^\w.-]', '_', f'{table}.{operation}')
+            entries.append(f'{name};desc="{count}x";dur={total_ms:.1f}')
+        response['Server-Timing'] = ', '.join(entries)
+
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'backend_calls': len(calls),
+            'backend_ms': round(backend_ms, 1),
+            'calls': [
+                {
+                    'table': call.table,
+                    'operation': call.operation,
+                    'filters': list(call.filters),
+                    'rows': call.rows,
+                    'ms': round(call.duration_ms, 1),
+                    'error': call.error
+                }
+                for call in calls
+            ]
+        }))
+
+        if self.n_plus_one_threshold:
+            for (table, operation), (count, _) in groups.items():
+                if operation == 'select' and count >= self.n_plus_one_threshold:
+                    logger.warning(
+                        'Possible N+1: %s %s read %s %d times in one request',
+                        request.method, request.path, table, count
+                    )
+
+
+class MetricsMiddleware:
+    """
+    Count requests by view, method and status and record their latency per view in the
+    process metrics exposed at /api/metrics/. Views are labelled by URL name (e.g.
+    ``accounts:user_login``) rather than path, so ids in URLs don't multiply the series.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, duration):
+        match = request.resolver_match
+        view = match.view_name if match else '<unmatched>'
+        metrics.increment('http_requests_total', (('view', view), ('method', request.method), ('status', str(response.status_code))))
+        metrics.observe('http_request_duration_seconds', (('view', view),), duration)
+        metrics.maybe_flush()
+
+
+class ProfilingMiddleware:
+    """
+    Run cProfile around the view for requests carrying a valid ``X-Profile-Request`` token
+    (see the issue_profile_token command) or picked by PROFILING_SAMPLE_RATE. The profile is
+    written to PROFILING_DIR, which keeps the newest PROFILING_MAX_FILES, and its id is
+    returned in the ``X-Profile-Id`` header; load it with ``pstats`` or snakeviz.
+
+    Removed from the middleware chain unless PROFILING_ENABLED is set, and otherwise costs
+    a header lookup per request that isn't profiled. One request is profiled at a time per
+    process. Profiles of async views also include other work run on the event loop meanwhile.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.store = ProfileStore(settings.PROFILING_DIR, getattr(settings, 'PROFILING_MAX_FILES', 200))
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profiler = start_profile() if self.should_profile(request) else None
+        if profiler is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_profile(profiler)
+        return self.save(request, response, profiler)
+
+    async def __acall__(self, request):
+        profiler = start_profile() if self.should_profile(request) else None
+        if profiler is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_profile(profiler)
+        return self.save(request, response, profiler)
+
+    def should_profile(self, request):
+        token = request.headers.get('X-Profile-Request')
+        if token:
+            return verify_profile_token(token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def save(self, request, response, profiler):
+        """Write the profile and add its id to the response"""
+        try:
+            profile_id = self.store.save(profiler)
+        except OSError:
+            logger.exception('Could not write the profile of %s %s', request.method, request.path)
+            return response
+        logger.info('Profiled %s %s as %s', request.method, request.path, profile_id)
+        response['X-Profile-Id'] = profile_id
+        return response
@@ -0,0 +1,57 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_carbonrecord_carbonsource_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150, unique=True)),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('password_hash', models.CharField(max_length=255)),
+                ('first_name', models.CharField(blank=True, default='', max_length=150)),
+                ('last_name', models.CharField(blank=True, default='', max_length=150)),
+                ('is_active', models.BooleanField(default=True)),
+                ('date_joined', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='carbonsource',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='carbonsource',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='user',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='profile', to='api.useraccount'),
+        ),
+        migrations.AlterField(
+            model_name='carbonrecord',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.useraccount'),
+        ),
+        migrations.AddIndex(
+            model_name='carbonrecord',
+            index=models.Index(fields=['user', 'source', 'date'], name='carbonrecord_user_source_date'),
+        ),
+        migrations.AddIndex(
+            model_name='carbonrecord',
+            index=models.Index(fields=['user', 'date'], name='carbonrecord_user_date'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_storage_backend_models'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carbonsource',
+            index=models.Index(fields=['created_at', 'uid'], name='carbonsource_created_uid'),
+        ),
+        migrations.AddIndex(
+            model_name='useraccount',
+            index=models.Index(fields=['created_at', 'id'], name='useraccount_created_id'),
+        ),
+    ]
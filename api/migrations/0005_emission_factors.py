@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_category_factors(apps, schema_editor):
+    """Seed the category factors that used to be hard-coded in calculate_footprint"""
+    EmissionFactor = apps.get_model('api', 'EmissionFactor')
+    if not EmissionFactor.objects.exists():
+        EmissionFactor.objects.bulk_create([
+            EmissionFactor(category='Travel', factor=2.3),
+            EmissionFactor(category='Dining & Shopping', factor=1.5),
+            EmissionFactor(category='Utility & Bills', factor=0.8),
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmissionFactor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(blank=True, max_length=100, null=True)),
+                ('factor', models.FloatField()),
+                ('unit', models.CharField(default='unit', max_length=50)),
+                ('valid_from', models.DateField(blank=True, null=True)),
+                ('valid_to', models.DateField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('source', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='emission_factors', to='api.carbonsource')),
+            ],
+        ),
+        migrations.RunPython(seed_category_factors, migrations.RunPython.noop),
+    ]
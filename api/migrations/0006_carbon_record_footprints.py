@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_emission_factors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carbonrecord',
+            name='emission_factor',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='carbonrecord',
+            name='footprint',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='carbonrecord',
+            index=models.Index(fields=['source', 'date', 'uid'], name='carbonrecord_source_date_uid'),
+        ),
+    ]
@@ -1,9 +1,25 @@
 from django.db import models
-from django.contrib.auth.models import User
 
 
+class UserAccount(models.Model):
+    username = models.CharField(max_length=150, unique=True)
+    email = models.EmailField(max_length=254, unique=True)
+    password_hash = models.CharField(max_length=255)
+    first_name = models.CharField(max_length=150, blank=True, default='')
+    last_name = models.CharField(max_length=150, blank=True, default='')
+    is_active = models.BooleanField(default=True)
+    date_joined = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='useraccount_created_id'),
+        ]
+
 class UserProfile(models.Model):
     uid = models.CharField(max_length=100, blank=True, null=True)
+    user = models.OneToOneField(UserAccount, on_delete=models.CASCADE, blank=True, null=True, related_name='profile')
     currentSources = models.ManyToManyField('CarbonSource', blank=True, related_name='user_profiles')
 
 class CarbonSource(models.Model):
@@ -11,10 +27,36 @@ class CarbonSource(models.Model):
     uid = models.CharField(max_length=100,primary_key=True)
     description = models.CharField(max_length=100)
     sourceType = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'uid'], name='carbonsource_created_uid'),
+        ]
     
 class CarbonRecord(models.Model):
     uid = models.CharField(max_length=100,primary_key=True)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
     source = models.ForeignKey(CarbonSource, on_delete=models.CASCADE)
     amount = models.FloatField()
     date = models.DateField()
+    footprint = models.FloatField(blank=True, null=True)
+    emission_factor = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'source', 'date'], name='carbonrecord_user_source_date'),
+            models.Index(fields=['user', 'date'], name='carbonrecord_user_date'),
+            models.Index(fields=['source', 'date', 'uid'], name='carbonrecord_source_date_uid'),
+        ]
+
+class EmissionFactor(models.Model):
+    source = models.ForeignKey(CarbonSource, on_delete=models.CASCADE, blank=True, null=True, related_name='emission_factors')
+    category = models.CharField(max_length=100, blank=True, null=True)
+    factor = models.FloatField()
+    unit = models.CharField(max_length=50, default='unit')
+    valid_from = models.DateField(blank=True, null=True)
+    valid_to = models.DateField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
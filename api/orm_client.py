@@ -0,0 +1,339 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FloatField, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+from .models import UserAccount, UserProfile, CarbonSource, CarbonRecord, EmissionFactor
+from .supabase_client import ACCOUNT_UNIQUE_COLUMNS, QueryResult, UniqueViolation, unique_violation_column
+from .pagination import USER_ACCOUNT_KEY, CARBON_SOURCE_KEY, CARBON_RECORD_KEY, EMISSION_FACTOR_KEY, NULLABLE_KEY_COLUMNS
+
+UserProfileSource = UserProfile.currentSources.through
+
+# API column name -> model field name for each Supabase table backed by a model
+ACCOUNT_FIELDS = {
+    name: name
+    for name in ('id', 'username', 'email', 'password_hash', 'first_name', 'last_name',
+                 'is_active', 'date_joined', 'created_at', 'updated_at')
+}
+SOURCE_FIELDS = {
+    'uid': 'uid',
+    'name': 'name',
+    'description': 'description',
+    'source_type': 'sourceType',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+RECORD_FIELDS = {
+    'uid': 'uid',
+    'user_id': 'user_id',
+    'source_uid': 'source_id',
+    'amount': 'amount',
+    'date': 'date',
+    'footprint': 'footprint',
+    'emission_factor': 'emission_factor',
+}
+PROFILE_FIELDS = {
+    'id': 'id',
+    'uid': 'uid',
+    'user_id': 'user_id',
+}
+FACTOR_FIELDS = {
+    'id': 'id',
+    'source_uid': 'source_id',
+    'category': 'category',
+    'factor': 'factor',
+    'unit': 'unit',
+    'valid_from': 'valid_from',
+    'valid_to': 'valid_to',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+CATALOG_MODELS = {
+    'emission_factors': EmissionFactor,
+    'carbon_sources': CarbonSource,
+}
+
+
+class DjangoORMClient:
+    """
+    Storage backend that runs on the Django models in api/models.py.
+
+    Exposes the same methods the views use on SupabaseClient, so the whole API can run
+    against the local Django database (STORAGE_BACKEND=django) with no network hops.
+    Activity operations are not modelled and are not available on this backend.
+    """
+
+    def values(self, queryset, columns, fields):
+        """Select a PostgREST-style column list, renaming model fields to their API names"""
+        if columns.strip() == '*':
+            names = list(fields)
+        else:
+            names = [column.strip() for column in columns.split(',')]
+        plain = [name for name in names if fields.get(name) == name]
+        renamed = {name: F(fields[name]) for name in names if name in fields and fields[name] != name}
+        unknown = [name for name in names if name not in fields]
+        if unknown:
+            raise ValueError(f'Unsupported column: {", ".join(unknown)}')
+        return list(queryset.values(*plain, **renamed))
+
+    def source_dict(self, source):
+        """Serialize a CarbonSource with its API column names"""
+        return {name: getattr(source, field) for name, field in SOURCE_FIELDS.items()}
+
+    def keyset(self, queryset, key_columns, fields, limit=None, after=None):
+        """Order a queryset by its keyset columns and resume after the cursor ``after``"""
+        names = [fields[column] for column in key_columns]
+        if after is not None:
+            # Same shape as keyset_condition(): nulls of NULLABLE_KEY_COLUMNS sort after every value
+            condition, prefix = Q(pk__in=[]), {}
+            for column, name, value in zip(key_columns, names, after):
+                if value is None:
+                    prefix[f'{name}__isnull'] = True
+                    continue
+                condition |= Q(**prefix, **{f'{name}__gt': value})
+                if column in NULLABLE_KEY_COLUMNS:
+                    condition |= Q(**prefix, **{f'{name}__isnull': True})
+                prefix[name] = value
+            queryset = queryset.filter(condition)
+        queryset = queryset.order_by(*names)
+        return queryset[:limit] if limit is not None else queryset
+
+    def model_data(self, data, fields):
+        """Translate API column names in a write payload to model field names"""
+        return {fields.get(name, name): value for name, value in data.items()}
+
+    # User Account operations
+    def create_user_account(self, data):
+        """Create a new user account, raising UniqueViolation if the username or email is taken"""
+        try:
+            with transaction.atomic():
+                account = UserAccount.objects.create(**data)
+        except IntegrityError as e:
+            raise UniqueViolation(unique_violation_column(str(e), ACCOUNT_UNIQUE_COLUMNS)) from e
+        return QueryResult([{column: getattr(account, field) for column, field in ACCOUNT_FIELDS.items()}])
+
+    def get_user_account(self, user_id):
+        """Get user account by ID"""
+        return QueryResult(list(UserAccount.objects.filter(id=user_id).values()))
+
+    def get_user_account_by_email(self, email, columns='*', exclude_id=None):
+        """Get user account by email, optionally ignoring the account with ID exclude_id"""
+        queryset = UserAccount.objects.filter(email=email)
+        if exclude_id is not None:
+            queryset = queryset.exclude(id=exclude_id)
+        return QueryResult(self.values(queryset, columns, ACCOUNT_FIELDS))
+
+    def get_user_account_by_username(self, username, columns='*'):
+        """Get user account by username"""
+        queryset = UserAccount.objects.filter(username=username)
+        return QueryResult(self.values(queryset, columns, ACCOUNT_FIELDS))
+
+    def update_user_account(self, user_id, data):
+        """Update user account"""
+        UserAccount.objects.filter(id=user_id).update(updated_at=timezone.now(), **data)
+        return self.get_user_account(user_id)
+
+    def delete_user_account(self, user_id):
+        """Delete user account"""
+        deleted = self.get_user_account(user_id)
+        UserAccount.objects.filter(id=user_id).delete()
+        return deleted
+
+    def list_user_accounts(self, limit=None, after=None):
+        """List user accounts in (created_at, id) order, one keyset page at a time"""
+        queryset = self.keyset(UserAccount.objects.all(), USER_ACCOUNT_KEY, ACCOUNT_FIELDS, limit, after)
+        return QueryResult(list(queryset.values()))
+
+    # User Profile operations
+    def get_user_profile(self, user_id, columns='*'):
+        """Get user profile by user ID"""
+        return QueryResult(self.values(UserProfile.objects.filter(user_id=user_id), columns, PROFILE_FIELDS))
+
+    def create_user_profile(self, data):
+        """Create a new user profile"""
+        profile = UserProfile.objects.create(**data)
+        return QueryResult([{'id': profile.id, 'uid': profile.uid, 'user_id': profile.user_id}])
+
+    # User Profile source operations
+    def add_source_to_user(self, email, source_uid, user_id=None):
+        """Link a carbon source to the profile of the user with this email (or user_id), creating the profile if needed"""
+        with transaction.atomic():
+            account = UserAccount.objects.filter(**({'id': user_id} if user_id is not None else {'email': email}))
+            user_id = account.values_list('id', flat=True).first()
+            if user_id is None:
+                return QueryResult({'status': 404, 'error': 'User not found'})
+            if not CarbonSource.objects.filter(uid=source_uid).exists():
+                return QueryResult({'status': 404, 'error': 'Source not found'})
+
+            profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
+            link, created = UserProfileSource.objects.get_or_create(userprofile=profile, carbonsource_id=source_uid)
+            if not created:
+                return QueryResult({'status': 400, 'error': 'Source already added to user profile'})
+
+        return QueryResult({
+            'status': 201,
+            'user_id': user_id,
+            'profile_id': profile.id,
+            'data': {
+                'id': link.id,
+                'user_profile_id': profile.id,
+                'carbon_source_uid': source_uid
+            }
+        })
+
+    def remove_source_from_user(self, email, source_uid, user_id=None):
+        """Unlink a carbon source from the profile of the user with this email (or user_id)"""
+        account = UserAccount.objects.filter(
+            **({'id': user_id} if user_id is not None else {'email': email})
+        ).values('id', 'profile__id').first()
+        if account is None:
+            return QueryResult({'status': 404, 'error': 'User not found'})
+        if account['profile__id'] is None:
+            return QueryResult({'status': 404, 'error': 'User profile not found'})
+
+        deleted, _ = UserProfileSource.objects.filter(
+            userprofile_id=account['profile__id'], carbonsource_id=source_uid
+        ).delete()
+        if not deleted:
+            return QueryResult({'status': 404, 'error': 'Source not found in user profile'})
+
+        return QueryResult({'status': 200, 'user_id': account['id'], 'profile_id': account['profile__id']})
+
+    def list_user_profile_sources(self, profile_id, columns='carbon_source_uid, carbon_sources(*)'):
+        """List the sources linked to a user profile, joining the carbon source rows in the same query"""
+        links = UserProfileSource.objects.filter(userprofile_id=profile_id).select_related('carbonsource')
+        return QueryResult([
+            {
+                'carbon_source_uid': link.carbonsource_id,
+                'carbon_sources': self.source_dict(link.carbonsource)
+            }
+            for link in links
+        ])
+
+    # Carbon Source operations
+    def create_carbon_source(self, data):
+        """Create a new carbon source"""
+        source = CarbonSource.objects.create(**self.model_data(data, SOURCE_FIELDS))
+        return QueryResult([self.source_dict(source)])
+
+    def get_carbon_source(self, source_id, columns='*'):
+        """Get a specific carbon source by UID"""
+        return QueryResult(self.values(CarbonSource.objects.filter(uid=source_id), columns, SOURCE_FIELDS))
+
+    def update_carbon_source(self, source_id, data):
+        """Update a carbon source"""
+        CarbonSource.objects.filter(uid=source_id).update(
+            updated_at=timezone.now(), **self.model_data(data, SOURCE_FIELDS)
+        )
+        return self.get_carbon_source(source_id)
+
+    def delete_carbon_source(self, source_id):
+        """Delete a carbon source"""
+        deleted = self.get_carbon_source(source_id)
+        CarbonSource.objects.filter(uid=source_id).delete()
+        return deleted
+
+    def list_carbon_sources(self, columns='*', limit=None, after=None):
+        """List carbon sources in (created_at, uid) order, one keyset page at a time"""
+        queryset = self.keyset(CarbonSource.objects.all(), CARBON_SOURCE_KEY, SOURCE_FIELDS, limit, after)
+        return QueryResult(self.values(queryset, columns, SOURCE_FIELDS))
+
+    def get_carbon_sources_by_uid(self, source_uids, columns='uid'):
+        """Get the carbon sources whose UID is in source_uids with a single query"""
+        return QueryResult(self.values(CarbonSource.objects.filter(uid__in=list(source_uids)), columns, SOURCE_FIELDS))
+
+    # Emission factor registry operations
+    def list_emission_factors(self, columns='*', limit=None, after=None):
+        """List emission factors in id order, one keyset page at a time"""
+        queryset = self.keyset(EmissionFactor.objects.all(), EMISSION_FACTOR_KEY, FACTOR_FIELDS, limit, after)
+        return QueryResult(self.values(queryset, columns, FACTOR_FIELDS))
+
+    def get_catalog_versions(self, names):
+        """Derive catalog version stamps from each table's row count and latest update (there are no triggers here)"""
+        rows = []
+        for name in names:
+            stats = CATALOG_MODELS[name].objects.aggregate(count=Count('pk'), latest=Max('updated_at'))
+            latest = stats['latest'].isoformat() if stats['latest'] else ''
+            rows.append({'name': name, 'version': f"{stats['count']}:{latest}"})
+        return QueryResult(rows)
+
+    # Carbon record operations
+    def records(self, user_id, start_date=None, end_date=None, source_uid=None):
+        """Filter carbon records the way the (user, source, date) index expects"""
+        queryset = CarbonRecord.objects.filter(user_id=user_id)
+        if source_uid:
+            queryset = queryset.filter(source_id=source_uid)
+        if start_date:
+            queryset = queryset.filter(date__gte=start_date)
+        if end_date:
+            queryset = queryset.filter(date__lte=end_date)
+        return queryset
+
+    def list_carbon_records(self, user_id, start_date=None, end_date=None, source_uid=None, columns='*', limit=None, after=None):
+        """List carbon records for a user in (date, uid) order, optionally filtered by source and date range"""
+        queryset = self.keyset(
+            self.records(user_id, start_date, end_date, source_uid), CARBON_RECORD_KEY, RECORD_FIELDS, limit, after
+        )
+        return QueryResult(self.values(queryset, columns, RECORD_FIELDS))
+
+    def upsert_carbon_records(self, records):
+        """Insert carbon records, or update the existing ones of the same user, by UID.
+
+        Returns the uids of the records left alone because they belong to another user.
+        """
+        rows = [CarbonRecord(**self.model_data(record, RECORD_FIELDS)) for record in records]
+        with transaction.atomic():
+            owners = dict(
+                CarbonRecord.objects.select_for_update()
+                .filter(uid__in=[row.uid for row in rows]).values_list('uid', 'user_id')
+            )
+            CarbonRecord.objects.bulk_update(
+                [row for row in rows if owners.get(row.uid) == row.user_id],
+                ['source', 'amount', 'date', 'footprint', 'emission_factor']
+            )
+            # A uid inserted concurrently by another request is skipped here and caught below
+            CarbonRecord.objects.bulk_create([row for row in rows if row.uid not in owners], ignore_conflicts=True)
+            owners = dict(
+                CarbonRecord.objects.filter(uid__in=[row.uid for row in rows]).values_list('uid', 'user_id')
+            )
+        return QueryResult([str(row.uid) for row in rows if owners.get(row.uid) != row.user_id])
+
+    def list_source_carbon_records(self, source_uid, start_date=None, end_date=None, columns='*', limit=None, after=None):
+        """List the carbon records of one source across all users in (date, uid) order, one keyset page at a time"""
+        queryset = CarbonRecord.objects.filter(source_id=source_uid)
+        if start_date:
+            queryset = queryset.filter(date__gte=start_date)
+        if end_date:
+            queryset = queryset.filter(date__lte=end_date)
+        queryset = self.keyset(queryset, CARBON_RECORD_KEY, RECORD_FIELDS, limit, after)
+        return QueryResult(self.values(queryset, columns, RECORD_FIELDS))
+
+    def update_carbon_record_footprints(self, rows):
+        """Rewrite footprint and emission_factor for a batch of records in one bulk update"""
+        updated = CarbonRecord.objects.bulk_update(
+            [CarbonRecord(uid=row['uid'], footprint=row['footprint'], emission_factor=row['emission_factor']) for row in rows],
+            ['footprint', 'emission_factor']
+        )
+        return QueryResult(updated)
+
+    def carbon_consumption_series(self, user_id, start_date, end_date, bucket='day', split_by_source=False):
+        """Sum a user's carbon records per day, week or month (and per source when split) in one aggregate query"""
+        trunc = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}[bucket]
+        groups = {'period_start': trunc('date')}
+        if split_by_source:
+            groups['source_uid'] = F('source_id')
+        rows = (
+            self.records(user_id, start_date, end_date)
+            .values(**groups)
+            .annotate(total_amount=Sum('amount'), record_count=Count('uid'))
+            .order_by('period_start')
+        )
+        return QueryResult(list(rows))
+
+    # Carbon consumption calculation
+    def calculate_carbon_consumption(self, user_id, start_date=None, end_date=None):
+        """Calculate total carbon consumption and record count for a user within a date range"""
+        totals = self.records(user_id, start_date, end_date).aggregate(
+            total_amount=Coalesce(Sum('amount'), Value(0.0), output_field=FloatField()),
+            record_count=Count('uid')
+        )
+        return QueryResult([totals])
@@ -0,0 +1,88 @@
+import base64
+import json
+from datetime import date, datetime
+from django.conf import settings
+from django.http import JsonResponse
+
+# Keyset (sort key) columns for each paginated table; the last column is unique
+USER_ACCOUNT_KEY = ('created_at', 'id')
+CARBON_SOURCE_KEY = ('created_at', 'uid')
+CARBON_RECORD_KEY = ('date', 'uid')
+EMISSION_FACTOR_KEY = ('id',)
+
+# Key columns that can hold null: created_at has a default but no NOT NULL constraint in the
+# Supabase schema. Ascending order puts nulls last, so the keyset condition has to include the
+# null rows after every non-null value, and a cursor may carry a null for these columns.
+NULLABLE_KEY_COLUMNS = frozenset({'created_at'})
+
+
+def cursor_value(value):
+    """Convert a sort key value to its JSON form, keeping full timestamp precision and nulls"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+def row_key(row, key_columns):
+    """Return the sort key of a row, for resuming a listing right after it"""
+    return tuple(cursor_value(row[column]) for column in key_columns)
+
+
+def encode_cursor(row, key_columns):
+    """Encode the sort key of the last row on a page as an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps(row_key(row, key_columns)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, key_columns):
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(key_columns):
+        raise ValueError('Invalid cursor')
+    for column, value in zip(key_columns, values):
+        if value is None and column in NULLABLE_KEY_COLUMNS:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError('Invalid cursor')
+    return tuple(values)
+
+
+def parse_page_params(params, key_columns):
+    """Read ``limit`` and ``cursor`` from request params.
+
+    Returns (limit, after, error_response) where ``after`` is the decoded sort key to
+    resume after (None for the first page) and error_response is a 400 JsonResponse
+    when the parameters are invalid.
+    """
+    default_limit = getattr(settings, 'PAGINATION_DEFAULT_LIMIT', 100)
+    # The limit + 1 rows a page fetches must fit under the backend's row cap, or the
+    # probe row is cut off and the listing silently ends early
+    max_limit = min(getattr(settings, 'PAGINATION_MAX_LIMIT', 999), getattr(settings, 'POSTGREST_MAX_ROWS', 1000) - 1)
+
+    try:
+        limit = int(params.get('limit') or default_limit)
+    except (TypeError, ValueError):
+        return None, None, JsonResponse({'error': 'Limit must be an integer'}, status=400)
+    if limit < 1 or limit > max_limit:
+        return None, None, JsonResponse({'error': f'Limit must be between 1 and {max_limit}'}, status=400)
+
+    cursor = params.get('cursor')
+    if not cursor:
+        return limit, None, None
+    try:
+        return limit, decode_cursor(cursor, key_columns), None
+    except ValueError as e:
+        return None, None, JsonResponse({'error': str(e)}, status=400)
+
+
+def page_results(rows, limit, key_columns):
+    """Split rows fetched with limit + 1 into (page, next_cursor)"""
+    rows = rows or []
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(page[-1], key_columns)
@@ -0,0 +1,361 @@
+import hashlib
+import os
+import re
+import time
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extras import Json, RealDictCursor
+from django.conf import settings
+from .instrumentation import record_sql
+from .supabase_client import ACCOUNT_UNIQUE_COLUMNS, QueryResult, UniqueViolation, unique_violation_column
+from .pagination import USER_ACCOUNT_KEY, CARBON_SOURCE_KEY, CARBON_RECORD_KEY, EMISSION_FACTOR_KEY, NULLABLE_KEY_COLUMNS
+
+IDENTIFIER_RE = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+
+class PreparedStatementConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers which statements were prepared on its session"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class PostgresClient:
+    """
+    Storage backend that talks to the Supabase Postgres database directly.
+
+    Exposes the same methods as SupabaseClient but runs each query as a server-side
+    prepared statement on a pooled psycopg2 connection, skipping the PostgREST hop.
+    Select it with STORAGE_BACKEND=postgres and point SUPABASE_DB_URL at the database
+    (a local Postgres with the same schema works just as well).
+    """
+
+    def __init__(self, dsn=None, min_connections=None, max_connections=None):
+        self.dsn = dsn or getattr(settings, 'SUPABASE_DB_URL', None) or os.getenv('SUPABASE_DB_URL')
+
+        if not self.dsn:
+            raise ValueError("SUPABASE_DB_URL must be set to use the postgres storage backend")
+
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            min_connections or getattr(settings, 'POSTGRES_POOL_MIN_CONNECTIONS', 1),
+            max_connections or getattr(settings, 'POSTGRES_POOL_MAX_CONNECTIONS', 10),
+            self.dsn,
+            connection_factory=PreparedStatementConnection
+        )
+
+    @contextmanager
+    def connection(self):
+        """Borrow an autocommit connection from the pool"""
+        conn = self.pool.getconn()
+        discard = False
+        try:
+            conn.autocommit = True
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.pool.putconn(conn, close=discard or conn.closed)
+
+    def execute(self, query, params=()):
+        """Run a query as a prepared statement and return its rows as dicts.
+
+        ``query`` uses $1..$n placeholders; statements are prepared once per pooled
+        connection, keyed by a hash of their text, and reused on later calls. A statement
+        whose result columns changed since it was prepared (a migration altered a table
+        behind ``select *`` or ``returning *``) is deallocated and prepared again.
+        """
+        name = 'ct_' + hashlib.sha1(query.encode()).hexdigest()[:16]
+        params = tuple(Json(value) if isinstance(value, (dict, list)) else value for value in params)
+        start = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    try:
+                        rows = self.execute_prepared(conn, cursor, name, query, params)
+                    except psycopg2.errors.FeatureNotSupported as e:
+                        if 'cached plan must not change result type' not in str(e):
+                            raise
+                        # Postgres refuses to run the stale plan before executing anything, so
+                        # preparing it again against the current schema and retrying is safe.
+                        cursor.execute(f'DEALLOCATE {name}')
+                        conn.prepared.discard(name)
+                        rows = self.execute_prepared(conn, cursor, name, query, params)
+        except Exception:
+            record_sql(query, 0, time.perf_counter() - start, error=True)
+            raise
+        record_sql(query, len(rows), time.perf_counter() - start)
+        return QueryResult(rows)
+
+    def execute_prepared(self, conn, cursor, name, query, params):
+        """Prepare ``query`` as ``name`` on ``conn`` unless it already is, execute it and return its rows"""
+        if name not in conn.prepared:
+            cursor.execute(f'PREPARE {name} AS {query}')
+            conn.prepared.add(name)
+        if params:
+            cursor.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(params))})', params)
+        else:
+            cursor.execute(f'EXECUTE {name}')
+        return [dict(row) for row in cursor.fetchall()] if cursor.description else []
+
+    def quote(self, column):
+        """Quote a plain lower-case column name, rejecting anything else"""
+        if not IDENTIFIER_RE.match(column):
+            raise ValueError(f'Unsupported column: {column}')
+        return f'"{column}"'
+
+    def select_list(self, columns):
+        """Translate a PostgREST-style column list into a quoted SQL select list"""
+        if columns.strip() == '*':
+            return '*'
+        return ', '.join(self.quote(column.strip()) for column in columns.split(','))
+
+    def keyset(self, conditions, params, key_columns, limit=None, after=None):
+        """Add the keyset condition for the cursor ``after`` and return the matching order by / limit clause.
+
+        Keys without nullable columns use a row comparison the index can range-scan. Otherwise
+        the condition is spelled out as in keyset_condition(), with null values sorting last.
+        """
+        if after is not None and (None in after or NULLABLE_KEY_COLUMNS.intersection(key_columns)):
+            alternatives, prefix = [], []
+            for column, value in zip(key_columns, after):
+                if value is None:
+                    prefix.append(f'{column} is null')
+                    continue
+                params.append(value)
+                tails = [f'{column} > ${len(params)}']
+                if column in NULLABLE_KEY_COLUMNS:
+                    tails.append(f'{column} is null')
+                alternatives.extend(' and '.join(prefix + [tail]) for tail in tails)
+                prefix.append(f'{column} = ${len(params)}')
+            conditions.append(f'({" or ".join(f"({alternative})" for alternative in alternatives) or "false"})')
+        elif after is not None:
+            placeholders = []
+            for value in after:
+                params.append(value)
+                placeholders.append(f'${len(params)}')
+            conditions.append(f'({", ".join(key_columns)}) > ({", ".join(placeholders)})')
+        clause = f'order by {", ".join(key_columns)}'
+        if limit is not None:
+            params.append(limit)
+            clause += f' limit ${len(params)}'
+        return clause
+
+    def where(self, conditions):
+        """Join conditions into a where clause"""
+        return f'where {" and ".join(conditions)} ' if conditions else ''
+
+    def insert(self, table, data, returning='*'):
+        """Insert one row and return it"""
+        columns = sorted(data)
+        placeholders = ', '.join(f'${index}' for index in range(1, len(columns) + 1))
+        query = (
+            f'insert into {table} ({", ".join(self.quote(column) for column in columns)}) '
+            f'values ({placeholders}) returning {returning}'
+        )
+        return self.execute(query, [data[column] for column in columns])
+
+    def update(self, table, key_column, key, data):
+        """Update the rows matching key_column = key and return them"""
+        columns = sorted(data)
+        assignments = ', '.join(f'{self.quote(column)} = ${index}' for index, column in enumerate(columns, start=1))
+        query = f'update {table} set {assignments} where {key_column} = ${len(columns) + 1} returning *'
+        return self.execute(query, [data[column] for column in columns] + [key])
+
+    # User Account operations
+    def create_user_account(self, data):
+        """Create a new user account, raising UniqueViolation if the username or email is taken"""
+        try:
+            return self.insert('user_accounts', data)
+        except psycopg2.errors.UniqueViolation as e:
+            message = f'{e.diag.constraint_name} {e.diag.message_detail}'
+            raise UniqueViolation(unique_violation_column(message, ACCOUNT_UNIQUE_COLUMNS)) from e
+
+    def get_user_account(self, user_id):
+        """Get user account by ID"""
+        return self.execute('select * from user_accounts where id = $1', [user_id])
+
+    def get_user_account_by_email(self, email, columns='*', exclude_id=None):
+        """Get user account by email, optionally ignoring the account with ID exclude_id"""
+        if exclude_id is not None:
+            return self.execute(
+                f'select {self.select_list(columns)} from user_accounts where email = $1 and id <> $2',
+                [email, exclude_id]
+            )
+        return self.execute(f'select {self.select_list(columns)} from user_accounts where email = $1', [email])
+
+    def get_user_account_by_username(self, username, columns='*'):
+        """Get user account by username"""
+        return self.execute(f'select {self.select_list(columns)} from user_accounts where username = $1', [username])
+
+    def update_user_account(self, user_id, data):
+        """Update user account"""
+        return self.update('user_accounts', 'id', user_id, data)
+
+    def delete_user_account(self, user_id):
+        """Delete user account"""
+        return self.execute('delete from user_accounts where id = $1 returning *', [user_id])
+
+    def list_user_accounts(self, limit=None, after=None):
+        """List user accounts in (created_at, id) order, one keyset page at a time"""
+        conditions, params = [], []
+        order = self.keyset(conditions, params, USER_ACCOUNT_KEY, limit, after)
+        return self.execute(f'select * from user_accounts {self.where(conditions)}{order}', params)
+
+    # User Profile operations
+    def get_user_profile(self, user_id, columns='*'):
+        """Get user profile by user ID"""
+        return self.execute(f'select {self.select_list(columns)} from user_profiles where user_id = $1', [user_id])
+
+    def create_user_profile(self, data):
+        """Create a new user profile"""
+        return self.insert('user_profiles', data)
+
+    # User Profile source operations
+    def add_source_to_user(self, email, source_uid, user_id=None):
+        """Link a carbon source to the profile of the user with this email (or user_id) in one database call"""
+        result = self.execute('select add_source_to_user($1, $2, $3) as result', [email, source_uid, user_id])
+        return QueryResult(result.data[0]['result'] if result.data else None)
+
+    def remove_source_from_user(self, email, source_uid, user_id=None):
+        """Unlink a carbon source from the profile of the user with this email (or user_id) in one database call"""
+        result = self.execute('select remove_source_from_user($1, $2, $3) as result', [email, source_uid, user_id])
+        return QueryResult(result.data[0]['result'] if result.data else None)
+
+    def list_user_profile_sources(self, profile_id, columns='carbon_source_uid, carbon_sources(*)'):
+        """List the sources linked to a user profile, embedding the carbon source rows"""
+        return self.execute(
+            'select ups.carbon_source_uid, to_jsonb(cs) as carbon_sources '
+            'from user_profile_sources ups '
+            'left join carbon_sources cs on cs.uid = ups.carbon_source_uid '
+            'where ups.user_profile_id = $1',
+            [profile_id]
+        )
+
+    # Activity operations
+    def create_activity(self, data):
+        """Create a new activity"""
+        return self.insert('activities', data)
+
+    def get_activity(self, activity_id):
+        """Get activity by ID"""
+        return self.execute('select * from activities where id = $1', [activity_id])
+
+    def update_activity(self, activity_id, data):
+        """Update activity"""
+        return self.update('activities', 'id', activity_id, data)
+
+    def delete_activity(self, activity_id):
+        """Delete activity"""
+        return self.execute('delete from activities where id = $1 returning *', [activity_id])
+
+    def list_activities(self, user_id=None):
+        """List activities, optionally filtered by user_id"""
+        if user_id:
+            return self.execute('select * from activities where user_id = $1', [user_id])
+        return self.execute('select * from activities')
+
+    # Carbon Source operations
+    def create_carbon_source(self, data):
+        """Create a new carbon source"""
+        return self.insert('carbon_sources', data)
+
+    def get_carbon_source(self, source_id, columns='*'):
+        """Get a specific carbon source by UID"""
+        return self.execute(f'select {self.select_list(columns)} from carbon_sources where uid = $1', [str(source_id)])
+
+    def update_carbon_source(self, source_id, data):
+        """Update a carbon source"""
+        return self.update('carbon_sources', 'uid', str(source_id), data)
+
+    def delete_carbon_source(self, source_id):
+        """Delete a carbon source"""
+        return self.execute('delete from carbon_sources where uid = $1 returning *', [str(source_id)])
+
+    def list_carbon_sources(self, columns='*', limit=None, after=None):
+        """List carbon sources in (created_at, uid) order, one keyset page at a time"""
+        conditions, params = [], []
+        order = self.keyset(conditions, params, CARBON_SOURCE_KEY, limit, after)
+        return self.execute(f'select {self.select_list(columns)} from carbon_sources {self.where(conditions)}{order}', params)
+
+    def get_carbon_sources_by_uid(self, source_uids, columns='uid'):
+        """Get the carbon sources whose UID is in source_uids with a single query"""
+        return self.execute(
+            f'select {self.select_list(columns)} from carbon_sources '
+            f'where uid::text in (select jsonb_array_elements_text($1::jsonb))',
+            [[str(uid) for uid in source_uids]]
+        )
+
+    # Emission factor registry operations
+    def list_emission_factors(self, columns='*', limit=None, after=None):
+        """List emission factors in id order, one keyset page at a time"""
+        conditions, params = [], []
+        order = self.keyset(conditions, params, EMISSION_FACTOR_KEY, limit, after)
+        return self.execute(f'select {self.select_list(columns)} from emission_factors {self.where(conditions)}{order}', params)
+
+    def get_catalog_versions(self, names):
+        """Get the version stamps of catalog tables"""
+        return self.execute(
+            'select name, version from catalog_versions where name in (select jsonb_array_elements_text($1::jsonb))',
+            [list(names)]
+        )
+
+    # Carbon record operations
+    def list_carbon_records(self, user_id, start_date=None, end_date=None, source_uid=None, columns='*', limit=None, after=None):
+        """List carbon records for a user in (date, uid) order, optionally filtered by source and date range"""
+        conditions, params = ['user_id = $1'], [user_id]
+        for condition, value in (('source_uid = ${}', source_uid), ('date >= ${}', start_date), ('date <= ${}', end_date)):
+            if value:
+                params.append(value)
+                conditions.append(condition.format(len(params)))
+        order = self.keyset(conditions, params, CARBON_RECORD_KEY, limit, after)
+        return self.execute(
+            f'select {self.select_list(columns)} from carbon_records {self.where(conditions)}{order}',
+            params
+        )
+
+    def list_source_carbon_records(self, source_uid, start_date=None, end_date=None, columns='*', limit=None, after=None):
+        """List the carbon records of one source across all users in (date, uid) order, one keyset page at a time"""
+        conditions, params = ['source_uid = $1'], [str(source_uid)]
+        for condition, value in (('date >= ${}', start_date), ('date <= ${}', end_date)):
+            if value:
+                params.append(value)
+                conditions.append(condition.format(len(params)))
+        order = self.keyset(conditions, params, CARBON_RECORD_KEY, limit, after)
+        return self.execute(
+            f'select {self.select_list(columns)} from carbon_records {self.where(conditions)}{order}',
+            params
+        )
+
+    def update_carbon_record_footprints(self, rows):
+        """Rewrite footprint and emission_factor for a batch of records in one database call"""
+        result = self.execute('select update_carbon_record_footprints($1) as updated', [rows])
+        return QueryResult(result.data[0]['updated'] if result.data else 0)
+
+    def upsert_carbon_records(self, records):
+        """Insert carbon records, or update the existing ones of the same user, by UID in one database call.
+
+        Returns the uids of the records left alone because they belong to another user.
+        """
+        result = self.execute('select upsert_carbon_records($1) as rejected', [records])
+        return QueryResult([str(uid) for uid in result.data[0]['rejected']] if result.data else [])
+
+    def carbon_consumption_series(self, user_id, start_date, end_date, bucket='day', split_by_source=False):
+        """Sum a user's carbon record rollups per day, week or month (and per source when split) in one database call"""
+        result = self.execute(
+            'select carbon_consumption_series($1, $2, $3, $4, $5) as series',
+            [user_id, start_date, end_date, bucket, split_by_source]
+        )
+        return QueryResult(result.data[0]['series'] if result.data else [])
+
+    # Carbon consumption calculation
+    def calculate_carbon_consumption(self, user_id, start_date=None, end_date=None):
+        """Calculate total carbon consumption and record count for a user within a date range"""
+        return self.execute(
+            'select * from carbon_consumption_totals($1::bigint, $2::date, $3::date)',
+            [user_id, start_date, end_date]
+        )
@@ -0,0 +1,81 @@
+import cProfile
+import os
+import secrets
+import threading
+import time
+from django.conf import settings
+from django.core import signing
+
+SALT = 'api.profile-request'
+
+# Profiles are taken one at a time per process: the profiler hooks the whole interpreter
+# thread, and concurrent profiles would measure each other
+_profiling = threading.Lock()
+
+
+def issue_profile_token():
+    """Return a signed token that makes a request be profiled while it is valid"""
+    return signing.TimestampSigner(salt=SALT).sign(secrets.token_urlsafe(6))
+
+
+def verify_profile_token(token):
+    """Whether a token was issued by issue_profile_token and is younger than PROFILING_TOKEN_MAX_AGE"""
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(token, max_age=getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600))
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class ProfileStore:
+    """Directory of cProfile dumps (``<profile id>.prof``) keeping only the newest ``max_files``"""
+
+    def __init__(self, directory, max_files=200):
+        self.directory = directory
+        self.max_files = max_files
+
+    def save(self, profiler):
+        """Write a profile and drop the oldest ones beyond max_files; returns the profile id"""
+        profile_id = f'{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{secrets.token_hex(4)}'
+        os.makedirs(self.directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(self.directory, f'{profile_id}.prof'))
+        self.rotate()
+        return profile_id
+
+    def rotate(self):
+        """Delete the oldest profiles beyond max_files"""
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.prof'):
+                try:
+                    profiles.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+        profiles.sort()
+        for _, path in profiles[:max(len(profiles) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def start_profile():
+    """Start a profiler, or return None if this process is already profiling a request"""
+    if not _profiling.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler (e.g. a debugger or coverage tool) already owns the hook
+        _profiling.release()
+        return None
+    return profiler
+
+
+def stop_profile(profiler):
+    """Stop a profiler returned by start_profile"""
+    try:
+        profiler.disable()
+    finally:
+        _profiling.release()
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import OrderedDict
+from django.db import connections
+
+# Cached read methods and the table each one reads
+CACHED_READS = {
+    'list_carbon_sources': 'carbon_sources',
+    'get_carbon_source': 'carbon_sources',
+    'list_user_profile_sources': 'user_profile_sources',
+}
+
+# Write methods and the tables whose cached reads they make stale
+INVALIDATED_BY = {
+    'create_carbon_source': ('carbon_sources', 'user_profile_sources'),
+    'update_carbon_source': ('carbon_sources', 'user_profile_sources'),
+    'delete_carbon_source': ('carbon_sources', 'user_profile_sources'),
+    'add_source_to_user': ('user_profile_sources',),
+    'remove_source_from_user': ('user_profile_sources',),
+}
+
+_UNKNOWN = object()
+
+
+class _Flight:
+    """A fetch in progress that concurrent identical reads wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ReadCache:
+    """
+    Single-flight, stale-while-revalidate cache in front of a storage backend.
+
+    Reads listed in CACHED_READS are cached per call arguments. Within a table's ``ttl``
+    the cached result is returned as is; for up to ``max_stale`` seconds after that it is
+    still returned while one background fetch refreshes it. Concurrent identical reads
+    with no usable entry share one in-flight fetch instead of each querying the database.
+    Writes listed in INVALIDATED_BY drop the affected tables, and a table can be tied to a
+    version stamp with watch() so entries older than the stamp are never served.
+    Everything else is passed straight through to the wrapped client.
+    """
+
+    def __init__(self, client, policies, max_entries=10000):
+        self.client = client
+        self.policies = policies  # table -> {'ttl': seconds, 'max_stale': seconds}
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (method, args, kwargs) -> [fetched_at, version, value]
+        self._inflight = {}  # (method, args, kwargs) -> _Flight
+        self._generations = {}  # table -> write counter, so fetches racing a write are not stored
+        self._version_funcs = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name in CACHED_READS and CACHED_READS[name] in self.policies:
+            table = CACHED_READS[name]
+
+            def cached_read(*args, **kwargs):
+                return self._read(table, name, attribute, args, kwargs)
+            wrapper = cached_read
+        elif name in INVALIDATED_BY:
+            tables = INVALIDATED_BY[name]
+
+            def invalidating_write(*args, **kwargs):
+                try:
+                    return attribute(*args, **kwargs)
+                finally:
+                    self.invalidate(*tables)
+            wrapper = invalidating_write
+        else:
+            return attribute
+        # Keep the wrapper on the instance so later lookups skip __getattr__
+        setattr(self, name, wrapper)
+        return wrapper
+
+    def watch(self, table, version_func):
+        """Only serve entries of a table fetched under the version version_func() currently returns"""
+        self._version_funcs[table] = version_func
+
+    def invalidate(self, *tables):
+        """Drop the cached reads of these tables (all tables if none are given)"""
+        tables = set(tables or self.policies)
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            for key in [key for key in self._entries if CACHED_READS[key[0]] in tables]:
+                del self._entries[key]
+
+    def stats(self):
+        """Return cache counters"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'refreshes': self.refreshes,
+                'errors': self.errors,
+                'size': len(self._entries),
+                'inflight': len(self._inflight)
+            }
+
+    def _read(self, table, name, method, args, kwargs):
+        """Serve a read from the cache, joining or starting a fetch when needed"""
+        key = (name, args, tuple(sorted(kwargs.items())))
+        policy = self.policies[table]
+        version = self._current_version(table)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (version is _UNKNOWN or entry[1] == version):
+                age = time.monotonic() - entry[0]
+                if age < policy['ttl']:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                if age < policy['ttl'] + policy['max_stale']:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._inflight:
+                        flight = self._inflight[key] = _Flight()
+                        self.refreshes += 1
+                        threading.Thread(
+                            target=self._background_fetch,
+                            args=(table, key, flight, method, args, kwargs,
+                                  entry[1] if version is _UNKNOWN else version, self._generations.get(table, 0)),
+                            daemon=True
+                        ).start()
+                    return entry[2]
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                generation = self._generations.get(table, 0)
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            self._fetch(table, key, flight, method, args, kwargs, None if version is _UNKNOWN else version, generation)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _background_fetch(self, table, key, flight, method, args, kwargs, version, generation):
+        """Refresh a stale entry off the request thread; on failure the stale entry is kept"""
+        try:
+            self._fetch(table, key, flight, method, args, kwargs, version, generation)
+        finally:
+            # Database backends open a connection per thread; don't leak this one
+            connections.close_all()
+
+    def _fetch(self, table, key, flight, method, args, kwargs, version, generation):
+        """Run the read, publish the result to waiters and store it unless a write raced it"""
+        try:
+            flight.value = method(*args, **kwargs)
+        except Exception as e:
+            flight.error = e
+        with self._lock:
+            self._inflight.pop(key, None)
+            if flight.error is not None:
+                self.errors += 1
+            elif self._generations.get(table, 0) == generation:
+                self._entries[key] = [time.monotonic(), version, flight.value]
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        flight.done.set()
+
+    def _current_version(self, table):
+        """Return the table's version stamp, or _UNKNOWN if it is not watched or cannot be read"""
+        version_func = self._version_funcs.get(table)
+        if version_func is None:
+            return _UNKNOWN
+        try:
+            return version_func()
+        except Exception:
+            return _UNKNOWN
@@ -0,0 +1,193 @@
+import hashlib
+import re
+import time
+from collections import namedtuple
+from pathlib import Path
+import psycopg2
+import psycopg2.errors
+from django.conf import settings
+
+MIGRATION_FILE_RE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# Session-level advisory lock held while migrations are applied, so processes that start
+# together run them one at a time. The key only has to be stable and unlikely to collide.
+ADVISORY_LOCK_KEY = int.from_bytes(hashlib.sha256(b'carbonthink.schema_migrations').digest()[:8], 'big', signed=True)
+
+CREATE_TABLE_SQL = """
+create table if not exists schema_migrations (
+    version text primary key,
+    name text not null,
+    checksum text not null,
+    applied_at timestamptz not null default now(),
+    execution_time interval
+)
+"""
+
+Migration = namedtuple('Migration', ['version', 'name', 'path', 'sql', 'checksum'])
+
+
+class MigrationError(Exception):
+    pass
+
+
+def default_migrations_dir():
+    return Path(settings.BASE_DIR) / 'supabase' / 'migrations'
+
+
+def discover_migrations(directory=None):
+    """Read the numbered ``NNN_name.sql`` files in a directory, in version order"""
+    migrations = []
+    for path in sorted(Path(directory or default_migrations_dir()).glob('*.sql')):
+        match = MIGRATION_FILE_RE.match(path.name)
+        if not match:
+            continue
+        sql = path.read_text()
+        # Line endings depend on the checkout, not on the migration
+        checksum = hashlib.sha256(sql.replace('\r\n', '\n').encode()).hexdigest()
+        migrations.append(Migration(match.group(1), match.group(2), path, sql, checksum))
+
+    versions = [migration.version for migration in migrations]
+    duplicates = sorted({version for version in versions if versions.count(version) > 1})
+    if duplicates:
+        raise MigrationError(f'More than one migration file for version {", ".join(duplicates)}')
+    return migrations
+
+
+def plan(migrations, applied):
+    """Split migrations into the ones still to run and the applied ones whose file has changed since"""
+    pending = [migration for migration in migrations if migration.version not in applied]
+    changed = [
+        migration for migration in migrations
+        if migration.version in applied and applied[migration.version] != migration.checksum
+    ]
+    return pending, changed
+
+
+def check_changed(changed):
+    if changed:
+        raise MigrationError(
+            'Applied migrations have changed on disk: '
+            f'{", ".join(migration.path.name for migration in changed)}. '
+            'Add a new migration instead of editing one that has run'
+        )
+
+
+def migration_script(migration, fake=False):
+    """SQL that runs a migration and records it, sent as one multi-statement query.
+
+    Postgres runs a multi-statement query in a single transaction, so the migration
+    and its schema_migrations row are committed together or not at all.
+    """
+    record = (
+        'insert into schema_migrations (version, name, checksum, execution_time) values '
+        f"({quote_literal(migration.version)}, {quote_literal(migration.name)}, "
+        f"{quote_literal(migration.checksum)}, clock_timestamp() - statement_timestamp())"
+    )
+    if fake:
+        return record
+    # The newline ends a trailing "--" comment and the semicolon a final statement without one
+    return f'{migration.sql}\n;\n{record}'
+
+
+def quote_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class PostgresMigrationRunner:
+    """Applies migrations over a direct connection to SUPABASE_DB_URL"""
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    def migrate(self, migrations, fake=False, log=None):
+        """Apply the pending migrations; returns the ones applied (empty when up to date)"""
+        log = log or (lambda migration, seconds: None)
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        try:
+            with connection.cursor() as cursor:
+                # Up-to-date databases are checked without waiting for the lock
+                pending, changed = plan(migrations, self.applied(cursor))
+                check_changed(changed)
+                if not pending:
+                    return []
+
+                cursor.execute('select pg_advisory_lock(%s)', (ADVISORY_LOCK_KEY,))
+                try:
+                    cursor.execute(CREATE_TABLE_SQL)
+                    # Another process may have applied some while we waited for the lock
+                    pending, changed = plan(migrations, self.applied(cursor))
+                    check_changed(changed)
+                    for migration in pending:
+                        started = time.monotonic()
+                        try:
+                            cursor.execute(migration_script(migration, fake))
+                        except psycopg2.Error as e:
+                            raise MigrationError(f'{migration.path.name}: {str(e).strip()}') from e
+                        log(migration, time.monotonic() - started)
+                    return pending
+                finally:
+                    cursor.execute('select pg_advisory_unlock(%s)', (ADVISORY_LOCK_KEY,))
+        finally:
+            connection.close()
+
+    def applied(self, cursor):
+        try:
+            cursor.execute('select version, checksum from schema_migrations')
+        except psycopg2.errors.UndefinedTable:
+            return {}
+        return dict(cursor.fetchall())
+
+    def status(self, migrations):
+        connection = psycopg2.connect(self.dsn)
+        try:
+            with connection.cursor() as cursor:
+                return plan(migrations, self.applied(cursor))
+        finally:
+            connection.close()
+
+
+class RestMigrationRunner:
+    """
+    Applies migrations through an ``exec_sql(sql text)`` database function over PostgREST.
+
+    Each migration is one RPC call, and so one transaction. Session advisory locks do not
+    survive between PostgREST requests, so every call takes a transaction-level lock
+    instead. A process that loses a race fails on the schema_migrations primary key,
+    rolls back, and then finds the migration recorded.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def migrate(self, migrations, fake=False, log=None):
+        """Apply the pending migrations; returns the ones this process applied"""
+        log = log or (lambda migration, seconds: None)
+        pending, changed = plan(migrations, self.applied())
+        check_changed(changed)
+
+        setup = f'{CREATE_TABLE_SQL};\nnotify pgrst, \'reload schema\''
+        done = []
+        for migration in pending:
+            started = time.monotonic()
+            script = f'select pg_advisory_xact_lock({ADVISORY_LOCK_KEY});\n{setup};\n{migration_script(migration, fake)}'
+            try:
+                self.client.rpc('exec_sql', {'sql': script}).execute()
+            except Exception as e:
+                if self.applied().get(migration.version) == migration.checksum:
+                    continue
+                raise MigrationError(f'{migration.path.name}: {e}') from e
+            done.append(migration)
+            log(migration, time.monotonic() - started)
+        return done
+
+    def applied(self):
+        try:
+            rows = self.client.table('schema_migrations').select('version, checksum').execute().data or []
+        except Exception:
+            # The table is created with the first migration
+            return {}
+        return {row['version']: row['checksum'] for row in rows}
+
+    def status(self, migrations):
+        return plan(migrations, self.applied())
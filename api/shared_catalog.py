@@ -0,0 +1,160 @@
+import json
+import mmap
+import os
+import stat
+import struct
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no flock; the shared tier is disabled there
+    fcntl = None
+
+# magic, sequence (odd while a write is in progress), generation, checked_at, payload length
+HEADER = struct.Struct('<8sQQdQ')
+MAGIC = b'CTCATLG2'
+
+
+class SharedCatalog:
+    """
+    Catalog snapshot shared by every worker process on a host through a memory-mapped file.
+
+    One process publishes a JSON payload and bumps the generation; the others compare the
+    generation in the mapping with the one they last loaded, so checking for a change is a
+    memory read and the payload is only decoded when it moved. Writers serialize on an
+    exclusive flock and use a sequence counter so readers never decode a half-written payload.
+
+    What is shared is the database round trip, not the memory: every worker still decodes
+    the snapshot into its own copy of the catalogs. Payloads are plain JSON (dates and
+    timestamps come back as ISO strings), so a tampered file can at worst corrupt the
+    catalog, never run code. The file is created 0600, and a file that is not owned by the
+    API user or is accessible to anyone else is refused with PermissionError.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._map = None
+        self._pid = None
+        # Threads of one worker share the mapping, which is closed and replaced when the file grows
+        self._thread_lock = threading.RLock()
+
+    @classmethod
+    def available(cls):
+        """Whether shared catalogs are supported on this platform"""
+        return fcntl is not None
+
+    def header(self):
+        """Return (generation, checked_at) of the published snapshot"""
+        while True:
+            with self._thread_lock:
+                sequence, generation, checked_at, _ = self._header()
+                if sequence % 2 == 0 and self._header()[0] == sequence:
+                    return generation, checked_at
+            time.sleep(0)
+
+    def read(self, known_generation=None):
+        """Return (generation, checked_at, payload); payload is None if known_generation is current or nothing is published"""
+        while True:
+            with self._thread_lock:
+                sequence, generation, checked_at, length = self._header()
+                changed = generation not in (0, known_generation)
+                if sequence % 2 == 0:
+                    if changed and HEADER.size + length > len(self._map):
+                        self._remap()
+                    data = self._map[HEADER.size:HEADER.size + length] if changed else None
+                    if self._header()[0] == sequence:
+                        return generation, checked_at, json.loads(data) if changed else None
+            time.sleep(0)
+
+    @contextmanager
+    def lock(self):
+        """Hold the exclusive writer lock, shared by every process using the file"""
+        with self._thread_lock:
+            self._ensure_open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def publish(self, payload, checked_at):
+        """Write a new snapshot and bump the generation; the caller must hold lock()"""
+        data = json.dumps(payload, default=_json_default, separators=(',', ':')).encode()
+        size = HEADER.size + len(data)
+        if size > len(self._map):
+            # Grow to the next power of two so republishing a slightly larger catalog rarely remaps
+            os.ftruncate(self._fd, 1 << (size - 1).bit_length())
+            self._remap()
+        sequence, generation, _, _ = self._header()
+        self._write_header(sequence + 1, generation, checked_at, len(data))
+        self._map[HEADER.size:size] = data
+        self._write_header(sequence + 2, generation + 1, checked_at, len(data))
+        return generation + 1
+
+    def touch(self, checked_at):
+        """Record a version check that found no change; the caller must hold lock()"""
+        sequence, generation, _, length = self._header()
+        self._write_header(sequence + 1, generation, checked_at, length)
+        self._write_header(sequence + 2, generation, checked_at, length)
+
+    def _header(self):
+        """Read the raw header as (sequence, generation, checked_at, length)"""
+        self._ensure_open()
+        magic, sequence, generation, checked_at, length = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            return 0, 0, 0.0, 0
+        return sequence, generation, checked_at, length
+
+    def _write_header(self, sequence, generation, checked_at, length):
+        """Write the header in place"""
+        HEADER.pack_into(self._map, 0, MAGIC, sequence, generation, checked_at, length)
+
+    def _ensure_open(self):
+        """Open and map the file, reopening after a fork so each worker has its own flock"""
+        if self._fd is not None and self._pid == os.getpid():
+            return
+        if self._fd is not None:
+            self._map.close()
+            self._map = None
+            os.close(self._fd)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        info = os.fstat(fd)
+        if not stat.S_ISREG(info.st_mode) or info.st_uid != os.geteuid() or info.st_mode & 0o077:
+            os.close(fd)
+            raise PermissionError(
+                f'Refusing shared catalog file {self.path}: it must be a regular file owned by this user '
+                'with no group or other permissions (mode 0600)'
+            )
+        self._fd = fd
+        self._pid = os.getpid()
+        if os.fstat(self._fd).st_size < mmap.PAGESIZE:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size < mmap.PAGESIZE:
+                    os.ftruncate(self._fd, mmap.PAGESIZE)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._remap()
+
+    def _remap(self):
+        """Map the whole file again after it grew"""
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+
+
+def _json_default(value):
+    """Encode the non-JSON values backend rows can hold: dates and timestamps, numerics and UUIDs"""
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
@@ -1,20 +1,103 @@
 import os
-from supabase import create_client, Client
+import re
+import asyncio
+import weakref
+from supabase import create_client, acreate_client, Client, AsyncClient
+from postgrest.exceptions import APIError
 from django.conf import settings
+from .instrumentation import InstrumentedClient
+from .read_cache import ReadCache
+from .pagination import USER_ACCOUNT_KEY, CARBON_SOURCE_KEY, CARBON_RECORD_KEY, EMISSION_FACTOR_KEY, NULLABLE_KEY_COLUMNS
+
+
+class QueryResult:
+    """Minimal stand-in for a PostgREST APIResponse so views can keep reading ``.data``"""
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+# Columns of user_accounts covered by unique constraints
+ACCOUNT_UNIQUE_COLUMNS = ('username', 'email')
+
+
+class UniqueViolation(Exception):
+    """Raised by create methods when a row conflicts with a unique constraint; ``column`` is the conflicting column, if known"""
+
+    def __init__(self, column=None):
+        super().__init__(f'{column or "Row"} already exists')
+        self.column = column
+
+
+def unique_violation_column(message, columns):
+    """Return which of ``columns`` a unique violation error message names (Postgres or SQLite wording), or None"""
+    for column in columns:
+        if re.search(rf'Key \({column}\)=|_{column}_key\b|UNIQUE constraint failed: \w+\.{column}\b', message):
+            return column
+    return None
+
+
+def keyset_condition(key_columns, after):
+    """Build the PostgREST ``or`` filter selecting rows whose sort key is greater than ``after``.
+
+    For key (a, b) and cursor (x, y) this is ``a > x or (a = x and b > y)``. Nulls sort
+    last, so when a is one of NULLABLE_KEY_COLUMNS rows with a null a follow any x, and
+    a null x is only followed by ``a is null and b > y``.
+    """
+    quoted = ['"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"')) for value in after]
+    conditions, prefix = [], []
+    for index, column in enumerate(key_columns):
+        if after[index] is None:
+            prefix.append(f'{column}.is.null')
+            continue
+        tails = [f'{column}.gt.{quoted[index]}']
+        if column in NULLABLE_KEY_COLUMNS:
+            tails.append(f'{column}.is.null')
+        for tail in tails:
+            terms = prefix + [tail]
+            conditions.append(terms[0] if len(terms) == 1 else f'and({",".join(terms)})')
+        prefix.append(f'{column}.eq.{quoted[index]}')
+    return ','.join(conditions)
+
+
+def keyset_page(query, key_columns, limit=None, after=None):
+    """Order a PostgREST select by its keyset columns and resume after the cursor ``after``.
+
+    Every page is a bounded index range scan, so deep pages cost the same as the first.
+    Works on both sync and async request builders.
+    """
+    if after is not None:
+        query = query.or_(keyset_condition(key_columns, after))
+    for column in key_columns:
+        query = query.order(column)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def user_source_params(email, source_uid, user_id=None):
+    """RPC parameters for add_source_to_user / remove_source_from_user; p_user_id is only sent when given"""
+    params = {'p_email': email, 'p_source_uid': source_uid}
+    if user_id is not None:
+        params['p_user_id'] = user_id
+    return params
 
 class SupabaseClient:
     """
     Supabase client utility for handling REST API operations
     """
     
-    def __init__(self):
+    def __init__(self, client=None):
         self.url = os.getenv('SUPABASE_URL')
         self.key = os.getenv('SUPABASE_ANON_KEY')
         
-        if not self.url or not self.key:
-            raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY must be set in environment variables")
+        if client is None:
+            if not self.url or not self.key:
+                raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY must be set in environment variables")
+            client = create_client(self.url, self.key)
         
-        self.client: Client = create_client(self.url, self.key)
+        self.client: Client = InstrumentedClient(client)
     
     def get_client(self) -> Client:
         """Get the Supabase client instance"""
@@ -22,13 +105,29 @@ class SupabaseClient:
     
     # User Account operations
     def create_user_account(self, data):
-        """Create a new user account"""
-        return self.client.table('user_accounts').insert(data).execute()
+        """Create a new user account, raising UniqueViolation if the username or email is taken"""
+        try:
+            return self.client.table('user_accounts').insert(data).execute()
+        except APIError as e:
+            if e.code == '23505':
+                raise UniqueViolation(unique_violation_column(f'{e.message} {e.details}', ACCOUNT_UNIQUE_COLUMNS)) from e
+            raise
     
     def get_user_account(self, user_id):
         """Get user account by ID"""
         return self.client.table('user_accounts').select('*').eq('id', user_id).execute()
     
+    def get_user_account_by_email(self, email, columns='*', exclude_id=None):
+        """Get user account by email, optionally ignoring the account with ID exclude_id"""
+        query = self.client.table('user_accounts').select(columns).eq('email', email)
+        if exclude_id is not None:
+            query = query.neq('id', exclude_id)
+        return query.execute()
+    
+    def get_user_account_by_username(self, username, columns='*'):
+        """Get user account by username"""
+        return self.client.table('user_accounts').select(columns).eq('username', username).execute()
+    
     def update_user_account(self, user_id, data):
         """Update user account"""
         return self.client.table('user_accounts').update(data).eq('id', user_id).execute()
@@ -37,9 +136,37 @@ class SupabaseClient:
         """Delete user account"""
         return self.client.table('user_accounts').delete().eq('id', user_id).execute()
     
-    def list_user_accounts(self):
-        """List all user accounts"""
-        return self.client.table('user_accounts').select('*').execute()
+    def list_user_accounts(self, limit=None, after=None):
+        """List user accounts in (created_at, id) order, one keyset page at a time"""
+        query = self.client.table('user_accounts').select('*')
+        return keyset_page(query, USER_ACCOUNT_KEY, limit, after).execute()
+    
+    # User Profile operations
+    def get_user_profile(self, user_id, columns='*'):
+        """Get user profile by user ID"""
+        return self.client.table('user_profiles').select(columns).eq('user_id', user_id).execute()
+    
+    def create_user_profile(self, data):
+        """Create a new user profile"""
+        return self.client.table('user_profiles').insert(data).execute()
+    
+    # User Profile source operations
+    def add_source_to_user(self, email, source_uid, user_id=None):
+        """Link a carbon source to the profile of the user with this email, creating the profile if needed.
+
+        ``user_id``, when given, identifies the user instead of the email. Runs as a single
+        database function (see supabase/migrations/010_user_source_functions_by_id.sql)
+        returning ``{'status': ..., 'error': ...}`` or the created link under ``data``.
+        """
+        return self.client.rpc('add_source_to_user', user_source_params(email, source_uid, user_id)).execute()
+    
+    def remove_source_from_user(self, email, source_uid, user_id=None):
+        """Unlink a carbon source from the profile of the user with this email (or user_id) in one database call"""
+        return self.client.rpc('remove_source_from_user', user_source_params(email, source_uid, user_id)).execute()
+    
+    def list_user_profile_sources(self, profile_id, columns='carbon_source_uid, carbon_sources(*)'):
+        """List the sources linked to a user profile, embedding the carbon source rows"""
+        return self.client.table('user_profile_sources').select(columns).eq('user_profile_id', profile_id).execute()
     
     # Activity operations
     def create_activity(self, data):
@@ -70,9 +197,9 @@ class SupabaseClient:
         """Create a new carbon source"""
         return self.client.table('carbon_sources').insert(data).execute()
     
-    def get_carbon_source(self, source_id):
+    def get_carbon_source(self, source_id, columns='*'):
         """Get a specific carbon source by UID"""
-        return self.client.table('carbon_sources').select('*').eq('uid', source_id).execute()
+        return self.client.table('carbon_sources').select(columns).eq('uid', source_id).execute()
 
     def update_carbon_source(self, source_id, data):
         """Update a carbon source"""
@@ -82,21 +209,283 @@ class SupabaseClient:
         """Delete a carbon source"""
         return self.client.table('carbon_sources').delete().eq('uid', source_id).execute()
     
-    def list_carbon_sources(self):
-        """List all carbon sources"""
-        return self.client.table('carbon_sources').select('*').execute()
+    def list_carbon_sources(self, columns='*', limit=None, after=None):
+        """List carbon sources in (created_at, uid) order, one keyset page at a time"""
+        query = self.client.table('carbon_sources').select(columns)
+        return keyset_page(query, CARBON_SOURCE_KEY, limit, after).execute()
+    
+    def get_carbon_sources_by_uid(self, source_uids, columns='uid'):
+        """Get the carbon sources whose UID is in source_uids with a single query"""
+        return self.client.table('carbon_sources').select(columns).in_('uid', list(source_uids)).execute()
+    
+    # Emission factor registry operations
+    def list_emission_factors(self, columns='*', limit=None, after=None):
+        """List emission factors in id order, one keyset page at a time"""
+        query = self.client.table('emission_factors').select(columns)
+        return keyset_page(query, EMISSION_FACTOR_KEY, limit, after).execute()
+    
+    def get_catalog_versions(self, names):
+        """Get the version stamps of catalog tables (see supabase/migrations/007_emission_factors.sql)"""
+        return self.client.table('catalog_versions').select('name, version').in_('name', list(names)).execute()
+    
+    # Carbon record operations
+    def list_carbon_records(self, user_id, start_date=None, end_date=None, source_uid=None, columns='*', limit=None, after=None):
+        """List carbon records for a user in (date, uid) order, optionally filtered by source and date range"""
+        query = self.client.table('carbon_records').select(columns).eq('user_id', user_id)
+        if source_uid:
+            query = query.eq('source_uid', source_uid)
+        if start_date:
+            query = query.gte('date', start_date)
+        if end_date:
+            query = query.lte('date', end_date)
+        return keyset_page(query, CARBON_RECORD_KEY, limit, after).execute()
+    
+    def list_source_carbon_records(self, source_uid, start_date=None, end_date=None, columns='*', limit=None, after=None):
+        """List the carbon records of one source across all users in (date, uid) order, one keyset page at a time"""
+        query = self.client.table('carbon_records').select(columns).eq('source_uid', source_uid)
+        if start_date:
+            query = query.gte('date', start_date)
+        if end_date:
+            query = query.lte('date', end_date)
+        return keyset_page(query, CARBON_RECORD_KEY, limit, after).execute()
+    
+    def update_carbon_record_footprints(self, rows):
+        """Rewrite footprint and emission_factor for a batch of records in one database call.
+
+        ``rows`` are ``{'uid', 'footprint', 'emission_factor'}`` dicts; the function
+        (see supabase/migrations/008_carbon_record_footprints.sql) returns how many changed.
+        """
+        return self.client.rpc('update_carbon_record_footprints', {'p_rows': rows}).execute()
+    
+    def upsert_carbon_records(self, records):
+        """Insert carbon records, or update the existing ones of the same user, by UID in one database call.
+
+        Runs as a single database function (see supabase/migrations/011_carbon_record_upsert.sql)
+        returning the uids of the records left alone because they belong to another user.
+        """
+        return self.client.rpc('upsert_carbon_records', {'p_rows': records}).execute()
+    
+    def carbon_consumption_series(self, user_id, start_date, end_date, bucket='day', split_by_source=False):
+        """Sum a user's carbon record rollups per day, week or month (and per source when split).
+
+        Runs as a single database function (see supabase/migrations/012_carbon_consumption_series.sql)
+        returning ``{'period_start', 'source_uid', 'total_amount', 'record_count'}`` rows as one JSON
+        value, so PostgREST's max-rows limit never truncates the series.
+        """
+        params = {
+            'p_user_id': user_id,
+            'p_start_date': start_date,
+            'p_end_date': end_date,
+            'p_bucket': bucket,
+            'p_split_by_source': split_by_source
+        }
+        return self.client.rpc('carbon_consumption_series', params).execute()
     
     # Carbon consumption calculation
     def calculate_carbon_consumption(self, user_id, start_date=None, end_date=None):
-        """Calculate carbon consumption for a user within a date range"""
-        query = self.client.table('activities').select('*').eq('user_id', user_id)
-        
+        """Calculate total carbon consumption and record count for a user within a date range.
+
+        The aggregation runs in Postgres over the carbon record rollups (see
+        supabase/migrations/004_carbon_record_rollups.sql) so only a single row with
+        ``total_amount`` and ``record_count`` comes back.
+        """
+        params = {
+            'p_user_id': user_id,
+            'p_start_date': start_date,
+            'p_end_date': end_date
+        }
+        return self.client.rpc('carbon_consumption_totals', params).execute()
+
+
+class AsyncSupabaseClient:
+    """
+    Async Supabase client used by the async views when running under ASGI with the
+    default 'supabase' storage backend.
+
+    supabase-py async clients hold an httpx.AsyncClient, which is bound to the event
+    loop it was created on, so one client is created lazily per running loop. A client
+    passed in (e.g. the in-memory stand-in) is used on every loop instead.
+    """
+    
+    def __init__(self, client=None):
+        self.url = os.getenv('SUPABASE_URL')
+        self.key = os.getenv('SUPABASE_ANON_KEY')
+        self._client = InstrumentedClient(client) if client is not None else None
+        self._clients = weakref.WeakKeyDictionary()
+    
+    async def get_client(self) -> AsyncClient:
+        """Get the async Supabase client instance for the running event loop"""
+        if self._client is not None:
+            return self._client
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            if not self.url or not self.key:
+                raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY must be set in environment variables")
+            client = InstrumentedClient(await acreate_client(self.url, self.key))
+            self._clients[loop] = client
+        return client
+    
+    # User Account operations
+    async def create_user_account(self, data):
+        """Create a new user account, raising UniqueViolation if the username or email is taken"""
+        client = await self.get_client()
+        try:
+            return await client.table('user_accounts').insert(data).execute()
+        except APIError as e:
+            if e.code == '23505':
+                raise UniqueViolation(unique_violation_column(f'{e.message} {e.details}', ACCOUNT_UNIQUE_COLUMNS)) from e
+            raise
+    
+    async def get_user_account(self, user_id):
+        """Get user account by ID"""
+        client = await self.get_client()
+        return await client.table('user_accounts').select('*').eq('id', user_id).execute()
+    
+    async def get_user_account_by_email(self, email, columns='*', exclude_id=None):
+        """Get user account by email, optionally ignoring the account with ID exclude_id"""
+        client = await self.get_client()
+        query = client.table('user_accounts').select(columns).eq('email', email)
+        if exclude_id is not None:
+            query = query.neq('id', exclude_id)
+        return await query.execute()
+    
+    async def get_user_account_by_username(self, username, columns='*'):
+        """Get user account by username"""
+        client = await self.get_client()
+        return await client.table('user_accounts').select(columns).eq('username', username).execute()
+    
+    async def update_user_account(self, user_id, data):
+        """Update user account"""
+        client = await self.get_client()
+        return await client.table('user_accounts').update(data).eq('id', user_id).execute()
+    
+    async def delete_user_account(self, user_id):
+        """Delete user account"""
+        client = await self.get_client()
+        return await client.table('user_accounts').delete().eq('id', user_id).execute()
+    
+    async def list_user_accounts(self, limit=None, after=None):
+        """List user accounts in (created_at, id) order, one keyset page at a time"""
+        client = await self.get_client()
+        query = client.table('user_accounts').select('*')
+        return await keyset_page(query, USER_ACCOUNT_KEY, limit, after).execute()
+    
+    # User Profile operations
+    async def get_user_profile(self, user_id, columns='*'):
+        """Get user profile by user ID"""
+        client = await self.get_client()
+        return await client.table('user_profiles').select(columns).eq('user_id', user_id).execute()
+    
+    # User Profile source operations
+    async def add_source_to_user(self, email, source_uid, user_id=None):
+        """Link a carbon source to the profile of the user with this email (or user_id) in one database call"""
+        client = await self.get_client()
+        return await client.rpc('add_source_to_user', user_source_params(email, source_uid, user_id)).execute()
+    
+    async def remove_source_from_user(self, email, source_uid, user_id=None):
+        """Unlink a carbon source from the profile of the user with this email (or user_id) in one database call"""
+        client = await self.get_client()
+        return await client.rpc('remove_source_from_user', user_source_params(email, source_uid, user_id)).execute()
+    
+    async def list_user_profile_sources(self, profile_id, columns='carbon_source_uid, carbon_sources(*)'):
+        """List the sources linked to a user profile, embedding the carbon source rows"""
+        client = await self.get_client()
+        return await client.table('user_profile_sources').select(columns).eq('user_profile_id', profile_id).execute()
+    
+    # Carbon Source operations
+    async def create_carbon_source(self, data):
+        """Create a new carbon source"""
+        client = await self.get_client()
+        return await client.table('carbon_sources').insert(data).execute()
+    
+    async def list_carbon_sources(self, columns='*', limit=None, after=None):
+        """List carbon sources in (created_at, uid) order, one keyset page at a time"""
+        client = await self.get_client()
+        query = client.table('carbon_sources').select(columns)
+        return await keyset_page(query, CARBON_SOURCE_KEY, limit, after).execute()
+    
+    async def get_carbon_sources_by_uid(self, source_uids, columns='uid'):
+        """Get the carbon sources whose UID is in source_uids with a single query"""
+        client = await self.get_client()
+        return await client.table('carbon_sources').select(columns).in_('uid', list(source_uids)).execute()
+    
+    # Carbon record operations
+    async def list_carbon_records(self, user_id, start_date=None, end_date=None, source_uid=None, columns='*', limit=None, after=None):
+        """List carbon records for a user in (date, uid) order, optionally filtered by source and date range"""
+        client = await self.get_client()
+        query = client.table('carbon_records').select(columns).eq('user_id', user_id)
+        if source_uid:
+            query = query.eq('source_uid', source_uid)
         if start_date:
             query = query.gte('date', start_date)
         if end_date:
             query = query.lte('date', end_date)
-            
-        return query.execute()
+        return await keyset_page(query, CARBON_RECORD_KEY, limit, after).execute()
+    
+    async def upsert_carbon_records(self, records):
+        """Insert carbon records, or update the existing ones of the same user, by UID in one database call"""
+        client = await self.get_client()
+        return await client.rpc('upsert_carbon_records', {'p_rows': records}).execute()
+    
+    async def carbon_consumption_series(self, user_id, start_date, end_date, bucket='day', split_by_source=False):
+        """Sum a user's carbon record rollups per day, week or month (and per source when split)"""
+        client = await self.get_client()
+        params = {
+            'p_user_id': user_id,
+            'p_start_date': start_date,
+            'p_end_date': end_date,
+            'p_bucket': bucket,
+            'p_split_by_source': split_by_source
+        }
+        return await client.rpc('carbon_consumption_series', params).execute()
+    
+    # Carbon consumption calculation
+    async def calculate_carbon_consumption(self, user_id, start_date=None, end_date=None):
+        """Calculate total carbon consumption and record count for a user within a date range"""
+        client = await self.get_client()
+        params = {
+            'p_user_id': user_id,
+            'p_start_date': start_date,
+            'p_end_date': end_date
+        }
+        return await client.rpc('carbon_consumption_totals', params).execute()
+
+
+def create_storage_backend():
+    """Instantiate the storage backend selected by the STORAGE_BACKEND setting"""
+    backend = getattr(settings, 'STORAGE_BACKEND', 'supabase')
+    if backend == 'postgres':
+        from .postgres_client import PostgresClient
+        return PostgresClient()
+    if backend == 'django':
+        from .orm_client import DjangoORMClient
+        return DjangoORMClient()
+    if backend == 'memory':
+        from .memory_backend import MemorySupabase, memory_database
+        return SupabaseClient(MemorySupabase(memory_database))
+    if backend != 'supabase':
+        raise ValueError(f"Unknown STORAGE_BACKEND '{backend}', expected 'supabase', 'postgres', 'django' or 'memory'")
+    return SupabaseClient()
+
+def create_async_backend():
+    """Instantiate the client used by the async views, which run on the 'supabase' and 'memory' backends"""
+    if getattr(settings, 'STORAGE_BACKEND', 'supabase') == 'memory':
+        from .memory_backend import MemorySupabase, memory_database
+        return AsyncSupabaseClient(MemorySupabase(memory_database, asynchronous=True))
+    return AsyncSupabaseClient()
+
+def create_read_cache(client):
+    """Wrap a storage backend in the shared read cache unless READ_CACHE_ENABLED is off"""
+    if not getattr(settings, 'READ_CACHE_ENABLED', True):
+        return client
+    return ReadCache(
+        client,
+        getattr(settings, 'READ_CACHE_POLICIES', {}),
+        max_entries=getattr(settings, 'READ_CACHE_MAX_ENTRIES', 10000)
+    )
 
-# Global instance
-supabase_client = SupabaseClient()
\ No newline at end of file
+# Global instances; storage_backend is the uncached client for callers that manage their own caching
+storage_backend = create_storage_backend()
+supabase_client = create_read_cache(storage_backend)
+async_supabase_client = create_async_backend()
\ No newline at end of file
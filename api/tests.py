@@ -1,3 +1,731 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import pickle
+import re
+import tempfile
+import time
+import uuid
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from .emission_factors import EmissionFactorRegistry, emission_factor_registry
+from .identity import identity_resolver
+from .memory_backend import memory_database
+from .pagination import CARBON_RECORD_KEY, USER_ACCOUNT_KEY, decode_cursor
+from .schema_migrations import (
+    MigrationError, PostgresMigrationRunner, RestMigrationRunner, check_changed, discover_migrations,
+    migration_script, plan, quote_literal
+)
+from .shared_catalog import HEADER, MAGIC, SharedCatalog
+from .supabase_client import keyset_condition, storage_backend, supabase_client
+from .tokens import issue_token, revoke_user_tokens
+from .views.activities import carbon_consumption_series_async
+from .views.sources import (
+    add_source_to_user_async, export_user_records_async, get_user_records_by_timeframe_async, get_user_sources_async,
+    ingest_user_records_async
+)
 
-# Create your tests here.
+
+class MemoryBackendTestCase(TestCase):
+    """Runs every test on an empty in-memory backend (the test settings select STORAGE_BACKEND=memory)"""
+
+    def setUp(self):
+        memory_database.reset()
+        supabase_client.invalidate()
+        identity_resolver.clear()
+        # Version stamps restart with the reset database, so make the registry reload regardless
+        emission_factor_registry.loaded_at = None
+        emission_factor_registry.invalidate()
+        cache.clear()
+
+    def post_json(self, path, data, **extra):
+        return self.client.post(path, json.dumps(data), content_type='application/json', **extra)
+
+    def put_json(self, path, data, **extra):
+        return self.client.put(path, json.dumps(data), content_type='application/json', **extra)
+
+    def register(self, username):
+        """Register a user and return its account row"""
+        response = self.post_json('/api/accounts/register/', {
+            'username': username,
+            'email': f'{username}@example.com',
+            'password': 'secret123'
+        })
+        self.assertEqual(response.status_code, 201)
+        user = storage_backend.get_user_account_by_username(username).data[0]
+        storage_backend.create_user_profile({'user_id': user['id']})
+        return user
+
+    def create_source(self, source_type='Travel'):
+        """Create a carbon source and return its uid"""
+        uid = str(uuid.uuid4())
+        storage_backend.create_carbon_source({'uid': uid, 'name': 'Commute', 'description': '', 'source_type': source_type})
+        emission_factor_registry.invalidate()
+        return uid
+
+
+class IngestUserRecordsTests(MemoryBackendTestCase):
+    path = '/api/sources/user/records/ingest/'
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.register('alice')
+        self.source_uid = self.create_source()
+
+    def record(self, **fields):
+        return {'uid': str(uuid.uuid4()), 'source_uid': self.source_uid, 'amount': 2.5, 'date': '2024-03-01', **fields}
+
+    def ingest(self, records, email='alice@example.com'):
+        return self.post_json(self.path, {'email': email, 'records': records})
+
+    def stored(self, uid):
+        return memory_database.tables['carbon_records'].get(uid)
+
+    def test_all_valid_records_return_201(self):
+        records = [self.record(), self.record(amount=4)]
+        response = self.ingest(records)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'ingested': 2, 'failed': 0, 'errors': []})
+        self.assertEqual(self.stored(records[1]['uid'])['amount'], 4)
+        self.assertEqual(self.stored(records[1]['uid'])['user_id'], self.alice['id'])
+
+    def test_partly_invalid_batch_returns_207_with_row_errors(self):
+        response = self.ingest([
+            self.record(),
+            self.record(amount=-1),
+            self.record(date='2024-02-30'),
+            self.record(source_uid=str(uuid.uuid4())),
+            'not an object'
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json(), {
+            'ingested': 1,
+            'failed': 4,
+            'errors': [
+                {'index': 1, 'error': 'Amount must be a non-negative number'},
+                {'index': 2, 'error': 'Invalid date format. Use YYYY-MM-DD'},
+                {'index': 3, 'error': 'Source not found'},
+                {'index': 4, 'error': 'Record must be an object'}
+            ]
+        })
+
+    def test_invalid_uids_are_rejected_per_row(self):
+        duplicate = self.record()
+        response = self.ingest([
+            self.record(uid='not-a-uuid'),
+            self.record(source_uid='nope'),
+            duplicate,
+            dict(duplicate)
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()['errors'], [
+            {'index': 0, 'error': 'Invalid uid'},
+            {'index': 1, 'error': 'Valid source UID is required'},
+            {'index': 3, 'error': 'Duplicate uid in request'}
+        ])
+        self.assertIsNone(self.stored('not-a-uuid'))
+
+    def test_all_invalid_records_return_400(self):
+        response = self.ingest([self.record(amount='2'), self.record(uid=42)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['ingested'], 0)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [0, 1])
+
+    def test_request_validation(self):
+        self.assertEqual(self.post_json(self.path, {'records': [self.record()]}).status_code, 400)
+        self.assertEqual(self.ingest([]).status_code, 400)
+        self.assertEqual(self.ingest([self.record()], email='nobody@example.com').status_code, 404)
+        with override_settings(INGEST_MAX_RECORDS=1):
+            self.assertEqual(self.ingest([self.record(), self.record()]).status_code, 400)
+
+    def test_reingesting_an_own_record_updates_it(self):
+        record = self.record()
+        self.ingest([record])
+        response = self.ingest([dict(record, amount=9)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stored(record['uid'])['amount'], 9)
+
+    def test_another_users_record_uid_is_rejected_and_kept(self):
+        self.register('mallory')
+        record = self.record()
+        self.ingest([record])
+        other = self.record()
+
+        response = self.ingest([dict(record, amount=999), other], email='mallory@example.com')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json(), {
+            'ingested': 1,
+            'failed': 1,
+            'errors': [{'index': 0, 'error': 'Record uid already exists'}]
+        })
+        self.assertEqual(self.stored(record['uid'])['amount'], 2.5)
+        self.assertEqual(self.stored(record['uid'])['user_id'], self.alice['id'])
+        self.assertIsNotNone(self.stored(other['uid']))
+
+    @override_settings(INGEST_CHUNK_SIZE=2)
+    def test_failed_chunk_marks_each_of_its_rows(self):
+        upsert = storage_backend.upsert_carbon_records
+        calls = []
+
+        def failing_second_chunk(rows):
+            calls.append(len(rows))
+            if len(calls) == 2:
+                raise RuntimeError('connection reset')
+            return upsert(rows)
+
+        with mock.patch.object(storage_backend, 'upsert_carbon_records', side_effect=failing_second_chunk):
+            response = self.ingest([self.record() for _ in range(5)])
+
+        self.assertEqual(calls, [2, 2, 1])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json(), {
+            'ingested': 3,
+            'failed': 2,
+            'errors': [{'index': 2, 'error': 'connection reset'}, {'index': 3, 'error': 'connection reset'}]
+        })
+
+    @override_settings(INGEST_CHUNK_SIZE=1000, POSTGREST_MAX_ROWS=3)
+    def test_chunk_size_is_capped_at_postgrest_max_rows(self):
+        with mock.patch.object(storage_backend, 'upsert_carbon_records', wraps=storage_backend.upsert_carbon_records) as upsert:
+            response = self.ingest([self.record() for _ in range(7)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([len(call.args[0]) for call in upsert.call_args_list], [3, 3, 1])
+
+
+class KeysetPaginationTests(MemoryBackendTestCase):
+    path = '/api/accounts/users/'
+
+    def create_users(self, count, **fields):
+        return [
+            storage_backend.create_user_account({
+                'username': f'user{index}', 'email': f'user{index}@example.com', 'password_hash': 'x', **fields
+            }).data[0]['id']
+            for index in range(len(memory_database.tables['user_accounts']), len(memory_database.tables['user_accounts']) + count)
+        ]
+
+    def list_all(self, limit):
+        """Follow next_cursor through every page, returning the user ids in listing order and the page count"""
+        ids, pages, params = [], 0, {'limit': limit}
+        while True:
+            response = self.client.get(self.path, params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertLessEqual(len(body['users']), limit)
+            ids.extend(user['id'] for user in body['users'])
+            pages += 1
+            if body['next_cursor'] is None:
+                return ids, pages
+            params = {'limit': limit, 'cursor': body['next_cursor']}
+
+    def test_cursor_round_trip_visits_every_row_once(self):
+        created = self.create_users(5)
+        with mock.patch.object(storage_backend, 'list_user_accounts', wraps=storage_backend.list_user_accounts) as listing:
+            ids, pages = self.list_all(limit=2)
+        self.assertEqual(ids, created)
+        self.assertEqual(pages, 3)
+        # Each page fetches one extra row to learn whether another page follows
+        self.assertEqual([call.kwargs['limit'] for call in listing.call_args_list], [3, 3, 3])
+
+    def test_exact_multiple_of_limit_has_no_empty_last_page(self):
+        created = self.create_users(4)
+        self.assertEqual(self.list_all(limit=2), (created, 2))
+
+    def test_cursor_encodes_the_last_row_key(self):
+        self.create_users(3)
+        body = self.client.get(self.path, {'limit': 2}).json()
+        last = body['users'][-1]
+        self.assertEqual(decode_cursor(body['next_cursor'], USER_ACCOUNT_KEY), (last['created_at'], last['id']))
+
+    def test_invalid_cursors_return_400(self):
+        self.create_users(3)
+        tampered = [
+            'not base64!',
+            encode_json_cursor({'created_at': '2024-01-01'}),
+            encode_json_cursor(['2024-01-01T00:00:00+00:00']),
+            encode_json_cursor(['2024-01-01T00:00:00+00:00', 1, 2]),
+            encode_json_cursor(['2024-01-01T00:00:00+00:00', None]),
+            encode_json_cursor([['nested'], 1]),
+            encode_json_cursor(['2024-01-01T00:00:00+00:00', True]),
+        ]
+        for cursor in tampered:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.path, {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+    def test_rows_with_a_null_key_sort_last_and_page_through(self):
+        dated = self.create_users(2)
+        undated = self.create_users(3, created_at=None)
+        ids, _ = self.list_all(limit=1)
+        self.assertEqual(ids, dated + undated)
+
+        body = self.client.get(self.path, {'limit': 3}).json()
+        self.assertIsNone(body['users'][-1]['created_at'])
+        self.assertEqual(decode_cursor(body['next_cursor'], USER_ACCOUNT_KEY), (None, undated[0]))
+
+    def test_keyset_condition_with_a_null_key_value(self):
+        self.assertEqual(
+            keyset_condition(USER_ACCOUNT_KEY, ('2024-01-01', 7)),
+            'created_at.gt."2024-01-01",created_at.is.null,and(created_at.eq."2024-01-01",id.gt."7")'
+        )
+        self.assertEqual(keyset_condition(USER_ACCOUNT_KEY, (None, 7)), 'and(created_at.is.null,id.gt."7")')
+        self.assertEqual(
+            keyset_condition(CARBON_RECORD_KEY, ('2024-01-01', 'a"b')),
+            'date.gt."2024-01-01",and(date.eq."2024-01-01",uid.gt."a\\"b")'
+        )
+
+    def test_limit_validation(self):
+        self.assertEqual(self.client.get(self.path, {'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get(self.path, {'limit': 'ten'}).status_code, 400)
+
+    @override_settings(PAGINATION_MAX_LIMIT=5000, POSTGREST_MAX_ROWS=1000)
+    def test_max_limit_is_clamped_below_postgrest_max_rows(self):
+        response = self.client.get(self.path, {'limit': 1000})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Limit must be between 1 and 999'})
+        self.assertEqual(self.client.get(self.path, {'limit': 999}).status_code, 200)
+
+    @override_settings(PAGINATION_MAX_LIMIT=50)
+    def test_max_limit_setting_below_the_cap_applies(self):
+        self.assertEqual(self.client.get(self.path, {'limit': 51}).status_code, 400)
+        self.assertEqual(self.client.get(self.path, {'limit': 50}).status_code, 200)
+
+
+class SessionTokenRevocationTests(MemoryBackendTestCase):
+    path = '/api/sources/user/sources/'
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.register('alice')
+
+    def login(self):
+        response = self.post_json('/api/accounts/login/', {'username': 'alice', 'password': 'secret123'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['token']
+
+    def get_with(self, token):
+        return self.client.get(self.path, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def assertRevoked(self, response):
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Token has been revoked'})
+
+    def test_logout_revokes_only_that_token(self):
+        token, other = self.login(), self.login()
+        self.assertEqual(self.get_with(token).status_code, 200)
+
+        response = self.client.post('/api/accounts/logout/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRevoked(self.get_with(token))
+        self.assertEqual(self.get_with(other).status_code, 200)
+
+    def test_forged_and_expired_tokens_are_rejected(self):
+        token = self.login()
+        self.assertEqual(self.get_with(token[:-2] + 'xx').json(), {'error': 'Invalid token'})
+        with override_settings(SESSION_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.get_with(token).json(), {'error': 'Token has expired'})
+
+    def test_user_revocation_rejects_earlier_tokens_only(self):
+        now = time.time()
+        with mock.patch('time.time', return_value=now - 20):
+            before = issue_token(self.alice['id'], None, 'alice@example.com')
+        with mock.patch('time.time', return_value=now - 10):
+            revoke_user_tokens(self.alice['id'])
+        after = issue_token(self.alice['id'], None, 'alice@example.com')
+
+        self.assertRevoked(self.get_with(before))
+        self.assertEqual(self.get_with(after).status_code, 200)
+
+    def test_user_revocation_does_not_affect_other_users(self):
+        self.register('bob')
+        bob = self.post_json('/api/accounts/login/', {'username': 'bob', 'password': 'secret123'}).json()['token']
+        revoke_user_tokens(self.alice['id'])
+        self.assertEqual(self.get_with(bob).status_code, 200)
+
+    def test_email_change_revokes_the_users_tokens(self):
+        token = self.login()
+        response = self.put_json(f'/api/accounts/users/{self.alice["id"]}/', {'email': 'alice@example.org'})
+        self.assertEqual(response.status_code, 200)
+        self.assertRevoked(self.get_with(token))
+
+    def test_deactivation_revokes_the_users_tokens(self):
+        token = self.login()
+        response = self.put_json(f'/api/accounts/users/{self.alice["id"]}/', {'is_active': False})
+        self.assertEqual(response.status_code, 200)
+        self.assertRevoked(self.get_with(token))
+
+    def test_other_updates_keep_tokens_valid(self):
+        token = self.login()
+        response = self.put_json(f'/api/accounts/users/{self.alice["id"]}/', {
+            'email': 'alice@example.com', 'first_name': 'Alice', 'is_active': True
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_with(token).status_code, 200)
+
+    async def test_async_middleware_rejects_revoked_tokens(self):
+        token = await sync_to_async(self.login)()
+        await sync_to_async(revoke_user_tokens)(self.alice['id'])
+        response = await self.async_client.get(self.path, AUTHORIZATION=f'Bearer {token}')
+        self.assertRevoked(response)
+
+
+class AsyncUserSourcesTests(MemoryBackendTestCase):
+    """The async user source views, called directly since URL routing picks the sync ones under test"""
+
+    def setUp(self):
+        super().setUp()
+        self.register('alice')
+        self.source_uid = self.create_source()
+        self.factory = AsyncRequestFactory()
+
+    async def list_sources(self):
+        response = await get_user_sources_async(self.factory.get('/api/sources/user/sources/', {'email': 'alice@example.com'}))
+        self.assertEqual(response.status_code, 200)
+        return [source['uid'] for source in json.loads(response.content)['sources']]
+
+    async def test_repeated_reads_are_served_from_the_read_cache(self):
+        before = supabase_client.stats()
+        self.assertEqual(await self.list_sources(), [])
+        self.assertEqual(await self.list_sources(), [])
+        after = supabase_client.stats()
+        self.assertEqual((after['misses'] - before['misses'], after['hits'] - before['hits']), (1, 1))
+
+    async def test_async_add_invalidates_the_cached_list(self):
+        self.assertEqual(await self.list_sources(), [])
+        request = self.factory.post('/api/sources/user/add/', json.dumps({'email': 'alice@example.com', 'source_uid': self.source_uid}),
+                                    content_type='application/json')
+        self.assertEqual((await add_source_to_user_async(request)).status_code, 201)
+        self.assertEqual(await self.list_sources(), [self.source_uid])
+
+
+class AsyncRecordViewsTests(MemoryBackendTestCase):
+    """The async record views, called directly, answer like the sync views they stand in for"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.register('alice')
+        self.source_uid = self.create_source()
+        self.factory = AsyncRequestFactory()
+        self.records = [
+            {'uid': str(uuid.uuid4()), 'source_uid': self.source_uid, 'amount': amount, 'date': f'2024-03-{day:02d}'}
+            for day, amount in ((1, 1.5), (2, 2.0), (9, 4.0))
+        ]
+        response = self.post_json('/api/sources/user/records/ingest/', {'email': 'alice@example.com', 'records': self.records})
+        self.assertEqual(response.status_code, 201)
+
+    def assertSameResponse(self, sync_response, async_response):
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(json.loads(async_response.content), sync_response.json())
+
+    async def test_records_by_timeframe(self):
+        params = {'email': 'alice@example.com', 'source_uid': self.source_uid, 'start_date': '2024-03-01',
+                  'end_date': '2024-03-31', 'limit': 2}
+        path = '/api/sources/user/records/'
+        sync_response = await sync_to_async(self.client.get)(path, params)
+        self.assertEqual(len(sync_response.json()['records']), 2)
+        self.assertSameResponse(sync_response, await get_user_records_by_timeframe_async(self.factory.get(path, params)))
+
+    async def test_export_streams_every_page(self):
+        path = '/api/sources/user/records/export/'
+        for export_format in ('ndjson', 'csv'):
+            params = {'email': 'alice@example.com', 'format': export_format}
+            with override_settings(EXPORT_CHUNK_SIZE=2):
+                sync_response = await sync_to_async(self.client.get)(path, params)
+                sync_content = b''.join(sync_response.streaming_content)
+                async_response = await export_user_records_async(self.factory.get(path, params))
+                async_content = b''.join([chunk async for chunk in async_response.streaming_content])
+            self.assertEqual(async_response['Content-Disposition'], sync_response['Content-Disposition'])
+            self.assertEqual(async_content, sync_content)
+        self.assertEqual(len(async_content.decode().splitlines()), len(self.records) + 1)
+
+    async def test_export_rejects_bad_parameters(self):
+        request = self.factory.get('/api/sources/user/records/export/', {'email': 'alice@example.com', 'format': 'xml'})
+        response = await export_user_records_async(request)
+        self.assertEqual((response.status_code, json.loads(response.content)), (400, {'error': 'Format must be ndjson or csv'}))
+
+    async def test_ingest(self):
+        bob = await sync_to_async(self.register)('bob')
+        records = [
+            {'source_uid': self.source_uid, 'amount': 3, 'date': '2024-04-01'},
+            {'source_uid': self.source_uid, 'amount': -1, 'date': '2024-04-01'},
+            # Alice's record, which bob may not overwrite
+            {'uid': self.records[0]['uid'], 'source_uid': self.source_uid, 'amount': 9, 'date': '2024-04-01'}
+        ]
+        request = self.factory.post('/api/sources/user/records/ingest/', json.dumps({'email': 'bob@example.com', 'records': records}),
+                                    content_type='application/json')
+        response = await ingest_user_records_async(request)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(json.loads(response.content), {'ingested': 1, 'failed': 2, 'errors': [
+            {'index': 1, 'error': 'Amount must be a non-negative number'},
+            {'index': 2, 'error': 'Record uid already exists'}
+        ]})
+        stored = [record for record in memory_database.tables['carbon_records'].values() if record['user_id'] == bob['id']]
+        self.assertEqual([(record['amount'], record['footprint']) for record in stored], [(3, 3 * 2.3)])
+
+    async def test_consumption_series(self):
+        path = '/api/activities/carbon-consumption/series/'
+        body = {'email': 'alice@example.com', 'start_date': '2024-03-01', 'end_date': '2024-03-31', 'bucket': 'week',
+                'split_by_source': True}
+        sync_response = await sync_to_async(self.post_json)(path, body)
+        self.assertEqual(sync_response.json()['total_carbon_consumption'], 7.5)
+        request = self.factory.post(path, json.dumps(body), content_type='application/json')
+        self.assertSameResponse(sync_response, await carbon_consumption_series_async(request))
+
+
+class FootprintCalculationTests(MemoryBackendTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source_uid = self.create_source('Travel')
+
+    def test_calculation_keeps_the_deprecated_default_factor(self):
+        response = self.post_json('/api/sources/calculate/', {'source_id': self.source_uid, 'amount': 10})
+        self.assertEqual(response.status_code, 200)
+        calculation = response.json()['calculation']
+        self.assertEqual(calculation['emission_factor'], 2.3)
+        self.assertEqual(calculation['default_factor'], calculation['emission_factor'])
+        self.assertEqual(calculation['factor_origin'], 'category')
+        self.assertAlmostEqual(response.json()['carbon_footprint'], 23.0)
+
+    def test_batch_results_keep_the_deprecated_default_factor(self):
+        response = self.post_json('/api/sources/calculate/batch/', {'items': [{'source_id': self.source_uid, 'amount': 1}]})
+        self.assertEqual(response.status_code, 200)
+        calculation = response.json()['results'][0]['calculation']
+        self.assertEqual(calculation['default_factor'], calculation['emission_factor'])
+
+
+class SharedCatalogTests(MemoryBackendTestCase):
+    """Catalog snapshots shared between workers through a file in a private temp directory"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'catalog')
+
+    def shared(self):
+        catalog = SharedCatalog(self.path)
+        self.addCleanup(lambda: catalog._fd is not None and (catalog._map.close(), os.close(catalog._fd)))
+        return catalog
+
+    def test_snapshot_round_trips_as_json(self):
+        publisher, reader = self.shared(), self.shared()
+        payload = {'loaded_at': 1.5, 'valid_from': date(2024, 1, 1), 'uid': uuid.UUID(int=1), 'factor': Decimal('2.5')}
+        with publisher.lock():
+            generation = publisher.publish(payload, 10.0)
+        self.assertEqual(reader.read(), (generation, 10.0, {
+            'loaded_at': 1.5, 'valid_from': '2024-01-01', 'uid': str(uuid.UUID(int=1)), 'factor': 2.5
+        }))
+        self.assertEqual(reader.read(generation), (generation, 10.0, None))
+
+    def test_file_readable_by_others_is_refused(self):
+        with open(self.path, 'wb'):
+            pass
+        os.chmod(self.path, 0o644)
+        with self.assertRaises(PermissionError):
+            self.shared().header()
+
+    def test_pickled_payload_is_never_executed(self):
+        catalog = self.shared()
+        data = pickle.dumps(mock.Mock)
+        with catalog.lock():
+            catalog.publish({'padding': ' ' * len(data)}, 10.0)
+            HEADER.pack_into(catalog._map, 0, MAGIC, 4, 2, 10.0, len(data))
+            catalog._map[HEADER.size:HEADER.size + len(data)] = data
+        with mock.patch('pickle.loads', side_effect=AssertionError('unpickled the payload')):
+            with self.assertRaises(ValueError):
+                self.shared().read()
+
+    def test_workers_serve_the_catalog_one_of_them_loaded(self):
+        source_uid = self.create_source('Travel')
+        first = EmissionFactorRegistry(storage_backend, shared=self.shared())
+        second = EmissionFactorRegistry(storage_backend, shared=self.shared())
+        source = first.get_source(source_uid)
+        with mock.patch.object(storage_backend, 'get_catalog_versions', side_effect=AssertionError('queried the database')):
+            self.assertEqual(second.get_source(source_uid), source)
+            self.assertEqual(second.resolve(source), first.resolve(source))
+            self.assertEqual(second.factors(), first.factors())
+        self.assertEqual(first.reloads, 1)
+        self.assertEqual(second.reloads, 0)
+
+
+class HealthAndMetricsTests(MemoryBackendTestCase):
+
+    def test_health_check_exposes_no_internals(self):
+        response = self.client.get('/api/health/')
+        self.assertEqual(response.json(), {'status': 'healthy', 'message': 'API is running successfully'})
+
+    def test_metrics_only_answer_allowed_addresses(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+        response = self.client.get('/api/metrics/', REMOTE_ADDR='203.0.113.5')
+        self.assertEqual((response.status_code, response.json()), (403, {'error': 'Forbidden'}))
+        with override_settings(METRICS_ALLOWED_IPS=['10.0.0.0/8']):
+            self.assertEqual(self.client.get('/api/metrics/', REMOTE_ADDR='10.1.2.3').status_code, 200)
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    def test_disabled_metrics_return_404(self):
+        with override_settings(METRICS_ENABLED=False):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+
+
+class SchemaMigrationTests(SimpleTestCase):
+    """The migration runner's planning and scripts, with no database"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def write(self, name, sql):
+        (self.directory / name).write_text(sql)
+
+    def migrations(self):
+        return discover_migrations(self.directory)
+
+    def test_discovers_numbered_files_in_version_order(self):
+        self.write('002_second.sql', 'select 2;')
+        self.write('001_first.sql', 'select 1;')
+        self.write('notes.sql', 'select 0;')
+        self.write('003_third.txt', 'select 3;')
+        self.assertEqual([(m.version, m.name) for m in self.migrations()], [('001', 'first'), ('002', 'second')])
+
+    def test_checksum_ignores_line_endings(self):
+        self.write('001_first.sql', 'select 1;\nselect 2;\n')
+        unix = self.migrations()[0].checksum
+        (self.directory / '001_first.sql').write_bytes(b'select 1;\r\nselect 2;\r\n')
+        self.assertEqual(self.migrations()[0].checksum, unix)
+
+    def test_duplicate_versions_are_refused(self):
+        self.write('004_one.sql', 'select 1;')
+        self.write('004_other.sql', 'select 2;')
+        self.write('005_fine.sql', 'select 3;')
+        with self.assertRaisesMessage(MigrationError, 'More than one migration file for version 004'):
+            self.migrations()
+
+    def test_plan_skips_applied_migrations(self):
+        self.write('001_first.sql', 'select 1;')
+        self.write('002_second.sql', 'select 2;')
+        first, second = self.migrations()
+        pending, changed = plan([first, second], {'001': first.checksum})
+        self.assertEqual((pending, changed), ([second], []))
+        self.assertEqual(plan([first, second], {'001': first.checksum, '002': second.checksum}), ([], []))
+
+    def test_changed_checksum_is_refused(self):
+        self.write('001_first.sql', 'select 1;')
+        first, = self.migrations()
+        pending, changed = plan([first], {'001': 'stale checksum'})
+        self.assertEqual((pending, changed), ([], [first]))
+        with self.assertRaisesMessage(MigrationError, 'Applied migrations have changed on disk: 001_first.sql'):
+            check_changed(changed)
+        check_changed([])
+
+    def test_script_ends_a_trailing_comment_and_a_missing_semicolon(self):
+        self.write('001_first.sql', "create table t (id int);\nselect 1 -- no semicolon, then a comment")
+        first, = self.migrations()
+        lines = migration_script(first).splitlines()
+        self.assertEqual(lines[:3], ['create table t (id int);', 'select 1 -- no semicolon, then a comment', ';'])
+        self.assertTrue(lines[3].startswith('insert into schema_migrations (version, name, checksum, execution_time) values '))
+        self.assertIn(f"('001', 'first', '{first.checksum}', ", lines[3])
+        self.assertEqual(len(lines), 4)
+
+    def test_fake_script_only_records_the_migration(self):
+        self.write('001_first.sql', 'drop table everything;')
+        first, = self.migrations()
+        script = migration_script(first, fake=True)
+        self.assertTrue(script.startswith('insert into schema_migrations'))
+        self.assertNotIn('drop table', script)
+
+    def test_quote_literal_escapes_quotes(self):
+        self.assertEqual(quote_literal("it's"), "'it''s'")
+
+    def test_postgres_runner_skips_the_lock_when_up_to_date(self):
+        self.write('001_first.sql', 'select 1;')
+        first, = self.migrations()
+        connection = mock.MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [('001', first.checksum)]
+        with mock.patch('api.schema_migrations.psycopg2.connect', return_value=connection):
+            self.assertEqual(PostgresMigrationRunner('postgresql://example').migrate([first]), [])
+        cursor.execute.assert_called_once_with('select version, checksum from schema_migrations')
+        connection.close.assert_called_once_with()
+
+    def test_rest_runner_applies_pending_migrations_in_order(self):
+        self.write('001_first.sql', 'select 1;')
+        self.write('002_second.sql', 'select 2;')
+        first, second = self.migrations()
+        client = FakeExecSqlClient({'001': first.checksum})
+        logged = []
+        done = RestMigrationRunner(client).migrate([first, second], log=lambda migration, seconds: logged.append(migration))
+        self.assertEqual(done, [second])
+        self.assertEqual(logged, [second])
+        self.assertEqual(len(client.scripts), 1)
+        self.assertIn('pg_advisory_xact_lock', client.scripts[0])
+        self.assertTrue(client.scripts[0].rstrip().endswith(migration_script(second).splitlines()[-1]))
+
+    def test_rest_runner_skips_a_migration_another_process_applied(self):
+        self.write('001_first.sql', 'select 1;')
+        self.write('002_second.sql', 'select 2;')
+        first, second = self.migrations()
+        client = FakeExecSqlClient({})
+        # The other process commits 001 first; our exec_sql call then fails on the primary key
+        client.lose_race = {'001': first.checksum}
+        done = RestMigrationRunner(client).migrate([first, second])
+        self.assertEqual(done, [second])
+        self.assertEqual(client.applied, {'001': first.checksum, '002': second.checksum})
+
+    def test_rest_runner_reports_a_failed_migration(self):
+        self.write('001_first.sql', 'select 1;')
+        first, = self.migrations()
+        client = FakeExecSqlClient({})
+        client.error = RuntimeError('syntax error at or near "selec"')
+        with self.assertRaisesMessage(MigrationError, '001_first.sql: syntax error at or near "selec"'):
+            RestMigrationRunner(client).migrate([first])
+
+    def test_rest_runner_refuses_changed_migrations_before_running_any(self):
+        self.write('001_first.sql', 'select 1;')
+        self.write('002_second.sql', 'select 2;')
+        first, second = self.migrations()
+        client = FakeExecSqlClient({'001': 'stale checksum'})
+        with self.assertRaises(MigrationError):
+            RestMigrationRunner(client).migrate([first, second])
+        self.assertEqual(client.scripts, [])
+
+
+class FakeExecSqlClient:
+    """Just enough of the PostgREST client for RestMigrationRunner: exec_sql and schema_migrations"""
+
+    def __init__(self, applied):
+        self.applied = dict(applied)
+        self.scripts = []
+        self.lose_race = {}
+        self.error = None
+
+    def rpc(self, name, params):
+        assert name == 'exec_sql'
+        return mock.Mock(execute=lambda: self.exec_sql(params['sql']))
+
+    def table(self, name):
+        assert name == 'schema_migrations'
+        rows = [{'version': version, 'checksum': checksum} for version, checksum in self.applied.items()]
+        return mock.Mock(**{'select.return_value.execute.return_value.data': rows})
+
+    def exec_sql(self, sql):
+        self.scripts.append(sql)
+        if self.error:
+            raise self.error
+        version = re.search(r"values \('(\d+)', '\w+', '(\w+)'", sql)
+        if version.group(1) in self.lose_race:
+            self.applied[version.group(1)] = self.lose_race.pop(version.group(1))
+            raise RuntimeError('duplicate key value violates unique constraint "schema_migrations_pkey"')
+        self.applied[version.group(1)] = version.group(2)
+
+
+def encode_json_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
@@ -0,0 +1,76 @@
+import secrets
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+SALT = 'api.session-token'
+
+# Identity carried by a verified session token
+TokenIdentity = namedtuple('TokenIdentity', ['user_id', 'profile_id', 'email', 'token_id', 'issued_at'])
+
+
+class TokenRevoked(Exception):
+    """Raised when a correctly signed token has been revoked"""
+
+
+def token_max_age():
+    """Seconds a session token stays valid"""
+    return getattr(settings, 'SESSION_TOKEN_MAX_AGE', 86400)
+
+
+def issue_token(user_id, profile_id, email):
+    """Return a signed, expiring session token for a user"""
+    return signing.dumps({
+        'uid': user_id,
+        'pid': profile_id,
+        'email': email,
+        'jti': secrets.token_urlsafe(12),
+        'iat': time.time()
+    }, salt=SALT)
+
+
+def verify_token(token):
+    """Check a token's signature and age without any I/O.
+
+    Returns its TokenIdentity; raises signing.BadSignature (or its subclass
+    SignatureExpired) when the token is forged, malformed or too old.
+    """
+    payload = signing.loads(token, salt=SALT, max_age=token_max_age())
+    return TokenIdentity(payload['uid'], payload.get('pid'), payload['email'], payload['jti'], payload['iat'])
+
+
+def _revocation_keys(identity):
+    return f'session-token:revoked:{identity.token_id}', f'session-token:user-revoked:{identity.user_id}'
+
+
+def _check_revocations(identity, entries):
+    """Raise TokenRevoked if the token or every token of its user issued before it was revoked"""
+    token_key, user_key = _revocation_keys(identity)
+    if token_key in entries or entries.get(user_key, 0) >= identity.issued_at:
+        raise TokenRevoked('Token has been revoked')
+
+
+def check_revoked(identity):
+    """Raise TokenRevoked if the token was revoked; one cache lookup, no database query"""
+    _check_revocations(identity, cache.get_many(_revocation_keys(identity)))
+
+
+async def acheck_revoked(identity):
+    """Async variant of check_revoked"""
+    _check_revocations(identity, await cache.aget_many(_revocation_keys(identity)))
+
+
+def revoke_token(identity):
+    """Revoke one token, e.g. on logout.
+
+    Entries expire when the token would have, so the revocation set only ever holds
+    tokens that are still within their max age.
+    """
+    cache.set(_revocation_keys(identity)[0], True, timeout=token_max_age())
+
+
+def revoke_user_tokens(user_id):
+    """Revoke every token issued to a user so far, e.g. when the account is disabled or deleted"""
+    cache.set(f'session-token:user-revoked:{user_id}', time.time(), timeout=token_max_age())
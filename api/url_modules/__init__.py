@@ -1 +1,13 @@
-# URLs package for API
\ No newline at end of file
+# URLs package for API
+from django.conf import settings
+
+
+def select_view(module, name):
+    """Return the async variant of a view when ASYNC_VIEWS is enabled and one exists.
+
+    The async variants talk to Supabase over REST, so they are only used with the
+    default 'supabase' storage backend and its in-memory stand-in.
+    """
+    if getattr(settings, 'ASYNC_VIEWS', False) and getattr(settings, 'STORAGE_BACKEND', 'supabase') in ('supabase', 'memory'):
+        return getattr(module, f'{name}_async', getattr(module, name))
+    return getattr(module, name)
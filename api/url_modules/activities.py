@@ -1,12 +1,14 @@
 from django.urls import path
 from ..views import activities
+from . import select_view
 
 # User Activity URLs
-# Single endpoint for carbon consumption tracking
+# Endpoints for carbon consumption tracking
 
 app_name = 'activities'
 
 urlpatterns = [
     # Carbon consumption endpoint
-    path('carbon-consumption/', activities.carbon_consumption, name='carbon_consumption'),
+    path('carbon-consumption/', select_view(activities, 'carbon_consumption'), name='carbon_consumption'),
+    path('carbon-consumption/series/', select_view(activities, 'carbon_consumption_series'), name='carbon_consumption_series'),
 ]
\ No newline at end of file
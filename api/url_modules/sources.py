@@ -1,5 +1,6 @@
 from django.urls import path
 from ..views import sources
+from . import select_view
 
 # Carbon Footprint Source Management URLs
 # Handles carbon sources, calculations, and footprint data
@@ -8,19 +9,22 @@ app_name = 'sources'
 
 urlpatterns = [
     # Carbon footprint source endpoints
-    path('', sources.source_list, name='source_list'),
-    path('<int:source_id>/', sources.source_detail, name='source_detail'),
-    path('categories/', sources.source_categories, name='source_categories'),
-    path('calculate/', sources.calculate_footprint, name='calculate_footprint'),
+    path('', select_view(sources, 'source_list'), name='source_list'),
+    path('<int:source_id>/', select_view(sources, 'source_detail'), name='source_detail'),
+    path('categories/', select_view(sources, 'source_categories'), name='source_categories'),
+    path('calculate/', select_view(sources, 'calculate_footprint'), name='calculate_footprint'),
+    path('calculate/batch/', select_view(sources, 'calculate_footprint_batch'), name='calculate_footprint_batch'),
+    path('emission-factors/', select_view(sources, 'emission_factors'), name='emission_factors'),
     
     # User source management endpoints
-    path('user/add/', sources.add_source_to_user, name='add_source_to_user'),
-    path('user/records/', sources.get_user_records_by_timeframe, name='get_user_records_by_timeframe'),
-    path('user/remove/', sources.remove_source_from_user, name='remove_source_from_user'),
-    path('user/sources/', sources.get_user_sources, name='get_user_sources'),
+    path('user/add/', select_view(sources, 'add_source_to_user'), name='add_source_to_user'),
+    path('user/records/', select_view(sources, 'get_user_records_by_timeframe'), name='get_user_records_by_timeframe'),
+    path('user/records/export/', select_view(sources, 'export_user_records'), name='export_user_records'),
+    path('user/records/ingest/', select_view(sources, 'ingest_user_records'), name='ingest_user_records'),
+    path('user/remove/', select_view(sources, 'remove_source_from_user'), name='remove_source_from_user'),
+    path('user/sources/', select_view(sources, 'get_user_sources'), name='get_user_sources'),
     
     # Future endpoints (to be implemented)
     # path('user/<int:user_id>/footprint/', views.user_footprint, name='user_footprint'),
     # path('reports/', views.footprint_reports, name='footprint_reports'),
-    # path('emissions/', views.emission_factors, name='emission_factors'),
 ]
\ No newline at end of file
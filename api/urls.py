@@ -5,6 +5,7 @@ urlpatterns = [
     # API root and health check
     path('', views.index, name='api_root'),
     path('health/', views.health_check, name='health_check'),
+    path('metrics/', views.metrics, name='metrics'),
     
     # Include category-specific URL modules
     path('accounts/', include('api.url_modules.accounts')),
@@ -10,7 +10,10 @@ from .activities import *
 from .sources import *
 
 # Keep the original views for backward compatibility
-from django.http import JsonResponse
+import ipaddress
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from ..metrics import metrics as metrics_registry
 
 def index(request):
     """API root endpoint"""
@@ -29,4 +32,21 @@ def health_check(request):
     return JsonResponse({
         'status': 'healthy',
         'message': 'API is running successfully'
-    })
\ No newline at end of file
+    })
+
+def _metrics_allowed(request):
+    """Whether the request comes from an address in METRICS_ALLOWED_IPS (addresses or CIDR networks)"""
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network.strip(), strict=False)
+               for network in getattr(settings, 'METRICS_ALLOWED_IPS', ()) if network.strip())
+
+def metrics(request):
+    """Prometheus metrics in the text exposition format"""
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        return JsonResponse({'error': 'Metrics are disabled'}, status=404)
+    if not _metrics_allowed(request):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
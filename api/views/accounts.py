@@ -1,86 +1,104 @@
 from django.http import JsonResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+import asyncio
 import json
-from datetime import datetime
-from ..supabase_client import supabase_client
+from ..supabase_client import supabase_client, async_supabase_client, UniqueViolation
+from ..identity import identity_resolver
+from ..pagination import USER_ACCOUNT_KEY, parse_page_params, page_results
+from ..tokens import issue_token, revoke_token, revoke_user_tokens, token_max_age
+from .decorators import async_api_view
+
+def _new_user_data(data):
+    """Validate a registration payload; returns (user_data, error_response)"""
+    for field in ('username', 'email', 'password'):
+        if not data.get(field):
+            return None, JsonResponse({
+                'error': f'{field.capitalize()} is required'
+            }, status=400)
+    
+    return {
+        'username': data['username'],
+        'email': data['email'],
+        'password_hash': data['password'],  # In production, hash this properly
+        'first_name': data.get('first_name', ''),
+        'last_name': data.get('last_name', ''),
+        'date_joined': timezone.now().isoformat(),
+        'is_active': True
+    }, None
+
+def _registration_response(response, message):
+    """Build the response for a newly created account"""
+    if not response.data:
+        return JsonResponse({'error': 'Failed to create user'}, status=500)
+    user = response.data[0]
+    return JsonResponse({
+        'message': message,
+        'user': {
+            'id': user['id'],
+            'username': user['username'],
+            'email': user['email'],
+            'first_name': user['first_name'],
+            'last_name': user['last_name']
+        }
+    }, status=201)
+
+def _conflict_response(error):
+    """Map a unique constraint violation on user_accounts to the matching error response"""
+    messages = {'username': 'Username already exists', 'email': 'Email already exists'}
+    return JsonResponse({'error': messages.get(error.column, 'User already exists')}, status=400)
+
+def _register(request, message):
+    """Create a user account with a single insert.
+
+    Duplicate usernames and emails are caught by the unique constraints on user_accounts
+    rather than looked up first, so concurrent signups cannot both take the same name.
+    """
+    try:
+        user_data, error_response = _new_user_data(json.loads(request.body))
+        if error_response:
+            return error_response
+        return _registration_response(supabase_client.create_user_account(user_data), message)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except UniqueViolation as e:
+        return _conflict_response(e)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+async def _aregister(request, message):
+    """Async variant of _register"""
+    try:
+        user_data, error_response = _new_user_data(json.loads(request.body))
+        if error_response:
+            return error_response
+        return _registration_response(await async_supabase_client.create_user_account(user_data), message)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except UniqueViolation as e:
+        return _conflict_response(e)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
 
 @require_http_methods(["GET", "POST"])
 @csrf_exempt
 def user_list(request):
     """Handle user list operations"""
     if request.method == 'GET':
+        limit, after, error_response = parse_page_params(request.GET, USER_ACCOUNT_KEY)
+        if error_response:
+            return error_response
         try:
-            # Get all users from Supabase
-            response = supabase_client.list_user_accounts()
-            if response.data:
-                return JsonResponse({'users': response.data})
-            else:
-                return JsonResponse({'users': []})
+            # Get one page of users from Supabase, plus one row to tell whether another page follows
+            response = supabase_client.list_user_accounts(limit=limit + 1, after=after)
+            users, next_cursor = page_results(response.data, limit, USER_ACCOUNT_KEY)
+            return JsonResponse({'users': users, 'next_cursor': next_cursor})
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
     elif request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            username = data.get('username')
-            email = data.get('email')
-            password = data.get('password')
-            first_name = data.get('first_name', '')
-            last_name = data.get('last_name', '')
-            
-            # Validate required fields
-            if not all([username, email, password]):
-                return JsonResponse({
-                    'error': 'Username, email, and password are required'
-                }, status=400)
-            
-            # Check if user already exists by username
-            existing_user = supabase_client.get_client().table('user_accounts').select('*').eq('username', username).execute()
-            if existing_user.data:
-                return JsonResponse({
-                    'error': 'Username already exists'
-                }, status=400)
-            
-            # Check if user already exists by email
-            existing_email = supabase_client.get_client().table('user_accounts').select('*').eq('email', email).execute()
-            if existing_email.data:
-                return JsonResponse({
-                    'error': 'Email already exists'
-                }, status=400)
-            
-            # Create new user account in Supabase
-            user_data = {
-                'username': username,
-                'email': email,
-                'password_hash': password,  # In production, this should be hashed
-                'first_name': first_name,
-                'last_name': last_name,
-                'date_joined': datetime.now().isoformat(),
-                'is_active': True
-            }
-            
-            response = supabase_client.create_user_account(user_data)
-            
-            if response.data:
-                user = response.data[0]
-                return JsonResponse({
-                    'message': 'User created successfully',
-                    'user': {
-                        'id': user['id'],
-                        'username': user['username'],
-                        'email': user['email'],
-                        'first_name': user['first_name'],
-                        'last_name': user['last_name']
-                    }
-                }, status=201)
-            else:
-                return JsonResponse({'error': 'Failed to create user'}, status=500)
-            
-        except json.JSONDecodeError:
-            return JsonResponse({'error': 'Invalid JSON'}, status=400)
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=500)
+        return _register(request, 'User created successfully')
 
 @require_http_methods(["GET", "PUT", "DELETE"])
 @csrf_exempt
@@ -104,7 +122,7 @@ def user_detail(request, user_id):
             
             # Check if email is already taken by another user
             if 'email' in data:
-                existing_email = supabase_client.get_client().table('user_accounts').select('*').eq('email', data['email']).neq('id', user_id).execute()
+                existing_email = supabase_client.get_user_account_by_email(data['email'], columns='id', exclude_id=user_id)
                 if existing_email.data:
                     return JsonResponse({
                         'error': 'Email already exists'
@@ -123,6 +141,10 @@ def user_detail(request, user_id):
             
             if update_data:
                 response = supabase_client.update_user_account(user_id, update_data)
+                identity_resolver.invalidate_user(user_id)
+                # Tokens carry the email they were issued for, so a new email invalidates them
+                if update_data.get('is_active') is False or update_data.get('email', user['email']) != user['email']:
+                    revoke_user_tokens(user_id)
                 if response.data:
                     updated_user = response.data[0]
                     return JsonResponse({
@@ -143,6 +165,8 @@ def user_detail(request, user_id):
         try:
             username = user.get('username', 'Unknown')
             response = supabase_client.delete_user_account(user_id)
+            identity_resolver.invalidate_user(user_id)
+            revoke_user_tokens(user_id)
             return JsonResponse({
                 'message': f'User {username} (ID: {user_id}) deleted successfully'
             })
@@ -153,58 +177,60 @@ def user_detail(request, user_id):
 @csrf_exempt
 def user_register(request):
     """Register a new user"""
+    return _register(request, 'User registered successfully')
+
+@require_http_methods(["POST"])
+@csrf_exempt
+def user_login(request):
+    """Handle user login"""
     try:
         data = json.loads(request.body)
+        username = data.get('username')
+        password = data.get('password')
         
-        # Validate required fields
-        required_fields = ['username', 'email', 'password']
-        for field in required_fields:
-            if field not in data or not data[field]:
-                return JsonResponse({
-                    'error': f'{field.capitalize()} is required'
-                }, status=400)
-        
-        # Check if username already exists
-        existing_username = supabase_client.get_client().table('user_accounts').select('*').eq('username', data['username']).execute()
-        if existing_username.data:
+        if not username or not password:
             return JsonResponse({
-                'error': 'Username already exists'
+                'error': 'Username and password are required'
             }, status=400)
         
-        # Check if email already exists
-        existing_email = supabase_client.get_client().table('user_accounts').select('*').eq('email', data['email']).execute()
-        if existing_email.data:
+        # Find user by username
+        user_response = supabase_client.get_user_account_by_username(username)
+        
+        if not user_response.data:
             return JsonResponse({
-                'error': 'Email already exists'
-            }, status=400)
+                'error': 'Invalid username or password'
+            }, status=401)
         
-        # Create new user in Supabase
-        user_data = {
-            'username': data['username'],
-            'email': data['email'],
-            'password_hash': data['password'],  # In production, hash this properly
-            'first_name': data.get('first_name', ''),
-            'last_name': data.get('last_name', ''),
-            'is_active': True,
-            'created_at': datetime.now().isoformat()
-        }
+        user = user_response.data[0]
         
-        response = supabase_client.create_user_account(user_data)
-        if response.data:
-            user = response.data[0]
+        # In production, properly verify password hash
+        if user['password_hash'] == password and user['is_active']:
+            # Sign the identity into a session token so later requests need no user lookup
+            profile_response = supabase_client.get_user_profile(user['id'], columns='id')
+            profile_id = profile_response.data[0]['id'] if profile_response.data else None
+            identity_resolver.remember(user['email'], user['id'], profile_id)
             return JsonResponse({
-                'message': 'User registered successfully',
+                'message': 'Login successful',
                 'user': {
                     'id': user['id'],
                     'username': user['username'],
                     'email': user['email'],
                     'first_name': user['first_name'],
                     'last_name': user['last_name']
-                }
-            }, status=201)
+                },
+                'token': issue_token(user['id'], profile_id, user['email']),
+                'token_type': 'Bearer',
+                'expires_in': token_max_age()
+            })
+        elif not user['is_active']:
+            return JsonResponse({
+                'error': 'Account is disabled'
+            }, status=403)
         else:
-            return JsonResponse({'error': 'Failed to create user'}, status=500)
-        
+            return JsonResponse({
+                'error': 'Invalid username or password'
+            }, status=401)
+            
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
     except Exception as e:
@@ -212,8 +238,114 @@ def user_register(request):
 
 @require_http_methods(["POST"])
 @csrf_exempt
-def user_login(request):
-    """Handle user login"""
+def user_logout(request):
+    """Handle user logout, revoking the session token the request was made with"""
+    try:
+        identity = getattr(request, 'identity', None)
+        if identity:
+            revoke_token(identity)
+        return JsonResponse({'message': 'Logout successful'})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+# Async variants, routed instead of the views above when ASYNC_VIEWS is enabled (the default under ASGI)
+
+@async_api_view(["GET", "POST"])
+async def user_list_async(request):
+    """Async variant of user_list"""
+    if request.method == 'GET':
+        limit, after, error_response = parse_page_params(request.GET, USER_ACCOUNT_KEY)
+        if error_response:
+            return error_response
+        try:
+            response = await async_supabase_client.list_user_accounts(limit=limit + 1, after=after)
+            users, next_cursor = page_results(response.data, limit, USER_ACCOUNT_KEY)
+            return JsonResponse({'users': users, 'next_cursor': next_cursor})
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+    
+    elif request.method == 'POST':
+        return await _aregister(request, 'User created successfully')
+
+@async_api_view(["GET", "PUT", "DELETE"])
+async def user_detail_async(request, user_id):
+    """Async variant of user_detail that fetches the user and checks email conflicts concurrently"""
+    try:
+        data = json.loads(request.body) if request.method == 'PUT' else {}
+    except json.JSONDecodeError:
+        data = None
+    
+    try:
+        lookups = [async_supabase_client.get_user_account(user_id)]
+        if data and 'email' in data:
+            lookups.append(async_supabase_client.get_user_account_by_email(data['email'], columns='id', exclude_id=user_id))
+        responses = await asyncio.gather(*lookups)
+        if not responses[0].data:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        user = responses[0].data[0]
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    if request.method == 'GET':
+        return JsonResponse({'user': user})
+    
+    elif request.method == 'PUT':
+        if data is None:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        
+        try:
+            # Check if email is already taken by another user
+            if len(responses) > 1 and responses[1].data:
+                return JsonResponse({
+                    'error': 'Email already exists'
+                }, status=400)
+            
+            update_data = {
+                field: data[field]
+                for field in ('email', 'first_name', 'last_name', 'is_active')
+                if field in data
+            }
+            
+            if update_data:
+                response = await async_supabase_client.update_user_account(user_id, update_data)
+                identity_resolver.invalidate_user(user_id)
+                # Tokens carry the email they were issued for, so a new email invalidates them
+                if update_data.get('is_active') is False or update_data.get('email', user['email']) != user['email']:
+                    revoke_user_tokens(user_id)
+                if response.data:
+                    return JsonResponse({
+                        'message': 'User updated successfully',
+                        'user': response.data[0]
+                    })
+                else:
+                    return JsonResponse({'error': 'Failed to update user'}, status=500)
+            else:
+                return JsonResponse({'error': 'No valid fields to update'}, status=400)
+                
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+    
+    elif request.method == 'DELETE':
+        try:
+            username = user.get('username', 'Unknown')
+            await async_supabase_client.delete_user_account(user_id)
+            identity_resolver.invalidate_user(user_id)
+            revoke_user_tokens(user_id)
+            return JsonResponse({
+                'message': f'User {username} (ID: {user_id}) deleted successfully'
+            })
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+@async_api_view(["POST"])
+async def user_register_async(request):
+    """Async variant of user_register"""
+    return await _aregister(request, 'User registered successfully')
+
+@async_api_view(["POST"])
+async def user_login_async(request):
+    """Async variant of user_login"""
     try:
         data = json.loads(request.body)
         username = data.get('username')
@@ -224,9 +356,7 @@ def user_login(request):
                 'error': 'Username and password are required'
             }, status=400)
         
-        # Find user by username
-        user_response = supabase_client.get_client().table('user_accounts').select('*').eq('username', username).execute()
-        
+        user_response = await async_supabase_client.get_user_account_by_username(username)
         if not user_response.data:
             return JsonResponse({
                 'error': 'Invalid username or password'
@@ -236,6 +366,9 @@ def user_login(request):
         
         # In production, properly verify password hash
         if user['password_hash'] == password and user['is_active']:
+            profile_response = await async_supabase_client.get_user_profile(user['id'], columns='id')
+            profile_id = profile_response.data[0]['id'] if profile_response.data else None
+            identity_resolver.remember(user['email'], user['id'], profile_id)
             return JsonResponse({
                 'message': 'Login successful',
                 'user': {
@@ -244,7 +377,10 @@ def user_login(request):
                     'email': user['email'],
                     'first_name': user['first_name'],
                     'last_name': user['last_name']
-                }
+                },
+                'token': issue_token(user['id'], profile_id, user['email']),
+                'token_type': 'Bearer',
+                'expires_in': token_max_age()
             })
         elif not user['is_active']:
             return JsonResponse({
@@ -257,16 +393,5 @@ def user_login(request):
             
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
-
-@require_http_methods(["POST"])
-@csrf_exempt
-def user_logout(request):
-    """Handle user logout"""
-    try:
-        # With Supabase, logout is typically handled on the frontend
-        # This endpoint can be used for any server-side cleanup if needed
-        return JsonResponse({'message': 'Logout successful'})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
@@ -3,7 +3,101 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from datetime import datetime
 import json
-from ..supabase_client import supabase_client
+import numpy as np
+from ..supabase_client import supabase_client, async_supabase_client
+from ..identity import identity_resolver, request_email
+from .decorators import async_api_view
+
+SERIES_BUCKETS = ('day', 'week', 'month')
+
+
+def _parse_timeframe(start_date, end_date):
+    """Validate a YYYY-MM-DD timeframe, returning (start, end, error_response)"""
+    try:
+        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
+        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None, None, JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=400)
+    
+    if start_date_obj > end_date_obj:
+        return None, None, JsonResponse({'error': 'Start date cannot be after end date'}, status=400)
+    
+    return start_date_obj, end_date_obj, None
+
+
+def _bucket_starts(days, bucket):
+    """Map datetime64[D] values to the start of their day/week/month bucket"""
+    if bucket == 'week':
+        # 1970-01-01 was a Thursday, so shift by 3 to land weeks on Mondays
+        return days - (days.astype('int64') + 3) % 7
+    if bucket == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    return days
+
+
+def _bucket_series(start_date, end_date, bucket, dates, amounts, counts, keys=None):
+    """Aggregate per-day amounts and counts into zero-filled buckets covering the timeframe.
+
+    Returns (periods, totals, record_counts, key_labels, key_totals) where
+    ``key_totals`` has one row per distinct key when ``keys`` is given.
+    """
+    first, last = _bucket_starts(np.array([start_date, end_date], dtype='datetime64[D]'), bucket)
+    if bucket == 'month':
+        periods = np.arange(first.astype('datetime64[M]'), last.astype('datetime64[M]') + 1).astype('datetime64[D]')
+    else:
+        step = 7 if bucket == 'week' else 1
+        periods = np.arange(first, last + 1, step)
+    size = len(periods)
+    
+    index = np.searchsorted(periods, _bucket_starts(dates, bucket))
+    totals = np.bincount(index, weights=amounts, minlength=size).astype('float64')
+    record_counts = np.bincount(index, weights=counts, minlength=size).astype('int64')
+    
+    key_labels, key_totals = None, None
+    if keys is not None:
+        key_labels, key_index = np.unique(keys, return_inverse=True)
+        key_totals = np.bincount(
+            key_index * size + index, weights=amounts, minlength=len(key_labels) * size
+        ).reshape(len(key_labels), size)
+    
+    return periods, totals, record_counts, key_labels, key_totals
+
+def _series_response(email, start_date, end_date, start_date_obj, end_date_obj, bucket, split_by_source, buckets):
+    """Zero-fill the database buckets of a consumption series in NumPy and build the response"""
+    dates = np.array([str(row['period_start'])[:10] for row in buckets], dtype='datetime64[D]')
+    amounts = np.array([row.get('total_amount') or 0 for row in buckets], dtype='float64')
+    counts = np.array([row.get('record_count') or 0 for row in buckets], dtype='float64')
+    keys = np.array([str(row.get('source_uid')) for row in buckets], dtype=object) if split_by_source else None
+
+    periods, totals, record_counts, source_uids, source_totals = _bucket_series(
+        start_date_obj, end_date_obj, bucket, dates, amounts, counts, keys
+    )
+
+    response_data = {
+        'email': email,
+        'timeframe': {
+            'start_date': start_date,
+            'end_date': end_date
+        },
+        'bucket': bucket,
+        'series': [
+            {
+                'period_start': str(period),
+                'total_carbon_consumption': total,
+                'record_count': count
+            }
+            for period, total, count in zip(periods, totals.tolist(), record_counts.tolist())
+        ],
+        'total_carbon_consumption': float(totals.sum()),
+        'record_count': int(record_counts.sum())
+    }
+    if split_by_source:
+        response_data['sources'] = {
+            source_uid: series
+            for source_uid, series in zip(source_uids.tolist(), source_totals.tolist())
+        }
+
+    return JsonResponse(response_data)
 
 @require_http_methods(["POST"])
 @csrf_exempt
@@ -11,7 +105,7 @@ def carbon_consumption(request):
     """Get total carbon consumption for a user within a timeframe"""
     try:
         data = json.loads(request.body)
-        email = data.get('email')
+        email = request_email(request, data.get('email'))
         start_date = data.get('start_date')
         end_date = data.get('end_date')
         
@@ -21,33 +115,114 @@ def carbon_consumption(request):
         if not start_date or not end_date:
             return JsonResponse({'error': 'Both start_date and end_date are required'}, status=400)
         
-        # Validate user exists in Supabase by email
-        user_response = supabase_client.get_client().table('user_accounts').select('*').eq('email', email).execute()
-        if not user_response.data:
+        # Validate user exists by email
+        user_id, _ = identity_resolver.resolve_request(request, email)
+        if user_id is None:
             return JsonResponse({'error': 'User not found'}, status=404)
         
-        user = user_response.data[0]
-        user_id = user['id']
+        # Parse and validate dates
+        start_date_obj, end_date_obj, error_response = _parse_timeframe(start_date, end_date)
+        if error_response:
+            return error_response
+        
+        # Aggregate carbon records in the database for the user within the timeframe
+        totals_response = supabase_client.calculate_carbon_consumption(user_id, start_date, end_date)
+        totals = totals_response.data[0] if totals_response.data else {}
+        
+        total_consumption = float(totals.get('total_amount') or 0)
+        record_count = int(totals.get('record_count') or 0)
+        
+        return JsonResponse({
+            'email': email,
+            'timeframe': {
+                'start_date': start_date,
+                'end_date': end_date
+            },
+            'total_carbon_consumption': total_consumption,
+            'record_count': record_count,
+            'message': f'Found {record_count} records with total consumption of {total_consumption} units'
+        })
         
-        # Parse dates
-        try:
-            start_date_obj = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date_obj = datetime.strptime(end_date, '%Y-%m-%d').date()
-        except ValueError:
-            return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=400)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON format'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'Internal server error: {str(e)}'}, status=500)
+
+@require_http_methods(["POST"])
+@csrf_exempt
+def carbon_consumption_series(request):
+    """Get carbon consumption for a user bucketed by day, week or month"""
+    try:
+        data = json.loads(request.body)
+        email = request_email(request, data.get('email'))
+        start_date = data.get('start_date')
+        end_date = data.get('end_date')
+        bucket = data.get('bucket', 'day')
+        split_by_source = bool(data.get('split_by_source', False))
         
-        # Validate date range
-        if start_date_obj > end_date_obj:
-            return JsonResponse({'error': 'Start date cannot be after end date'}, status=400)
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        if not start_date or not end_date:
+            return JsonResponse({'error': 'Both start_date and end_date are required'}, status=400)
+        if bucket not in SERIES_BUCKETS:
+            return JsonResponse({'error': f'Bucket must be one of: {", ".join(SERIES_BUCKETS)}'}, status=400)
         
-        # Query carbon records from Supabase for the user within the timeframe
-        records_response = supabase_client.get_client().table('carbon_records').select('*').eq('user_id', user_id).gte('date', start_date).lte('date', end_date).execute()
+        # Validate user exists by email
+        user_id, _ = identity_resolver.resolve_request(request, email)
+        if user_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
         
-        records = records_response.data or []
+        # Parse and validate dates
+        start_date_obj, end_date_obj, error_response = _parse_timeframe(start_date, end_date)
+        if error_response:
+            return error_response
         
-        # Calculate total carbon consumption
-        total_consumption = sum(float(record.get('amount', 0)) for record in records)
-        record_count = len(records)
+        # Sum the rollups per bucket in the database (one row per bucket, and per source when
+        # split) and zero-fill the buckets without records in NumPy
+        buckets_response = supabase_client.carbon_consumption_series(
+            user_id, start_date_obj.isoformat(), end_date_obj.isoformat(), bucket, split_by_source
+        )
+        return _series_response(email, start_date, end_date, start_date_obj, end_date_obj, bucket, split_by_source, buckets_response.data or [])
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON format'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'Internal server error: {str(e)}'}, status=500)
+
+
+# Async variants, routed instead of the views above when ASYNC_VIEWS is enabled (the default under ASGI)
+
+@async_api_view(["POST"])
+async def carbon_consumption_async(request):
+    """Async variant of carbon_consumption"""
+    try:
+        data = json.loads(request.body)
+        email = request_email(request, data.get('email'))
+        start_date = data.get('start_date')
+        end_date = data.get('end_date')
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        if not start_date or not end_date:
+            return JsonResponse({'error': 'Both start_date and end_date are required'}, status=400)
+        
+        # Validate user exists by email
+        user_id, _ = await identity_resolver.aresolve_request(request, email)
+        if user_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        
+        # Parse and validate dates
+        start_date_obj, end_date_obj, error_response = _parse_timeframe(start_date, end_date)
+        if error_response:
+            return error_response
+        
+        totals_response = await async_supabase_client.calculate_carbon_consumption(user_id, start_date, end_date)
+        totals = totals_response.data[0] if totals_response.data else {}
+        
+        total_consumption = float(totals.get('total_amount') or 0)
+        record_count = int(totals.get('record_count') or 0)
         
         return JsonResponse({
             'email': email,
@@ -63,4 +238,43 @@ def carbon_consumption(request):
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON format'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': f'Internal server error: {str(e)}'}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': f'Internal server error: {str(e)}'}, status=500)
+
+@async_api_view(["POST"])
+async def carbon_consumption_series_async(request):
+    """Async variant of carbon_consumption_series"""
+    try:
+        data = json.loads(request.body)
+        email = request_email(request, data.get('email'))
+        start_date = data.get('start_date')
+        end_date = data.get('end_date')
+        bucket = data.get('bucket', 'day')
+        split_by_source = bool(data.get('split_by_source', False))
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        if not start_date or not end_date:
+            return JsonResponse({'error': 'Both start_date and end_date are required'}, status=400)
+        if bucket not in SERIES_BUCKETS:
+            return JsonResponse({'error': f'Bucket must be one of: {", ".join(SERIES_BUCKETS)}'}, status=400)
+        
+        # Validate user exists by email
+        user_id, _ = await identity_resolver.aresolve_request(request, email)
+        if user_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        
+        # Parse and validate dates
+        start_date_obj, end_date_obj, error_response = _parse_timeframe(start_date, end_date)
+        if error_response:
+            return error_response
+        
+        buckets_response = await async_supabase_client.carbon_consumption_series(
+            user_id, start_date_obj.isoformat(), end_date_obj.isoformat(), bucket, split_by_source
+        )
+        return _series_response(email, start_date, end_date, start_date_obj, end_date_obj, bucket, split_by_source, buckets_response.data or [])
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON format'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'Internal server error: {str(e)}'}, status=500)
@@ -1,20 +1,49 @@
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+import csv
 import json
+import math
 import uuid
-from ..supabase_client import supabase_client
+from datetime import date
+import numpy as np
+from ..supabase_client import supabase_client, async_supabase_client
+from ..identity import identity_resolver, request_email, request_user_id
+from ..emission_factors import SOURCE_COLUMNS, emission_factor_registry
+from ..pagination import CARBON_SOURCE_KEY, CARBON_RECORD_KEY, parse_page_params, page_results, row_key
+from ..read_cache import INVALIDATED_BY, ReadCache
+from .decorators import async_api_view, conditional_catalog
+
+# Public carbon source columns (emission_factor and unit are not exposed)
+SOURCE_LIST_COLUMNS = SOURCE_COLUMNS
+
+# Carbon record columns written by the export endpoint, in CSV column order
+EXPORT_COLUMNS = ('uid', 'source_uid', 'amount', 'footprint', 'date')
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
 
 @require_http_methods(["GET", "POST"])
 @csrf_exempt
+@conditional_catalog('carbon_sources')
 def source_list(request):
     """Handle carbon source list operations"""
     if request.method == 'GET':
+        limit, after, error_response = parse_page_params(request.GET, CARBON_SOURCE_KEY)
+        if error_response:
+            return error_response
         try:
-            # Get carbon sources from Supabase (excluding emission_factor and unit)
-            response = supabase_client.get_client().table('carbon_sources').select('uid, name, description, source_type, created_at, updated_at').execute()
-            sources = response.data or []
-            return JsonResponse({'sources': sources})
+            # Get one page of carbon sources from the cached catalog (excluding emission_factor and unit)
+            rows = emission_factor_registry.source_page(limit + 1, after)
+            sources, next_cursor = page_results(rows, limit, CARBON_SOURCE_KEY)
+            return JsonResponse({'sources': sources, 'next_cursor': next_cursor})
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
@@ -38,7 +67,8 @@ def source_list(request):
                 'description': data.get('description', '')
             }
             
-            response = supabase_client.get_client().table('carbon_sources').insert(source_data).execute()
+            response = supabase_client.create_carbon_source(source_data)
+            emission_factor_registry.invalidate()
             
             if response.data:
                 return JsonResponse({
@@ -55,11 +85,21 @@ def source_list(request):
 
 @require_http_methods(["GET", "PUT", "DELETE"])
 @csrf_exempt
+@conditional_catalog('carbon_sources')
 def source_detail(request, source_id):
     """Handle individual carbon source operations"""
+    if request.method == 'GET':
+        try:
+            source = emission_factor_registry.get_source(_canonical_source_id(source_id))
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+        if source is None:
+            return JsonResponse({'error': 'Carbon source not found'}, status=404)
+        return JsonResponse({'source': source})
+    
     try:
         # Get carbon source from Supabase (excluding emission_factor and unit)
-        response = supabase_client.get_client().table('carbon_sources').select('uid, name, description, source_type, created_at, updated_at').eq('uid', source_id).execute()
+        response = supabase_client.get_carbon_source(source_id, columns=SOURCE_LIST_COLUMNS)
         if not response.data:
             return JsonResponse({'error': 'Carbon source not found'}, status=404)
         
@@ -67,10 +107,7 @@ def source_detail(request, source_id):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
     
-    if request.method == 'GET':
-        return JsonResponse({'source': source})
-    
-    elif request.method == 'PUT':
+    if request.method == 'PUT':
         try:
             data = json.loads(request.body)
             
@@ -85,7 +122,8 @@ def source_detail(request, source_id):
             
             if update_data:
                 # Update carbon source in Supabase
-                response = supabase_client.get_client().table('carbon_sources').update(update_data).eq('uid', source_id).execute()
+                response = supabase_client.update_carbon_source(source_id, update_data)
+                emission_factor_registry.invalidate()
                 
                 if response.data:
                     return JsonResponse({
@@ -105,7 +143,8 @@ def source_detail(request, source_id):
     elif request.method == 'DELETE':
         try:
             # Delete carbon source from Supabase
-            response = supabase_client.get_client().table('carbon_sources').delete().eq('uid', source_id).execute()
+            response = supabase_client.delete_carbon_source(source_id)
+            emission_factor_registry.invalidate()
             return JsonResponse({
                 'message': f'Carbon source {source_id} deleted successfully'
             })
@@ -114,6 +153,7 @@ def source_detail(request, source_id):
 
 @require_http_methods(["GET"])
 @csrf_exempt
+@conditional_catalog(max_age=86400)
 def source_categories(request):
     """Get carbon source categories"""
     categories = [
@@ -123,6 +163,59 @@ def source_categories(request):
     ]
     return JsonResponse({'categories': categories})
 
+def _canonical_source_id(source_id):
+    """Normalize a source UID to the lower-case form the catalog uses, leaving non-UUID ids as they are"""
+    try:
+        return str(uuid.UUID(str(source_id)))
+    except ValueError:
+        return str(source_id)
+
+def _parse_calculation_date(value):
+    """Parse the optional date a footprint is calculated for, defaulting to today; None if invalid"""
+    if not value:
+        return date.today()
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def _footprint_calculation(amount, source, factor, activity_unit, factor_origin, calculation_date):
+    """Describe how a footprint was calculated"""
+    return {
+        'amount': amount,
+        'activity_unit': activity_unit,
+        'emission_factor': factor,
+        # Deprecated: the field's name before factors came from the registry; same value as emission_factor
+        'default_factor': factor,
+        'factor_origin': factor_origin,
+        'date': calculation_date.isoformat(),
+        'source_id': str(source['uid']),
+        'source_name': source['name'],
+        'source_type': source['source_type']
+    }
+
+@require_http_methods(["GET"])
+@csrf_exempt
+@conditional_catalog('emission_factors')
+def emission_factors(request):
+    """List the emission factors in the registry, optionally only those valid on a date"""
+    try:
+        factors = emission_factor_registry.factors()
+        on_date = request.GET.get('date')
+        if on_date:
+            try:
+                on_date = date.fromisoformat(on_date)
+            except ValueError:
+                return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=400)
+            factors = [
+                factor for factor in factors
+                if (factor['valid_from'] is None or factor['valid_from'] <= on_date)
+                and (factor['valid_to'] is None or on_date < factor['valid_to'])
+            ]
+        return JsonResponse({'emission_factors': factors, 'count': len(factors)})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
 @require_http_methods(["POST"])
 @csrf_exempt
 def calculate_footprint(request):
@@ -139,34 +232,22 @@ def calculate_footprint(request):
         if not activity_amount or activity_amount <= 0:
             return JsonResponse({'error': 'Valid activity amount is required'}, status=400)
         
-        # Get carbon source from Supabase to verify it exists
-        source_response = supabase_client.get_client().table('carbon_sources').select('*').eq('uid', source_id).execute()
+        calculation_date = _parse_calculation_date(data.get('date'))
+        if calculation_date is None:
+            return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=400)
         
-        if not source_response.data:
+        # Look up the source and the factor valid on the date in the in-memory registry
+        source = emission_factor_registry.get_source(_canonical_source_id(source_id))
+        if source is None:
             return JsonResponse({'error': 'Carbon source not found'}, status=404)
         
-        source = source_response.data[0]
-        
-        # Simple calculation using a default emission factor based on category
-        category_factors = {
-            'Travel': 2.3,              # kg CO2
-            'Dining & Shopping': 1.5,   # kg CO2
-            'Utility & Bills': 0.8      # kg CO2
-        }
-        
-        default_factor = category_factors.get(source['source_type'], 1.0)
-        carbon_footprint = float(activity_amount) * default_factor
+        factor, activity_unit, factor_origin = emission_factor_registry.resolve(source, calculation_date)
+        carbon_footprint = float(activity_amount) * factor
         
         return JsonResponse({
             'carbon_footprint': carbon_footprint,
             'unit': 'kg CO2',
-            'calculation': {
-                'amount': activity_amount,
-                'default_factor': default_factor,
-                'source_id': source_id,
-                'source_name': source['name'],
-                'source_type': source['source_type']
-            }
+            'calculation': _footprint_calculation(activity_amount, source, factor, activity_unit, factor_origin, calculation_date)
         })
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
@@ -175,13 +256,74 @@ def calculate_footprint(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@require_http_methods(["POST"])
+@csrf_exempt
+def calculate_footprint_batch(request):
+    """Calculate carbon footprints for a list of (source_id, amount) items in one request"""
+    try:
+        data = json.loads(request.body)
+        items = data.get('items')
+        max_items = getattr(settings, 'FOOTPRINT_BATCH_MAX_ITEMS', 1000)
+        
+        # Validate required fields
+        if not isinstance(items, list) or not items:
+            return JsonResponse({'error': 'Items must be a non-empty list'}, status=400)
+        if len(items) > max_items:
+            return JsonResponse({'error': f'At most {max_items} items can be calculated per request'}, status=400)
+        
+        # Validate every item, keeping the index of each item that can be calculated
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[index] = {'index': index, 'error': 'Item must be an object'}
+                continue
+            source_id = item.get('source_id')
+            amount = item.get('amount')
+            calculation_date = _parse_calculation_date(item.get('date'))
+            if not source_id:
+                results[index] = {'index': index, 'error': 'Source ID is required'}
+            elif isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount) or amount <= 0:
+                results[index] = {'index': index, 'error': 'Valid activity amount is required'}
+            elif calculation_date is None:
+                results[index] = {'index': index, 'error': 'Invalid date format. Use YYYY-MM-DD'}
+            else:
+                source = emission_factor_registry.get_source(_canonical_source_id(source_id))
+                if source is None:
+                    results[index] = {'index': index, 'error': 'Carbon source not found'}
+                else:
+                    valid.append((index, source, amount, calculation_date) + emission_factor_registry.resolve(source, calculation_date))
+        
+        # One vectorized multiply for every footprint in the batch
+        amounts = np.array([item[2] for item in valid], dtype=float)
+        factors = np.array([item[4] for item in valid], dtype=float)
+        footprints = amounts * factors
+        
+        for (index, source, amount, calculation_date, factor, activity_unit, factor_origin), footprint in zip(valid, footprints.tolist()):
+            results[index] = {
+                'index': index,
+                'carbon_footprint': footprint,
+                'calculation': _footprint_calculation(amount, source, factor, activity_unit, factor_origin, calculation_date)
+            }
+        
+        return JsonResponse({
+            'results': results,
+            'total_carbon_footprint': float(footprints.sum()),
+            'unit': 'kg CO2',
+            'failed': len(items) - len(valid)
+        })
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
 @require_http_methods(["POST"])
 @csrf_exempt
 def add_source_to_user(request):
     """Add a source to user profile"""
     try:
         data = json.loads(request.body)
-        email = data.get('email')
+        email = request_email(request, data.get('email'))
         source_uid = data.get('source_uid')
         
         # Validate required fields
@@ -190,49 +332,20 @@ def add_source_to_user(request):
         if not source_uid:
             return JsonResponse({'error': 'Source UID is required'}, status=400)
         
-        # Get user account by email
-        user_response = supabase_client.get_client().table('user_accounts').select('*').eq('email', email).execute()
-        if not user_response.data:
-            return JsonResponse({'error': 'User not found'}, status=404)
-        
-        user_id = user_response.data[0]['id']
-        
-        # Check if source exists
-        source_response = supabase_client.get_client().table('carbon_sources').select('*').eq('uid', source_uid).execute()
-        if not source_response.data:
-            return JsonResponse({'error': 'Source not found'}, status=404)
-        
-        # Get or create user profile
-        profile_response = supabase_client.get_client().table('user_profiles').select('*').eq('user_id', user_id).execute()
-        if not profile_response.data:
-            # Create user profile
-            profile_data = {'user_id': user_id}
-            profile_response = supabase_client.get_client().table('user_profiles').insert(profile_data).execute()
-            if not profile_response.data:
-                return JsonResponse({'error': 'Failed to create user profile'}, status=500)
-            profile_id = profile_response.data[0]['id']
-        else:
-            profile_id = profile_response.data[0]['id']
-        
-        # Check if source is already added to user profile
-        existing_response = supabase_client.get_client().table('user_profile_sources').select('*').eq('user_profile_id', profile_id).eq('carbon_source_uid', source_uid).execute()
-        if existing_response.data:
-            return JsonResponse({'error': 'Source already added to user profile'}, status=400)
+        # Resolve the user (by the token's user id when signed in), upsert the profile and
+        # link the source in one database call
+        result = supabase_client.add_source_to_user(email, source_uid, user_id=request_user_id(request)).data or {}
+        status = result.get('status', 500)
+        if status != 201:
+            return JsonResponse({'error': result.get('error', 'Failed to add source to user profile')}, status=status)
         
-        # Add source to user profile
-        profile_source_data = {
-            'user_profile_id': profile_id,
-            'carbon_source_uid': source_uid
-        }
-        result = supabase_client.get_client().table('user_profile_sources').insert(profile_source_data).execute()
+        if request_user_id(request) is None:
+            identity_resolver.remember(email, result['user_id'], result['profile_id'])
         
-        if result.data:
-            return JsonResponse({
-                'message': 'Source added to user profile successfully',
-                'data': result.data[0]
-            }, status=201)
-        else:
-            return JsonResponse({'error': 'Failed to add source to user profile'}, status=500)
+        return JsonResponse({
+            'message': 'Source added to user profile successfully',
+            'data': result['data']
+        }, status=201)
             
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
@@ -244,7 +357,7 @@ def add_source_to_user(request):
 def get_user_records_by_timeframe(request):
     """Get user records by timeframe and source"""
     try:
-        email = request.GET.get('email')
+        email = request_email(request, request.GET.get('email'))
         source_uid = request.GET.get('source_uid')
         start_date = request.GET.get('start_date')
         end_date = request.GET.get('end_date')
@@ -256,29 +369,27 @@ def get_user_records_by_timeframe(request):
             return JsonResponse({'error': 'Source UID is required'}, status=400)
         if not start_date or not end_date:
             return JsonResponse({'error': 'Start date and end date are required'}, status=400)
+        limit, after, error_response = parse_page_params(request.GET, CARBON_RECORD_KEY)
+        if error_response:
+            return error_response
         
-        # Get user account by email
-        user_response = supabase_client.get_client().table('user_accounts').select('*').eq('email', email).execute()
-        if not user_response.data:
+        # Resolve user and profile from the email
+        user_id, profile_id = identity_resolver.resolve_request(request, email, with_profile=True)
+        if user_id is None:
             return JsonResponse({'error': 'User not found'}, status=404)
-        
-        user_id = user_response.data[0]['id']
-        
-        # Get user profile
-        profile_response = supabase_client.get_client().table('user_profiles').select('*').eq('user_id', user_id).execute()
-        if not profile_response.data:
+        if profile_id is None:
             return JsonResponse({'error': 'User profile not found'}, status=404)
         
-        profile_id = profile_response.data[0]['id']
-        
-        # Get carbon records for the user, source, and timeframe
-        records_response = supabase_client.get_client().table('carbon_records').select('*').eq('user_id', user_id).eq('source_uid', source_uid).gte('date', start_date).lte('date', end_date).execute()
-        
-        records = records_response.data or []
+        # Get one page of carbon records for the user, source, and timeframe
+        records_response = supabase_client.list_carbon_records(
+            user_id, start_date, end_date, source_uid=source_uid, limit=limit + 1, after=after
+        )
+        records, next_cursor = page_results(records_response.data, limit, CARBON_RECORD_KEY)
         
         return JsonResponse({
             'records': records,
             'count': len(records),
+            'next_cursor': next_cursor,
             'timeframe': {
                 'start_date': start_date,
                 'end_date': end_date
@@ -288,42 +399,263 @@ def get_user_records_by_timeframe(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-@require_http_methods(["DELETE"])
+class _Echo:
+    """File-like object whose write() returns the value, so csv.writer can format one row at a time"""
+
+    def write(self, value):
+        return value
+
+def _record_pages(user_id, start_date, end_date, source_uid, chunk_size, first_page):
+    """Yield pages of carbon records, fetching the next keyset page only once the previous one is consumed"""
+    rows = first_page
+    while rows:
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        rows = supabase_client.list_carbon_records(
+            user_id, start_date, end_date, source_uid=source_uid,
+            columns=', '.join(EXPORT_COLUMNS), limit=chunk_size, after=row_key(rows[-1], CARBON_RECORD_KEY)
+        ).data
+
+async def _aiter_chunks(chunks):
+    """Async iterator over a sync chunk generator, advancing it (and the page query behind each chunk) in a worker thread.
+
+    Under ASGI Django buffers a sync streaming iterator into a list before sending it, so
+    exports are handed over as an async iterator there to keep memory flat.
+    """
+    done = object()
+    while True:
+        chunk = await sync_to_async(next)(chunks, done)
+        if chunk is done:
+            return
+        yield chunk
+
+def _export_page(rows, export_format):
+    """Serialize one page of records as a chunk of NDJSON or CSV text"""
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        return ''.join(writer.writerow([row.get(column) for column in EXPORT_COLUMNS]) for row in rows)
+    return ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+
+def _export_chunks(pages, export_format):
+    """Serialize record pages as NDJSON or CSV, one chunk of text per page"""
+    if export_format == 'csv':
+        yield csv.writer(_Echo()).writerow(EXPORT_COLUMNS)
+    for rows in pages:
+        yield _export_page(rows, export_format)
+
+def _export_params_error(export_format, start_date, end_date, source_uid):
+    """Return a 400 response for invalid export parameters, or None"""
+    if export_format not in EXPORT_CONTENT_TYPES:
+        return JsonResponse({'error': 'Format must be ndjson or csv'}, status=400)
+    try:
+        for value in (start_date, end_date):
+            if value:
+                date.fromisoformat(value)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=400)
+    if source_uid:
+        try:
+            uuid.UUID(source_uid)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid source UID'}, status=400)
+    return None
+
+def _export_response(chunks, export_format, user_id):
+    """Stream export chunks as an attachment"""
+    response = StreamingHttpResponse(chunks, content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="carbon-records-{user_id}.{export_format}"'
+    return response
+
+@require_http_methods(["GET"])
 @csrf_exempt
-def remove_source_from_user(request):
-    """Remove a source from user profile"""
+def export_user_records(request):
+    """Stream a user's carbon records as NDJSON or CSV, one page at a time"""
+    try:
+        email = request_email(request, request.GET.get('email'))
+        source_uid = request.GET.get('source_uid')
+        start_date = request.GET.get('start_date')
+        end_date = request.GET.get('end_date')
+        export_format = request.GET.get('format', 'ndjson')
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        error_response = _export_params_error(export_format, start_date, end_date, source_uid)
+        if error_response:
+            return error_response
+        
+        user_id, _ = identity_resolver.resolve_request(request, email)
+        if user_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        
+        # Fetch the first page up front so database errors still produce a JSON error response.
+        # A page larger than the backend's row cap would come back short and end the export early.
+        chunk_size = min(getattr(settings, 'EXPORT_CHUNK_SIZE', 1000), getattr(settings, 'POSTGREST_MAX_ROWS', 1000))
+        first_page = supabase_client.list_carbon_records(
+            user_id, start_date, end_date, source_uid=source_uid,
+            columns=', '.join(EXPORT_COLUMNS), limit=chunk_size
+        ).data
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    pages = _record_pages(user_id, start_date, end_date, source_uid, chunk_size, first_page)
+    chunks = _export_chunks(pages, export_format)
+    if isinstance(request, ASGIRequest):
+        chunks = _aiter_chunks(chunks)
+    return _export_response(chunks, export_format, user_id)
+
+def _validate_ingest_record(record, user_id):
+    """Return (row, error) for one submitted carbon record, with row ready for upsert"""
+    if not isinstance(record, dict):
+        return None, 'Record must be an object'
+    
+    try:
+        uid = str(uuid.UUID(str(record['uid']))) if record.get('uid') is not None else str(uuid.uuid4())
+    except ValueError:
+        return None, 'Invalid uid'
+    try:
+        source_uid = str(uuid.UUID(str(record.get('source_uid'))))
+    except ValueError:
+        return None, 'Valid source UID is required'
+    
+    amount = record.get('amount')
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount) or amount < 0:
+        return None, 'Amount must be a non-negative number'
+    try:
+        record_date = date.fromisoformat(record.get('date') or '')
+    except (TypeError, ValueError):
+        return None, 'Invalid date format. Use YYYY-MM-DD'
+    
+    return {
+        'uid': uid,
+        'user_id': user_id,
+        'source_uid': source_uid,
+        'amount': float(amount),
+        'date': record_date.isoformat()
+    }, None
+
+def _validate_ingest_records(records, user_id):
+    """Validate every record in one pass, returning ((request index, row) pairs, per-row errors)"""
+    rows, errors, seen_uids = [], [], set()
+    for index, record in enumerate(records):
+        row, error = _validate_ingest_record(record, user_id)
+        if row and row['uid'] in seen_uids:
+            row, error = None, 'Duplicate uid in request'
+        if error:
+            errors.append({'index': index, 'error': error})
+        else:
+            seen_uids.add(row['uid'])
+            rows.append((index, row))
+    return rows, errors
+
+def _price_ingest_rows(rows, source_rows, errors):
+    """Drop the rows whose source does not exist (adding their errors) and store each remaining
+    record's footprint with the factor valid on its date"""
+    sources = {str(source['uid']): source for source in source_rows}
+    errors.extend({'index': index, 'error': 'Source not found'} for index, row in rows if row['source_uid'] not in sources)
+    rows = [(index, row) for index, row in rows if row['source_uid'] in sources]
+    
+    factors = np.array([
+        emission_factor_registry.resolve(sources[row['source_uid']], date.fromisoformat(row['date']))[0]
+        for _, row in rows
+    ], dtype=float)
+    footprints = np.array([row['amount'] for _, row in rows], dtype=float) * factors
+    for (_, row), factor, footprint in zip(rows, factors.tolist(), footprints.tolist()):
+        row['emission_factor'] = factor
+        row['footprint'] = footprint
+    return rows
+
+def _ingest_chunks(rows):
+    """Split rows into upsert chunks, which never exceed the backend's row cap, like the export pages"""
+    chunk_size = min(getattr(settings, 'INGEST_CHUNK_SIZE', 1000), getattr(settings, 'POSTGREST_MAX_ROWS', 1000))
+    return [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+
+def _ingest_response(ingested, errors):
+    """Report the ingested count and per-row errors: 201 if all rows went in, 207 if some did, 400 if none"""
+    errors.sort(key=lambda error: error['index'])
+    if not errors:
+        status = 201
+    elif ingested:
+        status = 207
+    else:
+        status = 400
+    
+    return JsonResponse({
+        'ingested': ingested,
+        'failed': len(errors),
+        'errors': errors
+    }, status=status)
+
+@require_http_methods(["POST"])
+@csrf_exempt
+def ingest_user_records(request):
+    """Validate and upsert a batch of carbon records for a user"""
     try:
         data = json.loads(request.body)
-        email = data.get('email')
-        source_uid = data.get('source_uid')
+        email = request_email(request, data.get('email'))
+        records = data.get('records')
+        max_records = getattr(settings, 'INGEST_MAX_RECORDS', 10000)
         
         # Validate required fields
         if not email:
             return JsonResponse({'error': 'Email is required'}, status=400)
-        if not source_uid:
-            return JsonResponse({'error': 'Source UID is required'}, status=400)
+        if not isinstance(records, list) or not records:
+            return JsonResponse({'error': 'Records must be a non-empty list'}, status=400)
+        if len(records) > max_records:
+            return JsonResponse({'error': f'At most {max_records} records can be ingested per request'}, status=400)
         
-        # Get user account by email
-        user_response = supabase_client.get_client().table('user_accounts').select('*').eq('email', email).execute()
-        if not user_response.data:
+        user_id, _ = identity_resolver.resolve_request(request, email)
+        if user_id is None:
             return JsonResponse({'error': 'User not found'}, status=404)
         
-        user_id = user_response.data[0]['id']
+        rows, errors = _validate_ingest_records(records, user_id)
         
-        # Get user profile
-        profile_response = supabase_client.get_client().table('user_profiles').select('*').eq('user_id', user_id).execute()
-        if not profile_response.data:
-            return JsonResponse({'error': 'User profile not found'}, status=404)
+        # Resolve every referenced source with a single query
+        if rows:
+            source_uids = {row['source_uid'] for _, row in rows}
+            sources_response = supabase_client.get_carbon_sources_by_uid(source_uids, columns='uid, source_type')
+            rows = _price_ingest_rows(rows, sources_response.data or [], errors)
         
-        profile_id = profile_response.data[0]['id']
+        # Upsert in chunks; a failed chunk is reported per row and does not stop the others
+        ingested = 0
+        for chunk in _ingest_chunks(rows):
+            try:
+                # Records are only updated when they already belong to this user
+                rejected = set(supabase_client.upsert_carbon_records([row for _, row in chunk]).data or [])
+            except Exception as e:
+                errors.extend({'index': index, 'error': str(e)} for index, _ in chunk)
+                continue
+            errors.extend({'index': index, 'error': 'Record uid already exists'} for index, row in chunk if row['uid'] in rejected)
+            ingested += len(chunk) - len(rejected)
         
-        # Check if source exists in user profile
-        existing_response = supabase_client.get_client().table('user_profile_sources').select('*').eq('user_profile_id', profile_id).eq('carbon_source_uid', source_uid).execute()
-        if not existing_response.data:
-            return JsonResponse({'error': 'Source not found in user profile'}, status=404)
+        return _ingest_response(ingested, errors)
         
-        # Remove source from user profile
-        result = supabase_client.get_client().table('user_profile_sources').delete().eq('user_profile_id', profile_id).eq('carbon_source_uid', source_uid).execute()
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@require_http_methods(["DELETE"])
+@csrf_exempt
+def remove_source_from_user(request):
+    """Remove a source from user profile"""
+    try:
+        data = json.loads(request.body)
+        email = request_email(request, data.get('email'))
+        source_uid = data.get('source_uid')
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        if not source_uid:
+            return JsonResponse({'error': 'Source UID is required'}, status=400)
+        
+        # Resolve the user and profile and unlink the source in one database call
+        result = supabase_client.remove_source_from_user(email, source_uid, user_id=request_user_id(request)).data or {}
+        status = result.get('status', 500)
+        if status != 200:
+            return JsonResponse({'error': result.get('error', 'Failed to remove source from user profile')}, status=status)
         
         return JsonResponse({
             'message': 'Source removed from user profile successfully'
@@ -339,28 +671,21 @@ def remove_source_from_user(request):
 def get_user_sources(request):
     """Get all sources in user's profile"""
     try:
-        email = request.GET.get('email')
+        email = request_email(request, request.GET.get('email'))
         
         # Validate required fields
         if not email:
             return JsonResponse({'error': 'Email is required'}, status=400)
         
-        # Get user account by email
-        user_response = supabase_client.get_client().table('user_accounts').select('*').eq('email', email).execute()
-        if not user_response.data:
+        # Resolve user and profile from the email
+        user_id, profile_id = identity_resolver.resolve_request(request, email, with_profile=True)
+        if user_id is None:
             return JsonResponse({'error': 'User not found'}, status=404)
-        
-        user_id = user_response.data[0]['id']
-        
-        # Get user profile
-        profile_response = supabase_client.get_client().table('user_profiles').select('*').eq('user_id', user_id).execute()
-        if not profile_response.data:
+        if profile_id is None:
             return JsonResponse({'error': 'User profile not found'}, status=404)
         
-        profile_id = profile_response.data[0]['id']
-        
         # Get user's sources via join
-        sources_response = supabase_client.get_client().table('user_profile_sources').select('carbon_source_uid, carbon_sources(*)').eq('user_profile_id', profile_id).execute()
+        sources_response = supabase_client.list_user_profile_sources(profile_id)
         
         sources = []
         if sources_response.data:
@@ -374,4 +699,301 @@ def get_user_sources(request):
         })
         
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+# Async variants, routed instead of the views above when ASYNC_VIEWS is enabled (the default under ASGI)
+
+def _invalidate_cached_reads(write):
+    """Drop the cached reads made stale by a write through async_supabase_client, which bypasses the read cache"""
+    if isinstance(supabase_client, ReadCache):
+        supabase_client.invalidate(*INVALIDATED_BY[write])
+
+@async_api_view(["GET", "POST"])
+@conditional_catalog('carbon_sources')
+async def source_list_async(request):
+    """Async variant of source_list"""
+    if request.method == 'GET':
+        limit, after, error_response = parse_page_params(request.GET, CARBON_SOURCE_KEY)
+        if error_response:
+            return error_response
+        try:
+            # Same cached catalog as source_list; a miss loads it in a worker thread
+            rows = await sync_to_async(emission_factor_registry.source_page)(limit + 1, after)
+            sources, next_cursor = page_results(rows, limit, CARBON_SOURCE_KEY)
+            return JsonResponse({'sources': sources, 'next_cursor': next_cursor})
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+    
+    elif request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            
+            # Validate required fields
+            required_fields = ['name', 'source_type']
+            for field in required_fields:
+                if field not in data or data[field] is None:
+                    return JsonResponse({
+                        'error': f'{field.replace("_", " ").capitalize()} is required'
+                    }, status=400)
+            
+            source_data = {
+                'uid': str(uuid.uuid4()),
+                'name': data['name'],
+                'source_type': data['source_type'],
+                'description': data.get('description', '')
+            }
+            
+            response = await async_supabase_client.create_carbon_source(source_data)
+            _invalidate_cached_reads('create_carbon_source')
+            emission_factor_registry.invalidate()
+            
+            if response.data:
+                return JsonResponse({
+                    'message': 'Carbon source created successfully',
+                    'source': response.data[0]
+                }, status=201)
+            else:
+                return JsonResponse({'error': 'Failed to create carbon source'}, status=500)
+                
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+@async_api_view(["POST"])
+async def add_source_to_user_async(request):
+    """Async variant of add_source_to_user"""
+    try:
+        data = json.loads(request.body)
+        email = request_email(request, data.get('email'))
+        source_uid = data.get('source_uid')
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        if not source_uid:
+            return JsonResponse({'error': 'Source UID is required'}, status=400)
+        
+        response = await async_supabase_client.add_source_to_user(email, source_uid, user_id=request_user_id(request))
+        _invalidate_cached_reads('add_source_to_user')
+        result = response.data or {}
+        status = result.get('status', 500)
+        if status != 201:
+            return JsonResponse({'error': result.get('error', 'Failed to add source to user profile')}, status=status)
+        
+        if request_user_id(request) is None:
+            identity_resolver.remember(email, result['user_id'], result['profile_id'])
+        
+        return JsonResponse({
+            'message': 'Source added to user profile successfully',
+            'data': result['data']
+        }, status=201)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@async_api_view(["DELETE"])
+async def remove_source_from_user_async(request):
+    """Async variant of remove_source_from_user"""
+    try:
+        data = json.loads(request.body)
+        email = request_email(request, data.get('email'))
+        source_uid = data.get('source_uid')
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        if not source_uid:
+            return JsonResponse({'error': 'Source UID is required'}, status=400)
+        
+        response = await async_supabase_client.remove_source_from_user(email, source_uid, user_id=request_user_id(request))
+        _invalidate_cached_reads('remove_source_from_user')
+        result = response.data or {}
+        status = result.get('status', 500)
+        if status != 200:
+            return JsonResponse({'error': result.get('error', 'Failed to remove source from user profile')}, status=status)
+        
+        return JsonResponse({
+            'message': 'Source removed from user profile successfully'
+        })
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@async_api_view(["GET"])
+async def get_user_sources_async(request):
+    """Async variant of get_user_sources"""
+    try:
+        email = request_email(request, request.GET.get('email'))
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        
+        # Resolve user and profile from the email
+        user_id, profile_id = await identity_resolver.aresolve_request(request, email, with_profile=True)
+        if user_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        if profile_id is None:
+            return JsonResponse({'error': 'User profile not found'}, status=404)
+        
+        # Through the shared read cache, so concurrent requests for a profile share one query
+        sources_response = await sync_to_async(supabase_client.list_user_profile_sources)(profile_id)
+        sources = [item['carbon_sources'] for item in sources_response.data or [] if item.get('carbon_sources')]
+        
+        return JsonResponse({
+            'sources': sources,
+            'count': len(sources)
+        })
+        
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@async_api_view(["GET"])
+async def get_user_records_by_timeframe_async(request):
+    """Async variant of get_user_records_by_timeframe"""
+    try:
+        email = request_email(request, request.GET.get('email'))
+        source_uid = request.GET.get('source_uid')
+        start_date = request.GET.get('start_date')
+        end_date = request.GET.get('end_date')
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        if not source_uid:
+            return JsonResponse({'error': 'Source UID is required'}, status=400)
+        if not start_date or not end_date:
+            return JsonResponse({'error': 'Start date and end date are required'}, status=400)
+        limit, after, error_response = parse_page_params(request.GET, CARBON_RECORD_KEY)
+        if error_response:
+            return error_response
+        
+        # Resolve user and profile from the email
+        user_id, profile_id = await identity_resolver.aresolve_request(request, email, with_profile=True)
+        if user_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        if profile_id is None:
+            return JsonResponse({'error': 'User profile not found'}, status=404)
+        
+        records_response = await async_supabase_client.list_carbon_records(
+            user_id, start_date, end_date, source_uid=source_uid, limit=limit + 1, after=after
+        )
+        records, next_cursor = page_results(records_response.data, limit, CARBON_RECORD_KEY)
+        
+        return JsonResponse({
+            'records': records,
+            'count': len(records),
+            'next_cursor': next_cursor,
+            'timeframe': {
+                'start_date': start_date,
+                'end_date': end_date
+            }
+        })
+        
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+async def _arecord_chunks(user_id, start_date, end_date, source_uid, chunk_size, first_page, export_format):
+    """Async counterpart of _export_chunks(_record_pages(...)), fetching each next page on the event loop"""
+    if export_format == 'csv':
+        yield csv.writer(_Echo()).writerow(EXPORT_COLUMNS)
+    rows = first_page
+    while rows:
+        yield _export_page(rows, export_format)
+        if len(rows) < chunk_size:
+            return
+        response = await async_supabase_client.list_carbon_records(
+            user_id, start_date, end_date, source_uid=source_uid,
+            columns=', '.join(EXPORT_COLUMNS), limit=chunk_size, after=row_key(rows[-1], CARBON_RECORD_KEY)
+        )
+        rows = response.data
+
+@async_api_view(["GET"])
+async def export_user_records_async(request):
+    """Async variant of export_user_records"""
+    try:
+        email = request_email(request, request.GET.get('email'))
+        source_uid = request.GET.get('source_uid')
+        start_date = request.GET.get('start_date')
+        end_date = request.GET.get('end_date')
+        export_format = request.GET.get('format', 'ndjson')
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        error_response = _export_params_error(export_format, start_date, end_date, source_uid)
+        if error_response:
+            return error_response
+        
+        user_id, _ = await identity_resolver.aresolve_request(request, email)
+        if user_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        
+        # Fetch the first page up front so database errors still produce a JSON error response
+        chunk_size = min(getattr(settings, 'EXPORT_CHUNK_SIZE', 1000), getattr(settings, 'POSTGREST_MAX_ROWS', 1000))
+        first_page = (await async_supabase_client.list_carbon_records(
+            user_id, start_date, end_date, source_uid=source_uid,
+            columns=', '.join(EXPORT_COLUMNS), limit=chunk_size
+        )).data
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    chunks = _arecord_chunks(user_id, start_date, end_date, source_uid, chunk_size, first_page, export_format)
+    return _export_response(chunks, export_format, user_id)
+
+@async_api_view(["POST"])
+async def ingest_user_records_async(request):
+    """Async variant of ingest_user_records"""
+    try:
+        data = json.loads(request.body)
+        email = request_email(request, data.get('email'))
+        records = data.get('records')
+        max_records = getattr(settings, 'INGEST_MAX_RECORDS', 10000)
+        
+        # Validate required fields
+        if not email:
+            return JsonResponse({'error': 'Email is required'}, status=400)
+        if not isinstance(records, list) or not records:
+            return JsonResponse({'error': 'Records must be a non-empty list'}, status=400)
+        if len(records) > max_records:
+            return JsonResponse({'error': f'At most {max_records} records can be ingested per request'}, status=400)
+        
+        user_id, _ = await identity_resolver.aresolve_request(request, email)
+        if user_id is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        
+        rows, errors = _validate_ingest_records(records, user_id)
+        
+        # Resolve every referenced source with a single query; the registry may reload its
+        # catalog while pricing, so that part runs in a worker thread
+        if rows:
+            source_uids = {row['source_uid'] for _, row in rows}
+            sources_response = await async_supabase_client.get_carbon_sources_by_uid(source_uids, columns='uid, source_type')
+            rows = await sync_to_async(_price_ingest_rows)(rows, sources_response.data or [], errors)
+        
+        # Upsert in chunks; a failed chunk is reported per row and does not stop the others
+        ingested = 0
+        for chunk in _ingest_chunks(rows):
+            try:
+                # Records are only updated when they already belong to this user
+                rejected = set((await async_supabase_client.upsert_carbon_records([row for _, row in chunk])).data or [])
+            except Exception as e:
+                errors.extend({'index': index, 'error': str(e)} for index, _ in chunk)
+                continue
+            errors.extend({'index': index, 'error': 'Record uid already exists'} for index, row in chunk if row['uid'] in rejected)
+            ingested += len(chunk) - len(rejected)
+        
+        return _ingest_response(ingested, errors)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
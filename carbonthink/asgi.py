@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'carbonthink.settings')
+# Serve the async view variants, which fan out independent Supabase queries concurrently
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -46,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.BackendTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +57,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.SessionTokenMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'carbonthink.urls'
@@ -128,3 +134,134 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Identity resolver cache (email -> user_id -> profile_id)
+IDENTITY_CACHE_MAX_ENTRIES = int(os.getenv('IDENTITY_CACHE_MAX_ENTRIES', '10000'))
+IDENTITY_CACHE_TTL = float(os.getenv('IDENTITY_CACHE_TTL', '300'))
+
+# Route requests to the async view variants (enabled by default under ASGI, see asgi.py).
+# Views without one always run sync: source_detail, source_categories, emission_factors,
+# calculate_footprint and calculate_footprint_batch only read the in-memory emission-factor
+# registry (source writes are rare admin calls), so an async variant would just wrap CPU work
+# in a thread hop; user_logout only writes the token revocation to the Django cache; and the
+# index, health and metrics endpoints never touch the storage backend.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() == 'true'
+
+# Storage backend used by api.supabase_client.supabase_client:
+# 'supabase' (PostgREST over HTTP), 'postgres' (pooled direct connection to SUPABASE_DB_URL),
+# 'django' (the api models in the Django DATABASES above) or 'memory' (an in-process stand-in
+# for Supabase, used by the benchmark command; data is lost on restart)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'supabase')
+# The test suite (manage.py test) always runs on the in-memory backend, never on a real project
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+if TESTING:
+    STORAGE_BACKEND = 'memory'
+# Simulated network latency added to every round trip of the 'memory' backend
+MEMORY_BACKEND_LATENCY_MS = float(os.getenv('MEMORY_BACKEND_LATENCY_MS', '0'))
+SUPABASE_DB_URL = os.getenv('SUPABASE_DB_URL')
+POSTGRES_POOL_MIN_CONNECTIONS = int(os.getenv('POSTGRES_POOL_MIN_CONNECTIONS', '1'))
+POSTGRES_POOL_MAX_CONNECTIONS = int(os.getenv('POSTGRES_POOL_MAX_CONNECTIONS', '10'))
+
+# Most rows PostgREST returns for one request (its db-max-rows, 1000 on Supabase); larger
+# limits are silently cut down to it
+POSTGREST_MAX_ROWS = int(os.getenv('POSTGREST_MAX_ROWS', '1000'))
+
+# Keyset pagination for list endpoints (?limit=&cursor=). Lists fetch limit + 1 rows to tell
+# whether there is a next page, so the max limit is kept below POSTGREST_MAX_ROWS.
+PAGINATION_DEFAULT_LIMIT = int(os.getenv('PAGINATION_DEFAULT_LIMIT', '100'))
+PAGINATION_MAX_LIMIT = int(os.getenv('PAGINATION_MAX_LIMIT', '999'))
+
+# Rows fetched per page when streaming carbon record exports (keep at or below the PostgREST max rows)
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+
+# Bulk carbon record ingestion: records accepted per request and rows per upsert statement
+INGEST_MAX_RECORDS = int(os.getenv('INGEST_MAX_RECORDS', '10000'))
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', '1000'))
+DATA_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv('DATA_UPLOAD_MAX_MEMORY_SIZE', str(10 * 1024 * 1024)))
+
+# Items accepted per batch footprint calculation request
+FOOTPRINT_BATCH_MAX_ITEMS = int(os.getenv('FOOTPRINT_BATCH_MAX_ITEMS', '1000'))
+
+# Seconds between emission-factor registry version checks (catalog changes are picked up within this delay)
+EMISSION_FACTOR_CHECK_INTERVAL = float(os.getenv('EMISSION_FACTOR_CHECK_INTERVAL', '30'))
+
+# Cache-Control max-age (seconds) for catalog endpoints served with ETags
+CATALOG_CACHE_MAX_AGE = int(os.getenv('CATALOG_CACHE_MAX_AGE', '60'))
+
+# Shared read cache for catalog reads (api.read_cache): concurrent identical reads share one
+# query; results are fresh for 'ttl' seconds, then served stale for up to 'max_stale' more
+# seconds while a single background fetch refreshes them
+READ_CACHE_ENABLED = os.getenv('READ_CACHE_ENABLED', 'True').lower() == 'true'
+READ_CACHE_MAX_ENTRIES = int(os.getenv('READ_CACHE_MAX_ENTRIES', '10000'))
+READ_CACHE_POLICIES = {
+    'carbon_sources': {
+        'ttl': float(os.getenv('READ_CACHE_CARBON_SOURCES_TTL', '30')),
+        'max_stale': float(os.getenv('READ_CACHE_CARBON_SOURCES_MAX_STALE', '300')),
+    },
+    'user_profile_sources': {
+        'ttl': float(os.getenv('READ_CACHE_USER_PROFILE_SOURCES_TTL', '5')),
+        'max_stale': float(os.getenv('READ_CACHE_USER_PROFILE_SOURCES_MAX_STALE', '30')),
+    },
+}
+
+# Memory-mapped file through which worker processes on a host share the carbon source and
+# emission-factor catalogs as JSON, so one worker's refresh serves them all (each worker still
+# decodes its own copy). The file must be owned by the API user with mode 0600; anything else
+# is refused. Empty keeps a separate catalog per process.
+CATALOG_SHARED_CACHE_PATH = os.getenv('CATALOG_SHARED_CACHE_PATH', '')
+
+# Signed session tokens issued by user_login (Authorization: Bearer <token>)
+SESSION_TOKEN_MAX_AGE = int(os.getenv('SESSION_TOKEN_MAX_AGE', '86400'))
+
+# Holds the session token revocation set. The default in-process cache is fine for a single
+# worker; point CACHE_BACKEND/CACHE_LOCATION at a shared cache (e.g. Redis) so a logout is
+# seen by every worker.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Per-request backend call instrumentation: a Server-Timing header and one JSON log line per
+# request on the 'api.requests' logger. The N+1 warning fires when a request reads one table
+# BACKEND_N_PLUS_ONE_THRESHOLD or more times.
+BACKEND_N_PLUS_ONE_WARNINGS = os.getenv('BACKEND_N_PLUS_ONE_WARNINGS', str(DEBUG)).lower() == 'true'
+BACKEND_N_PLUS_ONE_THRESHOLD = int(os.getenv('BACKEND_N_PLUS_ONE_THRESHOLD', '3'))
+
+# Prometheus metrics at /api/metrics/: request counts and latency per view, backend call
+# counts and latency per table. With several worker processes, set METRICS_DIR to a
+# directory they all can write; each writes its totals there every METRICS_FLUSH_INTERVAL
+# seconds and the endpoint reports the sum. Empty reports the answering process only.
+# The endpoint only answers clients in METRICS_ALLOWED_IPS (comma-separated addresses or
+# CIDR networks, matched against REMOTE_ADDR, so behind a proxy list the proxy's address).
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+# Opt-in request profiling (api.middleware.ProfilingMiddleware): requests with a valid
+# X-Profile-Request token, valid for PROFILING_TOKEN_MAX_AGE seconds, and a
+# PROFILING_SAMPLE_RATE fraction of all requests are profiled with cProfile. The newest
+# PROFILING_MAX_FILES profiles are kept in PROFILING_DIR.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False').lower() == 'true'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_TOKEN_MAX_AGE = int(os.getenv('PROFILING_TOKEN_MAX_AGE', '3600'))
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'carbonthink-profiles'))
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', '200'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_LOG_LEVEL', 'WARNING' if TESTING else 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,25 @@
+-- Server-side aggregate for carbon consumption totals.
+-- Returns a single row so callers never have to pull raw carbon_records
+-- over PostgREST just to sum them.
+
+create index if not exists carbon_records_user_id_date_idx
+    on carbon_records (user_id, date);
+
+create or replace function carbon_consumption_totals(
+    p_user_id bigint,
+    p_start_date date default null,
+    p_end_date date default null
+)
+returns table (total_amount double precision, record_count bigint)
+language sql
+stable
+as $$
+    select coalesce(sum(amount), 0)::double precision as total_amount,
+           count(*) as record_count
+    from carbon_records
+    where user_id = p_user_id
+      and (p_start_date is null or date >= p_start_date)
+      and (p_end_date is null or date <= p_end_date);
+$$;
+
+grant execute on function carbon_consumption_totals(bigint, date, date) to anon, authenticated;
@@ -0,0 +1,333 @@
+-- Pre-aggregated carbon_records rollups.
+-- Daily rows are keyed by (user_id, source_uid, day) and monthly rows by
+-- (user_id, source_uid, month). Statement-level triggers on carbon_records
+-- apply deltas as records are written, and reconcile_carbon_rollups()
+-- backfills or repairs a scope from the raw rows.
+
+create table if not exists carbon_record_daily_rollups (
+    user_id bigint not null,
+    source_uid text not null,
+    day date not null,
+    total_amount double precision not null default 0,
+    record_count bigint not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (user_id, source_uid, day)
+);
+
+create index if not exists carbon_record_daily_rollups_user_day_idx
+    on carbon_record_daily_rollups (user_id, day);
+
+create table if not exists carbon_record_monthly_rollups (
+    user_id bigint not null,
+    source_uid text not null,
+    month date not null,
+    total_amount double precision not null default 0,
+    record_count bigint not null default 0,
+    updated_at timestamptz not null default now(),
+    primary key (user_id, source_uid, month)
+);
+
+create index if not exists carbon_record_monthly_rollups_user_month_idx
+    on carbon_record_monthly_rollups (user_id, month);
+
+-- Apply signed deltas (one row per user/source/day) to both rollup levels
+create or replace function apply_carbon_rollup_deltas(p_deltas jsonb)
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    with deltas as (
+        select user_id, source_uid, day, sum(total_amount) as total_amount, sum(record_count) as record_count
+        from jsonb_to_recordset(p_deltas)
+            as d(user_id bigint, source_uid text, day date, total_amount double precision, record_count bigint)
+        group by user_id, source_uid, day
+    )
+    insert into carbon_record_daily_rollups as r (user_id, source_uid, day, total_amount, record_count)
+    select user_id, source_uid, day, total_amount, record_count from deltas
+    on conflict (user_id, source_uid, day) do update
+        set total_amount = r.total_amount + excluded.total_amount,
+            record_count = r.record_count + excluded.record_count,
+            updated_at = now();
+
+    with deltas as (
+        select user_id, source_uid, date_trunc('month', day)::date as month,
+               sum(total_amount) as total_amount, sum(record_count) as record_count
+        from jsonb_to_recordset(p_deltas)
+            as d(user_id bigint, source_uid text, day date, total_amount double precision, record_count bigint)
+        group by 1, 2, 3
+    )
+    insert into carbon_record_monthly_rollups as r (user_id, source_uid, month, total_amount, record_count)
+    select user_id, source_uid, month, total_amount, record_count from deltas
+    on conflict (user_id, source_uid, month) do update
+        set total_amount = r.total_amount + excluded.total_amount,
+            record_count = r.record_count + excluded.record_count,
+            updated_at = now();
+
+    delete from carbon_record_daily_rollups r
+    using jsonb_to_recordset(p_deltas) as d(user_id bigint, source_uid text, day date)
+    where r.user_id = d.user_id
+      and r.source_uid = d.source_uid
+      and r.day = d.day
+      and r.record_count <= 0;
+
+    delete from carbon_record_monthly_rollups r
+    using jsonb_to_recordset(p_deltas) as d(user_id bigint, source_uid text, day date)
+    where r.user_id = d.user_id
+      and r.source_uid = d.source_uid
+      and r.month = date_trunc('month', d.day)::date
+      and r.record_count <= 0;
+end;
+$$;
+
+create or replace function carbon_records_rollup_insert()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    perform apply_carbon_rollup_deltas(coalesce((
+        select jsonb_agg(jsonb_build_object(
+            'user_id', user_id, 'source_uid', source_uid, 'day', day,
+            'total_amount', total_amount, 'record_count', record_count))
+        from (
+            select user_id, source_uid::text as source_uid, date as day,
+                   sum(amount) as total_amount, count(*) as record_count
+            from inserted_rows
+            group by 1, 2, 3
+        ) grouped
+    ), '[]'::jsonb));
+    return null;
+end;
+$$;
+
+create or replace function carbon_records_rollup_delete()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    perform apply_carbon_rollup_deltas(coalesce((
+        select jsonb_agg(jsonb_build_object(
+            'user_id', user_id, 'source_uid', source_uid, 'day', day,
+            'total_amount', -total_amount, 'record_count', -record_count))
+        from (
+            select user_id, source_uid::text as source_uid, date as day,
+                   sum(amount) as total_amount, count(*) as record_count
+            from deleted_rows
+            group by 1, 2, 3
+        ) grouped
+    ), '[]'::jsonb));
+    return null;
+end;
+$$;
+
+create or replace function carbon_records_rollup_update()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    perform apply_carbon_rollup_deltas(coalesce((
+        select jsonb_agg(jsonb_build_object(
+            'user_id', user_id, 'source_uid', source_uid, 'day', day,
+            'total_amount', total_amount, 'record_count', record_count))
+        from (
+            select user_id, source_uid, day, sum(total_amount) as total_amount, sum(record_count) as record_count
+            from (
+                select user_id, source_uid::text as source_uid, date as day, amount as total_amount, 1 as record_count
+                from inserted_rows
+                union all
+                select user_id, source_uid::text, date, -amount, -1
+                from deleted_rows
+            ) changes
+            group by 1, 2, 3
+            having sum(total_amount) <> 0 or sum(record_count) <> 0
+        ) grouped
+    ), '[]'::jsonb));
+    return null;
+end;
+$$;
+
+drop trigger if exists carbon_records_rollup_insert on carbon_records;
+create trigger carbon_records_rollup_insert
+    after insert on carbon_records
+    referencing new table as inserted_rows
+    for each statement execute function carbon_records_rollup_insert();
+
+drop trigger if exists carbon_records_rollup_delete on carbon_records;
+create trigger carbon_records_rollup_delete
+    after delete on carbon_records
+    referencing old table as deleted_rows
+    for each statement execute function carbon_records_rollup_delete();
+
+drop trigger if exists carbon_records_rollup_update on carbon_records;
+create trigger carbon_records_rollup_update
+    after update on carbon_records
+    referencing old table as deleted_rows new table as inserted_rows
+    for each statement execute function carbon_records_rollup_update();
+
+-- Rebuild the rollups for a scope from raw carbon_records, touching only rows that drifted.
+-- With no arguments this backfills every user and date.
+create or replace function reconcile_carbon_rollups(
+    p_user_id bigint default null,
+    p_start_date date default null,
+    p_end_date date default null
+)
+returns table (daily_rows_fixed bigint, monthly_rows_fixed bigint)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_daily bigint;
+    v_monthly bigint;
+    v_month_start date := date_trunc('month', p_start_date)::date;
+    v_month_end date := date_trunc('month', p_end_date)::date;
+begin
+    with fresh as (
+        select user_id, source_uid::text as source_uid, date as day,
+               sum(amount) as total_amount, count(*) as record_count
+        from carbon_records
+        where (p_user_id is null or user_id = p_user_id)
+          and (p_start_date is null or date >= p_start_date)
+          and (p_end_date is null or date <= p_end_date)
+        group by 1, 2, 3
+    ),
+    stored as (
+        select user_id, source_uid, day, total_amount, record_count
+        from carbon_record_daily_rollups
+        where (p_user_id is null or user_id = p_user_id)
+          and (p_start_date is null or day >= p_start_date)
+          and (p_end_date is null or day <= p_end_date)
+    ),
+    drift as (
+        select user_id, source_uid, day,
+               coalesce(f.total_amount, 0) as total_amount,
+               coalesce(f.record_count, 0) as record_count
+        from fresh f
+        full join stored s using (user_id, source_uid, day)
+        where f.record_count is distinct from s.record_count
+           or abs(coalesce(f.total_amount, 0) - coalesce(s.total_amount, 0)) > 1e-6
+    ),
+    upserted as (
+        insert into carbon_record_daily_rollups as r (user_id, source_uid, day, total_amount, record_count)
+        select user_id, source_uid, day, total_amount, record_count from drift where record_count > 0
+        on conflict (user_id, source_uid, day) do update
+            set total_amount = excluded.total_amount,
+                record_count = excluded.record_count,
+                updated_at = now()
+        returning 1
+    ),
+    removed as (
+        delete from carbon_record_daily_rollups r
+        using drift
+        where drift.record_count = 0
+          and r.user_id = drift.user_id
+          and r.source_uid = drift.source_uid
+          and r.day = drift.day
+        returning 1
+    )
+    select (select count(*) from upserted) + (select count(*) from removed) into v_daily;
+
+    -- Monthly rows are recomputed from the (now correct) daily rows of every touched month
+    with fresh as (
+        select user_id, source_uid, date_trunc('month', day)::date as month,
+               sum(total_amount) as total_amount, sum(record_count) as record_count
+        from carbon_record_daily_rollups
+        where (p_user_id is null or user_id = p_user_id)
+          and (v_month_start is null or day >= v_month_start)
+          and (v_month_end is null or day < (v_month_end + interval '1 month')::date)
+        group by 1, 2, 3
+    ),
+    stored as (
+        select user_id, source_uid, month, total_amount, record_count
+        from carbon_record_monthly_rollups
+        where (p_user_id is null or user_id = p_user_id)
+          and (v_month_start is null or month >= v_month_start)
+          and (v_month_end is null or month <= v_month_end)
+    ),
+    drift as (
+        select user_id, source_uid, month,
+               coalesce(f.total_amount, 0) as total_amount,
+               coalesce(f.record_count, 0) as record_count
+        from fresh f
+        full join stored s using (user_id, source_uid, month)
+        where f.record_count is distinct from s.record_count
+           or abs(coalesce(f.total_amount, 0) - coalesce(s.total_amount, 0)) > 1e-6
+    ),
+    upserted as (
+        insert into carbon_record_monthly_rollups as r (user_id, source_uid, month, total_amount, record_count)
+        select user_id, source_uid, month, total_amount, record_count from drift where record_count > 0
+        on conflict (user_id, source_uid, month) do update
+            set total_amount = excluded.total_amount,
+                record_count = excluded.record_count,
+                updated_at = now()
+        returning 1
+    ),
+    removed as (
+        delete from carbon_record_monthly_rollups r
+        using drift
+        where drift.record_count = 0
+          and r.user_id = drift.user_id
+          and r.source_uid = drift.source_uid
+          and r.month = drift.month
+        returning 1
+    )
+    select (select count(*) from upserted) + (select count(*) from removed) into v_monthly;
+
+    return query select v_daily, v_monthly;
+end;
+$$;
+
+-- Range totals now read whole months from the monthly rollups and only the
+-- partial months at either edge from the daily rollups.
+create or replace function carbon_consumption_totals(
+    p_user_id bigint,
+    p_start_date date default null,
+    p_end_date date default null
+)
+returns table (total_amount double precision, record_count bigint)
+language sql
+stable
+as $$
+    with bounds as (
+        select
+            case
+                when p_start_date is null then '-infinity'::date
+                when p_start_date = date_trunc('month', p_start_date)::date then p_start_date
+                else (date_trunc('month', p_start_date) + interval '1 month')::date
+            end as full_from,
+            case
+                when p_end_date is null then 'infinity'::date
+                when (p_end_date + 1) = date_trunc('month', p_end_date + 1)::date then p_end_date + 1
+                else date_trunc('month', p_end_date)::date
+            end as full_until
+    ),
+    parts as (
+        select m.total_amount, m.record_count
+        from carbon_record_monthly_rollups m, bounds b
+        where m.user_id = p_user_id
+          and m.month >= b.full_from
+          and m.month < b.full_until
+        union all
+        select d.total_amount, d.record_count
+        from carbon_record_daily_rollups d, bounds b
+        where d.user_id = p_user_id
+          and (p_start_date is null or d.day >= p_start_date)
+          and (p_end_date is null or d.day <= p_end_date)
+          and not (d.day >= b.full_from and d.day < b.full_until)
+    )
+    select coalesce(sum(total_amount), 0)::double precision as total_amount,
+           coalesce(sum(record_count), 0)::bigint as record_count
+    from parts;
+$$;
+
+grant select on carbon_record_daily_rollups, carbon_record_monthly_rollups to anon, authenticated;
+revoke execute on function apply_carbon_rollup_deltas(jsonb) from public;
+revoke execute on function reconcile_carbon_rollups(bigint, date, date) from public;
+grant execute on function reconcile_carbon_rollups(bigint, date, date) to service_role;
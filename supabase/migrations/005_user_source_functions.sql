@@ -0,0 +1,91 @@
+-- Single round-trip user source management.
+-- add_source_to_user / remove_source_from_user resolve the user by email,
+-- upsert the profile and add or remove the profile source link in one call.
+-- The unique indexes below let concurrent requests rely on ON CONFLICT
+-- instead of racing check-then-insert sequences.
+
+create unique index if not exists user_profiles_user_id_key
+    on user_profiles (user_id);
+
+create unique index if not exists user_profile_sources_profile_source_key
+    on user_profile_sources (user_profile_id, carbon_source_uid);
+
+-- Returns {"status": <http status>, "error": ...} or
+-- {"status": 201, "user_id": ..., "profile_id": ..., "data": <user_profile_sources row>}
+create or replace function add_source_to_user(p_email text, p_source_uid text)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_user_id user_accounts.id%type;
+    v_profile_id user_profiles.id%type;
+    v_source_uid carbon_sources.uid%type;
+    v_link user_profile_sources%rowtype;
+begin
+    select id into v_user_id from user_accounts where email = p_email;
+    if not found then
+        return jsonb_build_object('status', 404, 'error', 'User not found');
+    end if;
+
+    select uid into v_source_uid from carbon_sources where uid::text = p_source_uid;
+    if not found then
+        return jsonb_build_object('status', 404, 'error', 'Source not found');
+    end if;
+
+    insert into user_profiles (user_id) values (v_user_id)
+    on conflict (user_id) do nothing
+    returning id into v_profile_id;
+    if v_profile_id is null then
+        select id into v_profile_id from user_profiles where user_id = v_user_id;
+    end if;
+
+    insert into user_profile_sources (user_profile_id, carbon_source_uid)
+    values (v_profile_id, v_source_uid)
+    on conflict (user_profile_id, carbon_source_uid) do nothing
+    returning * into v_link;
+    if not found then
+        return jsonb_build_object('status', 400, 'error', 'Source already added to user profile');
+    end if;
+
+    return jsonb_build_object(
+        'status', 201,
+        'user_id', v_user_id,
+        'profile_id', v_profile_id,
+        'data', to_jsonb(v_link)
+    );
+end;
+$$;
+
+-- Returns {"status": <http status>, "error": ...} or {"status": 200, "user_id": ..., "profile_id": ...}
+create or replace function remove_source_from_user(p_email text, p_source_uid text)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_user_id user_accounts.id%type;
+    v_profile_id user_profiles.id%type;
+begin
+    select a.id, p.id into v_user_id, v_profile_id
+    from user_accounts a
+    left join user_profiles p on p.user_id = a.id
+    where a.email = p_email;
+    if not found then
+        return jsonb_build_object('status', 404, 'error', 'User not found');
+    end if;
+    if v_profile_id is null then
+        return jsonb_build_object('status', 404, 'error', 'User profile not found');
+    end if;
+
+    delete from user_profile_sources
+    where user_profile_id = v_profile_id
+      and carbon_source_uid::text = p_source_uid;
+    if not found then
+        return jsonb_build_object('status', 404, 'error', 'Source not found in user profile');
+    end if;
+
+    return jsonb_build_object('status', 200, 'user_id', v_user_id, 'profile_id', v_profile_id);
+end;
+$$;
+
+grant execute on function add_source_to_user(text, text) to anon, authenticated;
+grant execute on function remove_source_from_user(text, text) to anon, authenticated;
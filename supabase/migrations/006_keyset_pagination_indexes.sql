@@ -0,0 +1,13 @@
+-- Indexes backing keyset pagination of the list endpoints.
+-- Each list is ordered by a (sort column, unique column) key and resumed with
+-- "(key) > (cursor)", so every page is a short range scan on one of these
+-- indexes no matter how deep the client pages.
+
+create index if not exists user_accounts_created_at_id_idx
+    on user_accounts (created_at, id);
+
+create index if not exists carbon_sources_created_at_uid_idx
+    on carbon_sources (created_at, uid);
+
+create index if not exists carbon_records_user_source_date_uid_idx
+    on carbon_records (user_id, source_uid, date, uid);
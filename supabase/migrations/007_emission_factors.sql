@@ -0,0 +1,75 @@
+-- Emission-factor registry.
+-- emission_factors holds per-source and per-category factors (kg CO2 per unit
+-- of activity) with validity date ranges, so factors can change without a deploy
+-- and historical footprints resolve to the factor that was valid at the time.
+-- catalog_versions holds a version stamp per catalog table, bumped by a statement
+-- trigger on every write; API processes cache the catalogs in memory and only
+-- reload them when the stamp moves.
+
+create table if not exists catalog_versions (
+    name text primary key,
+    version bigint not null default 1,
+    updated_at timestamptz not null default now()
+);
+
+create or replace function bump_catalog_version()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into catalog_versions (name) values (tg_argv[0])
+    on conflict (name) do update
+    set version = catalog_versions.version + 1,
+        updated_at = now();
+    return null;
+end;
+$$;
+
+-- Exactly one of source_uid (a factor for one source) or category (a factor for
+-- every source whose source_type matches) is set. valid_to is exclusive and a
+-- null bound is open-ended. source_uid is text so it matches carbon_sources.uid
+-- whichever type that column has.
+create table if not exists emission_factors (
+    id bigserial primary key,
+    source_uid text,
+    category text,
+    factor double precision not null check (factor >= 0),
+    unit text not null default 'unit',
+    valid_from date,
+    valid_to date,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now(),
+    check ((source_uid is null) <> (category is null)),
+    check (valid_to is null or valid_from is null or valid_to > valid_from)
+);
+
+drop trigger if exists emission_factors_bump_version on emission_factors;
+create trigger emission_factors_bump_version
+    after insert or update or delete or truncate on emission_factors
+    for each statement execute function bump_catalog_version('emission_factors');
+
+drop trigger if exists carbon_sources_bump_version on carbon_sources;
+create trigger carbon_sources_bump_version
+    after insert or update or delete or truncate on carbon_sources
+    for each statement execute function bump_catalog_version('carbon_sources');
+
+insert into catalog_versions (name)
+values ('emission_factors'), ('carbon_sources')
+on conflict (name) do nothing;
+
+-- Seed the category factors that used to be hard-coded in the API, plus any
+-- per-source factors already stored on carbon_sources
+insert into emission_factors (category, factor)
+select category, factor
+from (values ('Travel', 2.3), ('Dining & Shopping', 1.5), ('Utility & Bills', 0.8)) as defaults (category, factor)
+where not exists (select 1 from emission_factors);
+
+insert into emission_factors (source_uid, factor, unit)
+select cs.uid::text, cs.emission_factor, coalesce(cs.unit, 'unit')
+from carbon_sources cs
+where cs.emission_factor is not null
+  and not exists (select 1 from emission_factors ef where ef.source_uid = cs.uid::text);
+
+grant select on emission_factors, catalog_versions to anon, authenticated;
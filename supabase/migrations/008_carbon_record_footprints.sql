@@ -0,0 +1,35 @@
+-- Stored footprints for carbon records.
+-- footprint (kg CO2) and the emission_factor it was calculated with are written
+-- at ingestion and rewritten in bulk by the recalculate_footprints management
+-- command whenever emission factors change.
+
+alter table carbon_records add column if not exists footprint double precision;
+alter table carbon_records add column if not exists emission_factor double precision;
+
+-- Recalculation walks one source at a time in (date, uid) order
+create index if not exists carbon_records_source_date_uid_idx
+    on carbon_records (source_uid, date, uid);
+
+-- Rewrite footprints for a batch of records in one statement.
+-- p_rows is a JSON array of {"uid", "footprint", "emission_factor"}; rows whose
+-- values did not change are skipped. Returns the number of records updated.
+create or replace function update_carbon_record_footprints(p_rows jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+    v_updated integer;
+begin
+    update carbon_records c
+    set footprint = r.footprint,
+        emission_factor = r.emission_factor
+    from jsonb_populate_recordset(null::carbon_records, p_rows) r
+    where c.uid = r.uid
+      and (c.footprint is distinct from r.footprint
+           or c.emission_factor is distinct from r.emission_factor);
+    get diagnostics v_updated = row_count;
+    return v_updated;
+end;
+$$;
+
+grant execute on function update_carbon_record_footprints(jsonb) to anon, authenticated;
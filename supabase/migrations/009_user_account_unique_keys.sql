@@ -0,0 +1,9 @@
+-- Unique usernames and emails.
+-- Registration inserts the account directly and relies on these indexes to reject
+-- duplicates, so two concurrent signups cannot both take a name; the API maps the
+-- violation back to "Username already exists" / "Email already exists" from the
+-- index name. The names match the constraints Postgres creates for
+-- "username text unique", so this is a no-op where those already exist.
+
+create unique index if not exists user_accounts_username_key on user_accounts (username);
+create unique index if not exists user_accounts_email_key on user_accounts (email);
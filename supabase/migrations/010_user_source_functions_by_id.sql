@@ -0,0 +1,92 @@
+-- add_source_to_user / remove_source_from_user keyed by user id.
+-- Requests made with a session token act for the token's user id rather than the
+-- email it was issued for: the email can change (and be registered again by
+-- someone else) while the token is still valid. p_user_id takes precedence over
+-- p_email when it is given; calls without it behave as before.
+
+drop function if exists add_source_to_user(text, text);
+drop function if exists remove_source_from_user(text, text);
+
+-- Returns {"status": <http status>, "error": ...} or
+-- {"status": 201, "user_id": ..., "profile_id": ..., "data": <user_profile_sources row>}
+create or replace function add_source_to_user(p_email text, p_source_uid text, p_user_id bigint default null)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_user_id user_accounts.id%type;
+    v_profile_id user_profiles.id%type;
+    v_source_uid carbon_sources.uid%type;
+    v_link user_profile_sources%rowtype;
+begin
+    if p_user_id is not null then
+        select id into v_user_id from user_accounts where id = p_user_id;
+    else
+        select id into v_user_id from user_accounts where email = p_email;
+    end if;
+    if not found then
+        return jsonb_build_object('status', 404, 'error', 'User not found');
+    end if;
+
+    select uid into v_source_uid from carbon_sources where uid::text = p_source_uid;
+    if not found then
+        return jsonb_build_object('status', 404, 'error', 'Source not found');
+    end if;
+
+    insert into user_profiles (user_id) values (v_user_id)
+    on conflict (user_id) do nothing
+    returning id into v_profile_id;
+    if v_profile_id is null then
+        select id into v_profile_id from user_profiles where user_id = v_user_id;
+    end if;
+
+    insert into user_profile_sources (user_profile_id, carbon_source_uid)
+    values (v_profile_id, v_source_uid)
+    on conflict (user_profile_id, carbon_source_uid) do nothing
+    returning * into v_link;
+    if not found then
+        return jsonb_build_object('status', 400, 'error', 'Source already added to user profile');
+    end if;
+
+    return jsonb_build_object(
+        'status', 201,
+        'user_id', v_user_id,
+        'profile_id', v_profile_id,
+        'data', to_jsonb(v_link)
+    );
+end;
+$$;
+
+-- Returns {"status": <http status>, "error": ...} or {"status": 200, "user_id": ..., "profile_id": ...}
+create or replace function remove_source_from_user(p_email text, p_source_uid text, p_user_id bigint default null)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_user_id user_accounts.id%type;
+    v_profile_id user_profiles.id%type;
+begin
+    select a.id, p.id into v_user_id, v_profile_id
+    from user_accounts a
+    left join user_profiles p on p.user_id = a.id
+    where case when p_user_id is not null then a.id = p_user_id else a.email = p_email end;
+    if not found then
+        return jsonb_build_object('status', 404, 'error', 'User not found');
+    end if;
+    if v_profile_id is null then
+        return jsonb_build_object('status', 404, 'error', 'User profile not found');
+    end if;
+
+    delete from user_profile_sources
+    where user_profile_id = v_profile_id
+      and carbon_source_uid::text = p_source_uid;
+    if not found then
+        return jsonb_build_object('status', 404, 'error', 'Source not found in user profile');
+    end if;
+
+    return jsonb_build_object('status', 200, 'user_id', v_user_id, 'profile_id', v_profile_id);
+end;
+$$;
+
+grant execute on function add_source_to_user(text, text, bigint) to anon, authenticated;
+grant execute on function remove_source_from_user(text, text, bigint) to anon, authenticated;
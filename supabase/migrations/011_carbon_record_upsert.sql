@@ -0,0 +1,26 @@
+-- Owner-checked upsert of carbon records.
+-- Ingestion upserts records by uid. A plain "on conflict (uid) do update" would let a
+-- caller overwrite, or move to its own account, any record whose uid it sends, so
+-- existing records are only updated when they already belong to the same user.
+-- Returns the uids that were left alone because they belong to another user, as a
+-- JSON array (empty when every row was written).
+
+create or replace function upsert_carbon_records(p_rows jsonb)
+returns jsonb
+language sql
+as $$
+    with submitted as (
+        select uid, user_id, source_uid, amount, date, footprint, emission_factor
+        from jsonb_populate_recordset(null::carbon_records, p_rows)
+    ), written as (
+        insert into carbon_records (uid, user_id, source_uid, amount, date, footprint, emission_factor)
+        select uid, user_id, source_uid, amount, date, footprint, emission_factor from submitted
+        on conflict (uid) do update set source_uid = excluded.source_uid, amount = excluded.amount,
+            date = excluded.date, footprint = excluded.footprint, emission_factor = excluded.emission_factor
+        where carbon_records.user_id = excluded.user_id
+        returning uid
+    )
+    select coalesce(jsonb_agg(uid), '[]'::jsonb) from submitted where uid not in (select uid from written);
+$$;
+
+grant execute on function upsert_carbon_records(jsonb) to anon, authenticated;
@@ -0,0 +1,33 @@
+-- Server-side buckets for the carbon consumption series endpoint.
+-- Selecting the daily rollups directly returns one row per source per day, which
+-- PostgREST cuts off at its max-rows limit (1000 by default) without an error; a
+-- year with 20 sources is already ~7300 rows. This sums the rollups per day, week
+-- (starting Monday) or month, and per source when asked, and returns the buckets as
+-- a single JSON array so the response is never truncated.
+
+create or replace function carbon_consumption_series(
+    p_user_id bigint,
+    p_start_date date,
+    p_end_date date,
+    p_bucket text default 'day',
+    p_split_by_source boolean default false
+)
+returns jsonb
+language sql
+stable
+as $$
+    select coalesce(jsonb_agg(to_jsonb(buckets) order by period_start, source_uid), '[]'::jsonb)
+    from (
+        select date_trunc(p_bucket, day::timestamp)::date as period_start,
+               case when p_split_by_source then source_uid end as source_uid,
+               sum(total_amount) as total_amount,
+               sum(record_count) as record_count
+        from carbon_record_daily_rollups
+        where user_id = p_user_id
+          and day >= p_start_date
+          and day <= p_end_date
+        group by 1, 2
+    ) buckets;
+$$;
+
+grant execute on function carbon_consumption_series(bigint, date, date, text, boolean) to anon, authenticated;
@@ -0,0 +1,8 @@
+-- Only the service role may rewrite stored footprints.
+-- 008 granted update_carbon_record_footprints to anon and authenticated, which let any
+-- API key holder set the footprint and emission factor of any user's records. Like
+-- reconcile_carbon_rollups in 004, it is a maintenance function for the
+-- recalculate_footprints command, which runs with the service role key.
+
+revoke execute on function update_carbon_record_footprints(jsonb) from public, anon, authenticated;
+grant execute on function update_carbon_record_footprints(jsonb) to service_role;